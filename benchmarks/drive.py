@@ -0,0 +1,181 @@
+"""
+Drive load against a running API and record latency percentiles and throughput per route and concurrency level.
+
+Request parameters (addresses, coordinates, time windows) are sampled from a dataset written by generate.py, so that
+consecutive requests do not all hit the same cache entry. Results are written to results/ and can be compared across runs.
+
+    python drive.py --base-url http://localhost:8000 --data data --concurrency 1,8,32 --duration 30 --label baseline
+    python drive.py --compare results/20220101-000000-baseline.json results/20220102-000000-rollups.json
+"""
+import argparse
+import os
+import random
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import h3
+import numpy as np
+import orjson
+import requests
+
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+SAMPLE_SIZE = 10000
+# the API answers invalid params and empty results with 200 and a {"Message": ...} body, which ORJSONResponse writes
+# without spaces
+MESSAGE_PREFIX = b'{"Message":'
+
+
+class Samples:
+    """Addresses, coordinates and time windows to build requests from."""
+
+    def __init__(self, data: str):
+        with open(os.path.join(data, 'manifest.json'), 'rb') as f:
+            manifest = orjson.loads(f.read())
+        self.min_time, self.max_time = manifest['min_time'], manifest['max_time']
+        self.accounts = self._read(os.path.join(data, 'accounts.jsonl'), lambda doc: doc['_key'])
+        self.hotspots = self._read(os.path.join(data, 'hotspots.jsonl'),
+                                   lambda doc: (doc['address'], doc['geo_location']['coordinates']))
+
+    @staticmethod
+    def _read(path: str, extract) -> list:
+        with open(path, 'rb') as f:
+            return [extract(orjson.loads(line)) for _, line in zip(range(SAMPLE_SIZE), f)]
+
+    def time_window(self, rng: random.Random) -> dict:
+        # windows from a day up to the whole dataset, ending anywhere in it
+        span = rng.randint(86400, self.max_time - self.min_time)
+        max_time = rng.randint(self.min_time + span, self.max_time)
+        return {'min_time': max_time - span, 'max_time': max_time}
+
+
+# route name -> function of (samples, rng) returning (method, path, query params, JSON body)
+ROUTES = {
+    'payments_from': lambda s, rng: ('GET', f'/payments/{rng.choice(s.accounts)}/from', {'limit': 100, **s.time_window(rng)},
+                                     None),
+    'payments_totals': lambda s, rng: ('GET', '/payments/totals', {'limit': 100, **s.time_window(rng)}, None),
+    'payments_payers': lambda s, rng: ('GET', '/payments/payers', {'limit': 100, **s.time_window(rng)}, None),
+    'payers_graph': lambda s, rng: ('GET', '/payments/payers/graph', {'limit': 10, **s.time_window(rng)}, None),
+    'payment_traversal': lambda s, rng: ('GET', f'/payments/{rng.choice(s.accounts)}/traversal', {'depth': 2, 'fan_out': 10},
+                                         None),
+    'payments_batch_from': lambda s, rng: ('POST', '/payments/batch/from', {'limit': 10},
+                                           {'addresses': rng.sample(s.accounts, 100)}),
+    'hotspot_outbound': lambda s, rng: ('GET', f'/hotspots/{rng.choice(s.hotspots)[0]}/outbound', {}, None),
+    'hotspot_inbound': lambda s, rng: ('GET', f'/hotspots/{rng.choice(s.hotspots)[0]}/inbound', {}, None),
+    'coords_graph': lambda s, rng: ('GET', '/hotspots/coords/graph',
+                                    dict(zip(('lon', 'lat'), rng.choice(s.hotspots)[1]), limit=10), None),
+    'hex_graph': lambda s, rng: ('GET', '/hotspots/hex/graph', {'hex': h3.geo_to_h3(*reversed(rng.choice(s.hotspots)[1]), 6)},
+                                 None),
+    'receipts': lambda s, rng: ('GET', '/hotspots/receipts', {'address': rng.choice(s.hotspots)[0], 'limit': 100}, None),
+    'clusters': lambda s, rng: ('GET', '/hotspots/clusters', {'n_clusters': 500}, None),
+}
+
+
+def run_level(base_url: str, samples: Samples, route: str, concurrency: int, duration: float, warmup: float,
+              seed: int) -> dict:
+    """
+    Hammer one route from `concurrency` threads for `duration` seconds, after `warmup` seconds that are not recorded.
+
+    :return: Dict of request counts, latency percentiles in ms and throughput in requests per second. Failed requests are
+        counted under errors, and 200 responses that only hold a {"Message": ...} under messages. Both are included in the
+        latencies.
+    """
+    latencies, errors, messages = [], 0, 0
+    lock = threading.Lock()
+    started_at = time.perf_counter()
+    record_from, stop_at = started_at + warmup, started_at + warmup + duration
+
+    def worker(i: int):
+        nonlocal errors, messages
+        rng = random.Random(seed * 1000 + i)
+        with requests.Session() as session:
+            while True:
+                method, path, params, body = ROUTES[route](samples, rng)
+                request_started_at = time.perf_counter()
+                if request_started_at >= stop_at:
+                    return
+                try:
+                    response = session.request(method, base_url + path, params=params, json=body)
+                    content = response.content
+                    ok = response.status_code < 400
+                except requests.RequestException:
+                    content, ok = b'', False
+                finished_at = time.perf_counter()
+                if request_started_at >= record_from:
+                    with lock:
+                        latencies.append(finished_at - request_started_at)
+                        errors += not ok
+                        messages += ok and content.startswith(MESSAGE_PREFIX)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(worker, range(concurrency)))
+    elapsed = max(time.perf_counter() - record_from, 1e-9)
+    ms = np.array(latencies) * 1000
+    return {
+        'route': route,
+        'concurrency': concurrency,
+        'requests': len(latencies),
+        'errors': errors,
+        'messages': messages,
+        'p50_ms': float(np.percentile(ms, 50)) if len(ms) else None,
+        'p95_ms': float(np.percentile(ms, 95)) if len(ms) else None,
+        'p99_ms': float(np.percentile(ms, 99)) if len(ms) else None,
+        'throughput_rps': len(latencies) / elapsed
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline_path: str, candidate_path: str):
+    runs = []
+    for path in (baseline_path, candidate_path):
+        with open(path, 'rb') as f:
+            runs.append({(row['route'], row['concurrency']): row for row in orjson.loads(f.read())['results']})
+    baseline, candidate = runs
+    print(f"{'route':<22}{'conc':>5}  {'p50 ms':>17}  {'p95 ms':>17}  {'p99 ms':>17}  {'rps':>17}")
+    for key in sorted(baseline.keys() & candidate.keys()):
+        cells = []
+        for metric in ('p50_ms', 'p95_ms', 'p99_ms', 'throughput_rps'):
+            before, after = baseline[key][metric], candidate[key][metric]
+            change = f'{(after - before) / before * 100:+.0f}%' if before and after is not None else ''
+            cells.append(f'{after or 0:>10.1f} {change:>6}')
+        print(f'{key[0]:<22}{key[1]:>5}  ' + '  '.join(cells))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the API routes at several concurrency levels.')
+    parser.add_argument('--base-url', default='http://localhost:8000')
+    parser.add_argument('--data', default='data', help='directory written by generate.py, to sample request parameters from')
+    parser.add_argument('--routes', default=','.join(ROUTES), help='comma-separated subset of: ' + ', '.join(ROUTES))
+    parser.add_argument('--concurrency', default='1,8,32', help='comma-separated concurrency levels')
+    parser.add_argument('--duration', type=float, default=30, help='seconds to record per route and concurrency level')
+    parser.add_argument('--warmup', type=float, default=5, help='seconds to run before recording')
+    parser.add_argument('--label', default='run', help='suffix of the results file')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'CANDIDATE'),
+                        help='compare two results files instead of running')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+    else:
+        samples = Samples(args.data)
+        results = []
+        for route in args.routes.split(','):
+            for concurrency in (int(c) for c in args.concurrency.split(',')):
+                result = run_level(args.base_url, samples, route, concurrency, args.duration, args.warmup, args.seed)
+                print(orjson.dumps(result).decode())
+                results.append(result)
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        path = os.path.join(RESULTS_DIR, f"{datetime.utcnow().strftime('%Y%m%d-%H%M%S')}-{args.label}.json")
+        with open(path, 'wb') as f:
+            f.write(orjson.dumps({'label': args.label, 'commit': git_commit(), 'started_at': datetime.utcnow().isoformat(),
+                                  'args': vars(args), 'results': results}, option=orjson.OPT_INDENT_2))
+        print('results written to', path)
@@ -0,0 +1,132 @@
+"""
+Generate a synthetic Helium dataset (accounts, payments, hotspots, witnesses) as JSON lines files, ready for load.py.
+
+Degree distributions are power-law: a few accounts (exchanges, large fleets) take part in most payments, a few hotspots are
+challenged far more than the rest, and hotspots are concentrated in a long tail of cities. Witness edges stay within a city.
+
+    python generate.py --out data --payments 1000000 --hotspots 500000 --witnesses 20000000
+"""
+import argparse
+import os
+import time
+import numpy as np
+import orjson
+
+
+CHUNK_SIZE = 1000000
+
+
+def power_law_weights(rng: np.random.Generator, n: int, alpha: float) -> np.ndarray:
+    """
+    Sampling probabilities with a Pareto tail, so that degrees drawn from them follow a power law.
+
+    :param rng: The random generator.
+    :param n: The number of items.
+    :param alpha: The Pareto shape. Smaller is more skewed.
+    :return: Probabilities summing to 1.
+    """
+    weights = rng.pareto(alpha, n) + 1
+    return weights / weights.sum()
+
+
+def account_address(i: int) -> str:
+    return f'1acct{i:045d}'
+
+
+def hotspot_address(i: int) -> str:
+    return f'1hspt{i:045d}'
+
+
+def write_lines(path: str, docs):
+    with open(path, 'ab') as f:
+        f.write(b''.join(orjson.dumps(doc) + b'\n' for doc in docs))
+
+
+def generate_accounts(out: str, n_accounts: int):
+    for start in range(0, n_accounts, CHUNK_SIZE):
+        write_lines(os.path.join(out, 'accounts.jsonl'),
+                    ({'_key': account_address(i)} for i in range(start, min(start + CHUNK_SIZE, n_accounts))))
+
+
+def generate_payments(out: str, rng: np.random.Generator, n_accounts: int, n_payments: int, min_time: int, max_time: int,
+                      alpha: float):
+    payer_p, payee_p = power_law_weights(rng, n_accounts, alpha), power_law_weights(rng, n_accounts, alpha)
+    for start in range(0, n_payments, CHUNK_SIZE):
+        size = min(CHUNK_SIZE, n_payments - start)
+        payers, payees = rng.choice(n_accounts, size, p=payer_p), rng.choice(n_accounts, size, p=payee_p)
+        amounts = np.round(rng.lognormal(2, 2, size), 8)
+        times = rng.integers(min_time, max_time, size)
+        write_lines(os.path.join(out, 'payments.jsonl'), (
+            {'_from': f'accounts/{account_address(payer)}', '_to': f'accounts/{account_address(payee)}',
+             'amount': float(amount), 'time': int(t)}
+            for payer, payee, amount, t in zip(payers, payees, amounts, times) if payer != payee))
+
+
+def generate_hotspots(out: str, rng: np.random.Generator, n_hotspots: int, n_cities: int, alpha: float) -> np.ndarray:
+    """
+    :return: The first hotspot id of every city, plus n_hotspots at the end. Hotspots of a city have consecutive ids.
+    """
+    city_sizes = rng.multinomial(n_hotspots, power_law_weights(rng, n_cities, alpha))
+    city_starts = np.concatenate([[0], np.cumsum(city_sizes)])
+    city_lats, city_lons = rng.uniform(-50, 60, n_cities), rng.uniform(-125, 150, n_cities)
+    cities = np.repeat(np.arange(n_cities), city_sizes)
+    # hotspots spread a few km around their city center
+    lats = np.round(city_lats[cities] + rng.normal(0, 0.05, n_hotspots), 6)
+    lons = np.round(city_lons[cities] + rng.normal(0, 0.05, n_hotspots), 6)
+    for start in range(0, n_hotspots, CHUNK_SIZE):
+        write_lines(os.path.join(out, 'hotspots.jsonl'), (
+            {'_key': hotspot_address(i), 'address': hotspot_address(i), 'name': f'synthetic-hotspot-{i}',
+             'owner': account_address(i % 1000),
+             'geo_location': {'type': 'Point', 'coordinates': [float(lons[i]), float(lats[i])]}}
+            for i in range(start, min(start + CHUNK_SIZE, n_hotspots))))
+    return city_starts
+
+
+def generate_witnesses(out: str, rng: np.random.Generator, city_starts: np.ndarray, n_witnesses: int, min_time: int,
+                       max_time: int, alpha: float):
+    n_hotspots = int(city_starts[-1])
+    challengee_p = power_law_weights(rng, n_hotspots, alpha)
+    city_of = np.repeat(np.arange(len(city_starts) - 1), np.diff(city_starts))
+    for start in range(0, n_witnesses, CHUNK_SIZE):
+        size = min(CHUNK_SIZE, n_witnesses - start)
+        challengees = rng.choice(n_hotspots, size, p=challengee_p)
+        # each witness is a random hotspot from the challengee's city
+        cities = city_of[challengees]
+        city_sizes = city_starts[cities + 1] - city_starts[cities]
+        witnesses = city_starts[cities] + (rng.random(size) * city_sizes).astype(np.int64)
+        snrs = np.round(rng.normal(0, 8, size), 1)
+        signals = rng.integers(-135, -60, size)
+        times = rng.integers(min_time, max_time, size)
+        write_lines(os.path.join(out, 'witnesses.jsonl'), (
+            {'_from': f'hotspots/{hotspot_address(c)}', '_to': f'hotspots/{hotspot_address(w)}', 'gateway': hotspot_address(w),
+             'snr': float(snr), 'signal': int(signal), 'time': int(t)}
+            for c, w, snr, signal, t in zip(challengees, witnesses, snrs, signals, times) if c != w))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate a synthetic Helium dataset with power-law degree distributions.')
+    parser.add_argument('--out', default='data', help='directory to write the .jsonl files to')
+    parser.add_argument('--accounts', type=int, default=100000)
+    parser.add_argument('--payments', type=int, default=1000000)
+    parser.add_argument('--hotspots', type=int, default=500000)
+    parser.add_argument('--cities', type=int, default=5000)
+    parser.add_argument('--witnesses', type=int, default=20000000)
+    parser.add_argument('--days', type=int, default=180, help='spread payments and receipts over this many days before now')
+    parser.add_argument('--alpha', type=float, default=1.2, help='Pareto shape of the degree distributions')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    os.makedirs(args.out, exist_ok=True)
+    for name in ('accounts', 'payments', 'hotspots', 'witnesses'):
+        if os.path.exists(os.path.join(args.out, f'{name}.jsonl')):
+            os.remove(os.path.join(args.out, f'{name}.jsonl'))
+    rng = np.random.default_rng(args.seed)
+    max_time = int(time.time())
+    min_time = max_time - args.days * 86400
+
+    generate_accounts(args.out, args.accounts)
+    generate_payments(args.out, rng, args.accounts, args.payments, min_time, max_time, args.alpha)
+    city_starts = generate_hotspots(args.out, rng, args.hotspots, args.cities, args.alpha)
+    generate_witnesses(args.out, rng, city_starts, args.witnesses, min_time, max_time, args.alpha)
+    with open(os.path.join(args.out, 'manifest.json'), 'wb') as f:
+        f.write(orjson.dumps({**vars(args), 'min_time': min_time, 'max_time': max_time}, option=orjson.OPT_INDENT_2))
@@ -0,0 +1,71 @@
+"""
+Measure how long it takes to import the API, i.e. the cold start of every worker process and of the test client.
+
+Reports the cumulative import time of each project module and of the heaviest third-party packages, from `python -X
+importtime`. Exits with status 1 if the total exceeds the budget, or if a heavy optional dependency is imported eagerly again.
+
+    python import_time.py --budget-ms 1500
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+
+APP_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'helium_arango_http')
+# dependencies that only some routes or background jobs need, and that must be imported on first use
+LAZY_MODULES = ('sklearn', 'scipy', 'h3', 'redis', 'pyarrow', 'msgpack')
+
+
+def import_times(module: str) -> dict:
+    """
+    Import a module in a fresh interpreter.
+
+    :param module: The module to import, from the app directory.
+    :return: Dict of every imported module name -> cumulative import time in microseconds.
+    """
+    stderr = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], cwd=APP_DIR,
+                            stderr=subprocess.PIPE, stdout=subprocess.DEVNULL, check=True).stderr.decode()
+    times = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def project_modules() -> set:
+    return {name[:-3] for name in os.listdir(APP_DIR) if name.endswith('.py')}
+
+
+def report(runs: list, module: str, top: int):
+    median = {name: statistics.median(run[name] for run in runs if name in run) for name in runs[0]}
+    print(f'{module}: {median[module] / 1000:.0f} ms (median of {len(runs)} runs)\n')
+    print('project modules')
+    for name in sorted(project_modules() & median.keys(), key=median.get, reverse=True):
+        print(f'  {name:<28}{median[name] / 1000:>8.1f} ms')
+    print('\nheaviest third-party packages')
+    packages = [name for name in runs[0] if '.' not in name and name not in project_modules() and name != module]
+    for name in sorted(packages, key=median.get, reverse=True)[:top]:
+        print(f'  {name:<28}{median[name] / 1000:>8.1f} ms')
+    return median[module]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Report import time per module, and check it against a budget.')
+    parser.add_argument('--module', default='server')
+    parser.add_argument('--runs', type=int, default=5, help='report the median of this many fresh interpreters')
+    parser.add_argument('--top', type=int, default=10, help='the number of third-party packages to list')
+    parser.add_argument('--budget-ms', type=float, help='fail if the median import time exceeds this many milliseconds')
+    args = parser.parse_args()
+
+    runs = [import_times(args.module) for _ in range(args.runs)]
+    total = report(runs, args.module, args.top)
+    failures = [f'{name} is imported eagerly' for name in LAZY_MODULES if name in runs[0]]
+    if args.budget_ms is not None and total / 1000 > args.budget_ms:
+        failures.append(f'import time {total / 1000:.0f} ms exceeds the budget of {args.budget_ms:.0f} ms')
+    for failure in failures:
+        print('FAIL:', failure)
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,73 @@
+"""
+Load a dataset written by generate.py into an ArangoDB instance, e.g. the one in docker-compose.benchmark.yml.
+
+Collections and indexes mirror what helium-arango-etl creates. Existing collections are truncated first.
+
+    docker-compose -f docker-compose.benchmark.yml up -d arangodb
+    python load.py --data data --url http://localhost:8529 --database helium_benchmark
+"""
+import argparse
+import os
+import requests
+from pyArango.connection import Connection
+
+
+COLLECTIONS = {'accounts': 'Collection', 'hotspots': 'Collection', 'payments': 'Edges', 'witnesses': 'Edges'}
+IMPORT_LINES = 100000
+
+
+def ensure_collections(conn: Connection, database_name: str):
+    if not conn.hasDatabase(database_name):
+        conn.createDatabase(name=database_name)
+    database = conn[database_name]
+    for name, class_name in COLLECTIONS.items():
+        if database.hasCollection(name):
+            database[name].truncate()
+        else:
+            database.createCollection(className=class_name, name=name)
+    database['payments'].ensurePersistentIndex(['time'], sparse=False)
+    database['witnesses'].ensurePersistentIndex(['time'], sparse=False)
+    database['hotspots'].ensurePersistentIndex(['address'], sparse=False)
+    return database
+
+
+def ensure_geo_index(url: str, auth: tuple, database_name: str):
+    # geo_location is GeoJSON ([lon, lat]), which needs the geoJson flag that pyArango's ensureGeoIndex does not pass through
+    response = requests.post(f'{url}/_db/{database_name}/_api/index', params={'collection': 'hotspots'},
+                             json={'type': 'geo', 'fields': ['geo_location'], 'geoJson': True}, auth=auth)
+    response.raise_for_status()
+
+
+def import_file(url: str, auth: tuple, database_name: str, collection: str, path: str) -> int:
+    """
+    Bulk import a JSON lines file through the Arango import API, IMPORT_LINES documents per request.
+
+    :return: The number of documents created.
+    """
+    created = 0
+    with open(path, 'rb') as f, requests.Session() as session:
+        while True:
+            lines = [line for _, line in zip(range(IMPORT_LINES), f)]
+            if not lines:
+                return created
+            response = session.post(f'{url}/_db/{database_name}/_api/import',
+                                    params={'collection': collection, 'type': 'documents'}, data=b''.join(lines), auth=auth)
+            response.raise_for_status()
+            created += response.json()['created']
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load a synthetic dataset into ArangoDB.')
+    parser.add_argument('--data', default='data', help='directory written by generate.py')
+    parser.add_argument('--url', default=os.getenv('ARANGO_URL', 'http://localhost:8529'))
+    parser.add_argument('--username', default=os.getenv('ARANGO_USERNAME', 'root'))
+    parser.add_argument('--password', default=os.getenv('ARANGO_PASSWORD', ''))
+    parser.add_argument('--database', default='helium_benchmark')
+    args = parser.parse_args()
+
+    conn = Connection(arangoURL=args.url, username=args.username, password=args.password)
+    ensure_collections(conn, args.database)
+    ensure_geo_index(args.url, (args.username, args.password), args.database)
+    for name in COLLECTIONS:
+        path = os.path.join(args.data, f'{name}.jsonl')
+        print(name, import_file(args.url, (args.username, args.password), args.database, name, path))
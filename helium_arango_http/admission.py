@@ -0,0 +1,131 @@
+"""
+Admission control: bounds on how much work a single request may ask for, and on how many expensive requests run at once.
+
+Route parameters that scale the cost of a query (limit, n_clusters, batch_size and the span of the time window) are checked
+against a maximum before anything runs. Routes wrapped in @limited get a per-route cap on concurrent requests, with a short
+bounded queue behind it. A slot is held while the route runs its queries, and for streamed responses until the stream ends.
+Other responses are serialized and sent after the slot is released, which is bounded by the cost params. Requests beyond the
+queue are shed with 429 and Retry-After instead of piling up. Separately, query_executor.run_query sheds with 503 once too many
+queries are waiting for a query worker, and every Arango cursor carries a memoryLimit and maxRuntime.
+
+Limits are per worker process.
+"""
+import asyncio
+import os
+import weakref
+from functools import wraps
+from typing import Optional
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from query_executor import OverloadedError
+from time_windows import resolve_max_time
+
+
+MAX_LIMIT = int(os.getenv('MAX_LIMIT', 10000))
+MAX_N_CLUSTERS = int(os.getenv('MAX_N_CLUSTERS', 2000))
+MAX_BATCH_SIZE = int(os.getenv('MAX_BATCH_SIZE', 10000))
+# 0 for no maximum. Most routes default to min_time=0, i.e. the whole chain, so this is opt-in
+MAX_TIME_SPAN_SECONDS = int(os.getenv('MAX_TIME_SPAN_SECONDS', 0))
+ROUTE_CONCURRENCY = int(os.getenv('ROUTE_CONCURRENCY', 4))
+# requests allowed to wait for a slot of a route, beyond which they are shed
+ROUTE_QUEUE_DEPTH = int(os.getenv('ROUTE_QUEUE_DEPTH', 16))
+
+
+def invalid_cost(limit: int = None, n_clusters: int = None, batch_size: int = None, min_time: int = None,
+                 max_time: int = None) -> Optional[str]:
+    if limit is not None and not 1 <= limit <= MAX_LIMIT:
+        return f'limit must be between 1 and {MAX_LIMIT}'
+    if n_clusters is not None and not 1 <= n_clusters <= MAX_N_CLUSTERS:
+        return f'n_clusters must be between 1 and {MAX_N_CLUSTERS}'
+    if batch_size is not None and not 1 <= batch_size <= MAX_BATCH_SIZE:
+        return f'batch_size must be between 1 and {MAX_BATCH_SIZE}'
+    if MAX_TIME_SPAN_SECONDS and min_time is not None and resolve_max_time(max_time) - min_time > MAX_TIME_SPAN_SECONDS:
+        return f'max_time - min_time must be at most {MAX_TIME_SPAN_SECONDS} seconds'
+    return None
+
+
+COST_PARAMS = ('limit', 'n_clusters', 'batch_size', 'min_time', 'max_time')
+
+
+class RouteLimiter:
+    def __init__(self, concurrency: int, queue_depth: int):
+        """
+        Cap the number of requests of a route that run at once.
+
+        :param concurrency: The max number of requests running.
+        :param queue_depth: The max number of requests waiting for one of them to finish.
+        """
+        self.concurrency = concurrency
+        self.queue_depth = queue_depth
+        # running + waiting
+        self.admitted = 0
+        # created on first use, so that it belongs to the event loop of the worker
+        self._semaphore = None
+
+    async def acquire(self):
+        if self.admitted >= self.concurrency + self.queue_depth:
+            raise OverloadedError(429, 'Too many concurrent requests for this route')
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        self.admitted += 1
+        try:
+            await self._semaphore.acquire()
+        except BaseException:
+            self.admitted -= 1
+            raise
+
+    def release(self):
+        self._semaphore.release()
+        self.admitted -= 1
+
+
+def hold_until_sent(response: StreamingResponse, limiter: RouteLimiter):
+    """
+    Release the slot of a streamed response once its body has been sent, or abandoned, e.g. when the client disconnects.
+
+    :param response: The streamed response.
+    :param limiter: The limiter the slot was acquired from.
+    """
+    async def body():
+        try:
+            async for chunk in chunks:
+                yield chunk
+        finally:
+            release()
+
+    chunks = response.body_iterator
+    response.body_iterator = body()
+    # also releases the slot if the body is never iterated, e.g. when the response is dropped before it starts. Only the
+    # first call has an effect
+    release = weakref.finalize(response.body_iterator, limiter.release)
+
+
+def limited(concurrency: int = ROUTE_CONCURRENCY, queue_depth: int = ROUTE_QUEUE_DEPTH):
+    """
+    Check the cost params of a route (see invalid_cost) and cap its concurrency. Goes below @cached, so that cache hits skip
+    both. The slot is released once the route returns, before the (cost-bounded) body is serialized by @cached or FastAPI,
+    which keeps the value cacheable. Streamed responses hold their slot until the stream ends.
+
+    :param concurrency: The max number of requests of the route running at once.
+    :param queue_depth: The max number of requests waiting for a slot. Requests beyond that raise OverloadedError (429).
+    """
+    def decorator(func):
+        limiter = RouteLimiter(concurrency, queue_depth)
+
+        @wraps(func)
+        async def wrapper(**kwargs):
+            message = invalid_cost(**{name: kwargs[name] for name in COST_PARAMS if name in kwargs})
+            if message:
+                return ORJSONResponse({'Message': message})
+            await limiter.acquire()
+            try:
+                response = await func(**kwargs)
+            except BaseException:
+                limiter.release()
+                raise
+            if isinstance(response, StreamingResponse):
+                hold_until_sent(response, limiter)
+            else:
+                limiter.release()
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,249 @@
+"""
+Graph analytics over the payments and witness graphs: PageRank, degree and weighted degree (strength) centrality, and weakly
+connected components.
+
+The edges in a time window are aggregated per (from, to) pair in AQL and streamed into a scipy sparse matrix, so every metric
+is a few vectorized passes over it. Both ends of a window are floored to ANALYTICS_TIME_BUCKET_SECONDS, so that nearby windows
+share results, and the window that was actually used is reported with the metrics. Results are kept per graph, weight and
+window, with every metric pre-sorted so that any top-k is a slice, in an LRU of at most ANALYTICS_CACHE_MAX_BYTES per worker.
+Historical windows (see time_windows.is_historical) are kept for time_windows.HISTORICAL_CACHE_TTL. Others are kept until the
+graph's collection is written to (see change_feed.py), or for ANALYTICS_CACHE_TTL if its revision is unknown.
+"""
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+import numpy as np
+from pyArango.database import Database
+from pyArango.theExceptions import AQLFetchError
+from arango_queries import register_query, run_registered, iter_registered, EXAMPLE_TIME_WINDOW
+from traversals import HOTSPOT_IDS
+from time_windows import is_historical, resolve_max_time, HISTORICAL_CACHE_TTL
+from change_feed import version, live_ttl, is_current
+
+
+ANALYTICS_CACHE_TTL = int(os.getenv('ANALYTICS_CACHE_TTL', 600))
+# results hold a few arrays and the _key of every node of the graph, e.g. ~200 MB for a million nodes
+ANALYTICS_CACHE_MAX_BYTES = int(os.getenv('ANALYTICS_CACHE_MAX_BYTES', 512 * 2 ** 20))
+ANALYTICS_TIME_BUCKET_SECONDS = int(os.getenv('ANALYTICS_TIME_BUCKET_SECONDS', 3600))
+EDGE_BATCH_SIZE = 10000
+PAGERANK_DAMPING = 0.85
+PAGERANK_TOLERANCE = 1e-6
+PAGERANK_MAX_ITERATIONS = 100
+
+METRICS = ('pagerank', 'in_degree', 'out_degree', 'in_strength', 'out_strength')
+
+PAYMENT_EDGES = register_query('payment_edges_in_window', """for payment in payments
+    filter payment.time > @min_time and payment.time < @max_time
+    collect from = payment._from, to = payment._to aggregate amount = SUM(payment.amount), count = LENGTH(1)
+    return [last(split(from,'/')), last(split(to,'/')), amount, count]""", EXAMPLE_TIME_WINDOW)
+
+# snr is averaged in linear scale, so that the weight of every edge is positive
+WITNESS_EDGES = register_query('witness_edges_in_window', """for witness in witnesses
+    filter witness.time > @min_time and witness.time < @max_time
+    collect from = witness._from, to = witness._to
+        aggregate snr = AVERAGE(witness.snr == null ? null : POW(10, witness.snr / 10)), count = LENGTH(1)
+    return [last(split(from,'/')), last(split(to,'/')), snr, count]""", EXAMPLE_TIME_WINDOW)
+
+# graph -> (edge query, weight name -> column of the edge rows)
+GRAPHS = {
+    'payments': (PAYMENT_EDGES, {'amount': 2, 'count': 3}),
+    'witnesses': (WITNESS_EDGES, {'snr': 2, 'count': 3})
+}
+
+
+def pagerank(matrix, damping: float = PAGERANK_DAMPING) -> np.ndarray:
+    """
+    Weighted PageRank by power iteration. The rank of nodes without outgoing edges is spread evenly over every node.
+
+    :param matrix: scipy CSR matrix of edge weights, rows are sources.
+    :param damping: The probability of following an edge rather than jumping to a random node.
+    :return: The PageRank of every node, summing to 1.
+    """
+    from scipy import sparse
+    n = matrix.shape[0]
+    out_strength = np.asarray(matrix.sum(axis=1)).ravel()
+    dangling = out_strength == 0
+    inverse = np.divide(1.0, out_strength, out=np.zeros(n), where=~dangling)
+    transition = (sparse.diags(inverse) @ matrix).T.tocsr()
+    rank = np.full(n, 1.0 / n)
+    for _ in range(PAGERANK_MAX_ITERATIONS):
+        updated = damping * (transition @ rank + rank[dangling].sum() / n) + (1 - damping) / n
+        converged = np.abs(updated - rank).sum() < PAGERANK_TOLERANCE
+        rank = updated
+        if converged:
+            break
+    return rank
+
+
+class GraphMetrics:
+    def __init__(self, keys: np.ndarray, src: np.ndarray, dst: np.ndarray, weights: np.ndarray, window: tuple = None):
+        """
+        Compute every metric of a graph.
+
+        :param keys: The _key of each node id.
+        :param src: Node id of the source of each edge.
+        :param dst: Node id of the target of each edge.
+        :param weights: Weight of each edge. Must be non-negative.
+        :param window: (optional) the (min_time, max_time) the edges were aggregated over.
+        """
+        from scipy import sparse
+        from scipy.sparse.csgraph import connected_components
+        n = len(keys)
+        matrix = sparse.csr_matrix((weights, (src, dst)), shape=(n, n))
+        self.keys = keys
+        self.key_bytes = keys.nbytes + sum(map(sys.getsizeof, keys))
+        self.edges = len(src)
+        self.window = window
+        self.created_at = time.time()
+        self.values = {
+            'pagerank': pagerank(matrix),
+            'in_degree': np.bincount(dst, minlength=n).astype(np.float64),
+            'out_degree': np.bincount(src, minlength=n).astype(np.float64),
+            'in_strength': np.bincount(dst, weights=weights, minlength=n),
+            'out_strength': np.bincount(src, weights=weights, minlength=n)
+        }
+        self.orders = {metric: np.argsort(-values, kind='stable') for metric, values in self.values.items()}
+        self.component_count, self.components = connected_components(matrix, directed=True, connection='weak')
+        self.component_sizes = np.bincount(self.components)
+        self._ids = None
+
+    def memory_bytes(self) -> int:
+        arrays = [*self.values.values(), *self.orders.values(), self.components, self.component_sizes]
+        total = self.key_bytes + sum(array.nbytes for array in arrays)
+        if self._ids is not None:
+            total += sys.getsizeof(self._ids)
+        return total
+
+    def row(self, i: int) -> dict:
+        row = {'_key': self.keys[i], **{metric: float(values[i]) for metric, values in self.values.items()}}
+        row['component'] = int(self.components[i])
+        row['component_size'] = int(self.component_sizes[self.components[i]])
+        return row
+
+    def top(self, metric: str, k: int) -> list:
+        return [self.row(i) for i in self.orders[metric][:k]]
+
+    def node(self, key: str) -> Optional[dict]:
+        if self._ids is None:
+            self._ids = {key: i for i, key in enumerate(self.keys)}
+        i = self._ids.get(key)
+        return None if i is None else self.row(i)
+
+    def component_summary(self, k: int) -> dict:
+        largest = np.argsort(-self.component_sizes, kind='stable')[:k]
+        return {
+            'nodes': len(self.keys),
+            'edges': self.edges,
+            'components': int(self.component_count),
+            'largest': [{'component': int(c), 'size': int(self.component_sizes[c])} for c in largest]
+        }
+
+
+def load_metrics(database: Database, graph: str, weight: str, min_time: int, max_time: int) -> GraphMetrics:
+    """
+    Aggregate the edges of a graph in a time window and compute its metrics.
+
+    :param database: The pyArango Database instance.
+    :param graph: 'payments' or 'witnesses'.
+    :param weight: The edge weight, one of the keys of GRAPHS[graph].
+    :param min_time: The minimum UTC timestamp of edges to consider.
+    :param max_time: The maximum UTC timestamp of edges to consider.
+    :return: The metrics. Raises AQLFetchError if the window has no edges.
+    """
+    query, weights = GRAPHS[graph]
+    column = weights[weight]
+    rows = []
+    for batch in iter_registered(database, query, {'min_time': min_time, 'max_time': max_time}, batch_size=EDGE_BATCH_SIZE):
+        rows.extend(batch)
+    if not rows:
+        raise AQLFetchError('No results matched for query.')
+    endpoints = np.array([row[0] for row in rows] + [row[1] for row in rows], dtype=object)
+    keys, ids = np.unique(endpoints, return_inverse=True)
+    weight_values = np.array([row[column] or 0 for row in rows], dtype=np.float64)
+    return GraphMetrics(keys, ids[:len(rows)], ids[len(rows):], weight_values, (min_time, max_time))
+
+
+# (graph, weight, min_time, max_time) -> (expires_at, version, GraphMetrics), most recently used last
+_results = OrderedDict()
+_results_lock = threading.Lock()
+# key -> lock held while that key is being computed, so concurrent misses compute it once
+_computing = {}
+
+
+def _is_fresh(entry: Optional[tuple], graph: str) -> bool:
+    return entry is not None and entry[0] > time.monotonic() and is_current(entry[1], (graph,))
+
+
+def _evict():
+    # least recently used first. A result larger than the whole budget is returned, but not kept
+    total = sum(entry[2].memory_bytes() for entry in _results.values())
+    while _results and total > ANALYTICS_CACHE_MAX_BYTES:
+        _, (_, _, metrics) = _results.popitem(last=False)
+        total -= metrics.memory_bytes()
+
+
+def get_metrics(database: Database, graph: str, weight: str, min_time: int = 0, max_time: int = None) -> GraphMetrics:
+    """
+    Get the metrics of a graph in a time window, computing them on a miss.
+
+    :param database: The pyArango Database instance.
+    :param graph: 'payments' or 'witnesses'.
+    :param weight: The edge weight, one of the keys of GRAPHS[graph].
+    :param min_time: The minimum UTC timestamp of edges to consider.
+    :param max_time: The maximum UTC timestamp of edges to consider, or None for up to now.
+    :return: The metrics. Both ends of the window are floored to ANALYTICS_TIME_BUCKET_SECONDS, so that nearby windows share
+        results. metrics.window holds the window that was used.
+    """
+    min_time -= min_time % ANALYTICS_TIME_BUCKET_SECONDS
+    if max_time is not None:
+        max_time -= max_time % ANALYTICS_TIME_BUCKET_SECONDS
+    key = (graph, weight, min_time, max_time)
+    with _results_lock:
+        entry = _results.get(key)
+        if _is_fresh(entry, graph):
+            _results.move_to_end(key)
+            return entry[2]
+        lock = _computing.setdefault(key, threading.Lock())
+    with lock:
+        with _results_lock:
+            entry = _results.get(key)
+            if _is_fresh(entry, graph):
+                return entry[2]
+        try:
+            historical = is_historical(max_time)
+            # the graph names double as the names of their edge collections
+            entry_version = None if historical else version((graph,))
+            metrics = load_metrics(database, graph, weight, min_time, resolve_max_time(max_time))
+            ttl = HISTORICAL_CACHE_TTL if historical else live_ttl(ANALYTICS_CACHE_TTL, entry_version)
+            expires_at = time.monotonic() + ttl
+            with _results_lock:
+                _results[key] = (expires_at, entry_version, metrics)
+                _results.move_to_end(key)
+                _evict()
+        finally:
+            with _results_lock:
+                _computing.pop(key, None)
+        return metrics
+
+
+def get_node_metrics(database: Database, graph: str, weight: str, address: str, min_time: int = 0,
+                     max_time: int = None) -> tuple:
+    """
+    Get the metrics of one account or hotspot.
+
+    :param database: The pyArango Database instance.
+    :param graph: 'payments' or 'witnesses'.
+    :param weight: The edge weight, one of the keys of GRAPHS[graph].
+    :param address: The HNT wallet address (payments) or hotspot address (witnesses).
+    :param min_time: The minimum UTC timestamp of edges to consider.
+    :param max_time: The maximum UTC timestamp of edges to consider, or None for up to now.
+    :return: (the metrics of the node, or None if it has no edges in the window, the window that was used).
+    """
+    metrics = get_metrics(database, graph, weight, min_time, max_time)
+    if graph == 'payments':
+        return metrics.node(address), metrics.window
+    ids = run_registered(database, HOTSPOT_IDS, {'address': address}, raise_if_empty=False)
+    return (metrics.node(ids[0].split('/')[-1]) if ids else None), metrics.window
@@ -0,0 +1,33 @@
+import os
+import requests
+from dotenv import load_dotenv
+from pyArango.connection import Connection
+from pyArango.database import Database
+
+
+load_dotenv()
+
+ARANGO_DATABASE = os.getenv('ARANGO_DATABASE', 'helium')
+
+
+def connect(pool_size: int = 10) -> Database:
+    """
+    Connect to the ArangoDB instance configured in the .env file.
+
+    :param pool_size: The number of keep-alive HTTP connections to hold open to Arango.
+    :return: The pyArango Database instance.
+    """
+    try:
+        conn = Connection(
+            arangoURL=os.getenv('ARANGO_URL'),
+            username=os.getenv('ARANGO_USERNAME'),
+            password=os.getenv('ARANGO_PASSWORD')
+        )
+    except requests.exceptions.ConnectionError:
+        raise Exception('Unable to connect to the ArangoDB instance. Please check that it is running and that you have '
+                        'supplied the correct URL/credentials in the .env file.')
+    # size the keep-alive pool so that concurrent queries each get their own connection
+    for prefix in ('http://', 'https://'):
+        conn.session.session.mount(prefix, requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size,
+                                                                         max_retries=conn.max_retries))
+    return conn[ARANGO_DATABASE]
@@ -1,8 +1,223 @@
-from pyArango.connection import *
-import h3
+from pyArango.database import Database
+from pyArango.theExceptions import AQLFetchError
+from query_executor import QUERY_TIMEOUT_SECONDS
+from metrics import record_query
+from time_windows import resolve_max_time, set_ingested_time
+from typing import Iterator, NamedTuple
+import logging
+import os
+import time
 
 
-def get_top_payment_totals(database: Database, n: int = 100, min_time: int = 0, max_time: int = int(datetime.utcnow().timestamp())):
+QUERY_BATCH_SIZE = 1000
+# how long Arango keeps an idle streaming cursor open between batches, e.g. while a slow client catches up
+STREAM_CURSOR_TTL_SECONDS = int(os.getenv('STREAM_CURSOR_TTL_SECONDS', 120))
+
+# per-query memory limit, enforced by Arango (0: server default). A query that needs more fails instead of starving every
+# other query
+AQL_MEMORY_LIMIT_BYTES = int(os.getenv('AQL_MEMORY_LIMIT_BYTES', 2 ** 30))
+# streaming cursors live as long as their (possibly slow) consumer, so they get a longer max runtime than QUERY_TIMEOUT_SECONDS
+STREAM_MAX_RUNTIME_SECONDS = int(os.getenv('STREAM_MAX_RUNTIME_SECONDS', 600))
+# Arango error numbers of a query aborted for exceeding memoryLimit or maxRuntime
+ERROR_RESOURCE_LIMIT = 32
+ERROR_QUERY_KILLED = 1500
+
+# opt-in Arango query results cache (requires --query.cache-mode demand on the server) and query plan cache (Arango 3.12+)
+AQL_RESULTS_CACHE = os.getenv('AQL_RESULTS_CACHE', '').lower() in ('1', 'true')
+AQL_PLAN_CACHE = os.getenv('AQL_PLAN_CACHE', '').lower() in ('1', 'true')
+
+logger = logging.getLogger(__name__)
+
+
+class RegisteredQuery(NamedTuple):
+    aql: str
+    example_bind_vars: dict
+
+
+# name -> constant AQL text. Values are always passed as @bind variables, so every request reuses the same query string.
+QUERIES = {}
+
+
+def register_query(name: str, aql: str, example_bind_vars: dict = None) -> str:
+    """
+    Add a constant AQL query to the registry.
+
+    :param name: A unique name for the query.
+    :param aql: The AQL query string, parameterized with @bind variables.
+    :param example_bind_vars: Representative bind variables, used to EXPLAIN the query.
+    :return: The name of the query.
+    """
+    if name in QUERIES:
+        raise ValueError(f'Query {name} is already registered')
+    QUERIES[name] = RegisteredQuery(aql, example_bind_vars or {})
+    return name
+
+
+def _cursor_stats(query) -> dict:
+    # execution stats come back in the 'extra' of the cursor response (of the last batch, for streaming cursors)
+    return (query.response.get('extra') or {}).get('stats')
+
+
+def run_aql(database: Database, aql: str, bind_vars: dict = None, raise_if_empty: bool = True,
+            name: str = 'unregistered') -> list:
+    """
+    Run an AQL query and merge all result batches. Arango aborts the query server-side after QUERY_TIMEOUT_SECONDS, or once it
+    uses more than AQL_MEMORY_LIMIT_BYTES.
+
+    :param database: The pyArango Database instance.
+    :param aql: The AQL query string.
+    :param bind_vars: (optional) bind variables for the query.
+    :param raise_if_empty: Raise AQLFetchError if the query returns no results.
+    :param name: The name to record metrics under.
+    :return: The list of results.
+    """
+    options = {'maxRuntime': QUERY_TIMEOUT_SECONDS}
+    if AQL_PLAN_CACHE:
+        options['usePlanCache'] = True
+    started_at = time.perf_counter()
+    query = database.AQLQuery(aql, batchSize=QUERY_BATCH_SIZE, rawResults=True, bindVars=bind_vars or {},
+                              options=options, cache=AQL_RESULTS_CACHE, memoryLimit=AQL_MEMORY_LIMIT_BYTES)
+    results = []
+    round_trips = 1
+    while True:
+        results.extend(query.response['result'])
+        try:
+            query.nextBatch()
+            round_trips += 1
+        except StopIteration:
+            break
+    record_query(name, time.perf_counter() - started_at, round_trips, len(results), _cursor_stats(query))
+    if not results and raise_if_empty:
+        raise AQLFetchError('No results matched for query.')
+    return results
+
+
+def run_registered(database: Database, name: str, bind_vars: dict = None, raise_if_empty: bool = True) -> list:
+    """
+    Run a query from the registry.
+
+    :param database: The pyArango Database instance.
+    :param name: The registered name of the query.
+    :param bind_vars: (optional) bind variables for the query.
+    :param raise_if_empty: Raise AQLFetchError if the query returns no results.
+    :return: The list of results.
+    """
+    return run_aql(database, QUERIES[name].aql, bind_vars, raise_if_empty, name=name)
+
+
+def iter_registered(database: Database, name: str, bind_vars: dict = None,
+                    batch_size: int = QUERY_BATCH_SIZE) -> Iterator[list]:
+    """
+    Run a query from the registry on a streaming cursor, yielding one batch of results at a time.
+    The next batch is only requested from Arango once the previous one has been consumed. Arango aborts the query after
+    STREAM_MAX_RUNTIME_SECONDS, or once it uses more than AQL_MEMORY_LIMIT_BYTES.
+
+    :param database: The pyArango Database instance.
+    :param name: The registered name of the query.
+    :param bind_vars: (optional) bind variables for the query.
+    :param batch_size: The number of results per batch.
+    :return: Generator of result batches.
+    """
+    started_at = time.perf_counter()
+    query = database.AQLQuery(QUERIES[name].aql, batchSize=batch_size, rawResults=True, bindVars=bind_vars or {},
+                              options={'stream': True, 'maxRuntime': STREAM_MAX_RUNTIME_SECONDS},
+                              ttl=STREAM_CURSOR_TTL_SECONDS, memoryLimit=AQL_MEMORY_LIMIT_BYTES)
+    round_trips, rows = 1, 0
+    try:
+        while True:
+            rows += len(query.response['result'])
+            yield query.response['result']
+            try:
+                query.nextBatch()
+                round_trips += 1
+            except StopIteration:
+                return
+    finally:
+        # closed before the last batch, e.g. when the client went away: kill the query instead of waiting for the cursor ttl
+        if query.response.get('hasMore') and query.cursor is not None:
+            try:
+                query.connection.session.delete(query.cursor.getURL())
+            except Exception:
+                logger.warning(f'Could not delete the cursor of {name}', exc_info=True)
+        # includes the time spent waiting on the consumer, since batches are only fetched on demand
+        record_query(name, time.perf_counter() - started_at, round_trips, rows, _cursor_stats(query))
+
+
+PING = register_query('ping', 'RETURN 1')
+
+
+def ping(database: Database) -> bool:
+    """
+    Check that Arango is reachable and answering queries.
+
+    :param database: The pyArango Database instance.
+    :return: True if the database answered.
+    """
+    return run_registered(database, PING) == [1]
+
+
+# the ETL writes blocks in order, so the latest time in each collection is how far it has ingested. Collections that are still
+# empty are ignored by MIN
+INGESTED_THROUGH = register_query('ingested_through', """RETURN MIN([
+    FIRST(for payment in payments sort payment.time desc limit 1 return payment.time),
+    FIRST(for witness in witnesses sort witness.time desc limit 1 return witness.time)
+])""")
+
+
+def update_ingested_time(database: Database):
+    """
+    Poll how far the ETL has ingested, which decides which time windows are historical (see time_windows.is_historical).
+
+    :param database: The pyArango Database instance.
+    """
+    set_ingested_time(run_registered(database, INGESTED_THROUGH)[0])
+
+
+def explain_registered_queries(database: Database) -> dict:
+    """
+    EXPLAIN every registered query with its example bind variables. Useful for confirming index usage.
+
+    :param database: The pyArango Database instance.
+    :return: Dict of query name -> the optimal plan returned by Arango.
+    """
+    return {name: database.explainAQLQuery(query.aql, query.example_bind_vars) for name, query in QUERIES.items()}
+
+
+# hydrates a node document by _id in the same round-trip as the traversal, optionally projected down to @fields
+NODE_PROJECTION = "@fields == null ? DOCUMENT(id) : KEEP(DOCUMENT(id), @fields)"
+
+EXAMPLE_ACCOUNT = '13aSUnDYLkJRWBPSwqFPDvbZ9pvF9g5KByq7msrbGTeE9EezsZB'
+EXAMPLE_HOTSPOT = '112nUEtrKPrgWtczpbira7aDU5271qduDfJm8Y2WSXjWwpkAHdgJ'
+EXAMPLE_TIME_WINDOW = {'n': 100, 'min_time': 0, 'max_time': 1640995200}
+EXAMPLE_ACCOUNT_WINDOW = {**EXAMPLE_TIME_WINDOW, 'account_id': f'accounts/{EXAMPLE_ACCOUNT}'}
+EXAMPLE_POLYGON = [[-79.917079, 40.441144], [-79.960382, 40.431539], [-79.970062, 40.399845], [-79.936489, 40.377766],
+                   [-79.89323, 40.387354], [-79.8835, 40.419037], [-79.917079, 40.441144]]
+
+
+def _node_fields(fields: list = None):
+    # edges reference nodes by _key, so a projection always keeps it
+    if not fields:
+        return None
+    return list({'_key', *fields})
+
+
+def _fetch_graph(database: Database, name: str, bind_vars: dict, fields: list = None) -> tuple:
+    graph = run_registered(database, name, {**bind_vars, 'fields': _node_fields(fields)})[0]
+    if not graph['edges']:
+        raise AQLFetchError('No results matched for query.')
+    return graph['nodes'], graph['edges']
+
+
+TOP_PAYMENT_TOTALS = register_query('top_payment_totals', """for payment in payments
+    filter payment.time > @min_time and payment.time < @max_time
+    collect from = payment._from, to = payment._to into payment_groups = payment.amount
+    let payment_total = SUM(payment_groups)
+    sort payment_total desc
+    limit @n
+    return {_from: last(split(from,'/')), _to: last(split(to,'/')), payment_total: payment_total}""", EXAMPLE_TIME_WINDOW)
+
+
+def get_top_payment_totals(database: Database, n: int = 100, min_time: int = 0, max_time: int = None):
     """
     Get top payments (payer, payee) pair, sorted by total HNT paid.
 
@@ -12,18 +227,21 @@ def get_top_payment_totals(database: Database, n: int = 100, min_time: int = 0,
     :param max_time: The maximum UTC timestamp to consider.
     :return: The list of top payment pairs (payer -> payee) by amount paid.
     """
-    aql = f"""for payment in payments
-    filter payment.time > {min_time} and payment.time < {max_time}
-    collect from = payment._from, to = payment._to into payment_groups = payment.amount
-    let payment_total = SUM(payment_groups)
-    sort payment_total desc
-    limit {n}
-    return {{_from: last(split(from,'/')), _to: last(split(to,'/')), payment_total: payment_total}}"""
-    totals = database.fetch_list(aql)
+    totals = run_registered(database, TOP_PAYMENT_TOTALS,
+                            {'n': n, 'min_time': min_time, 'max_time': resolve_max_time(max_time)})
     return totals
 
 
-def get_top_payment_counts(database: Database, n: int = 100, min_time: int = 0, max_time: int = int(datetime.utcnow().timestamp())):
+TOP_PAYMENT_COUNTS = register_query('top_payment_counts', """for payment in payments
+    filter payment.time > @min_time and payment.time < @max_time
+    collect from = payment._from, to = payment._to into payment_groups = payment.amount
+    let payment_count = LENGTH(payment_groups)
+    sort payment_count desc
+    limit @n
+    return {_from: last(split(from,'/')), _to: last(split(to,'/')), payment_count: payment_count}""", EXAMPLE_TIME_WINDOW)
+
+
+def get_top_payment_counts(database: Database, n: int = 100, min_time: int = 0, max_time: int = None):
     """
     Get top payments (payer, payee) pair, sorted by number of payments.
 
@@ -33,18 +251,22 @@ def get_top_payment_counts(database: Database, n: int = 100, min_time: int = 0,
     :param max_time: The maximum UTC timestamp to consider.
     :return: The list of top payment pairs (payer -> payee) by number of payments.
     """
-    aql = f"""for payment in payments
-    filter payment.time > {min_time} and payment.time < {max_time}
-    collect from = payment._from, to = payment._to into payment_groups = payment.amount
-    let payment_count = LENGTH(payment_groups)
-    sort payment_count desc
-    limit {n}
-    return {{_from: last(split(from,'/')), _to: last(split(to,'/')), payment_count: payment_count}}"""
-    counts = database.fetch_list(aql)
+    counts = run_registered(database, TOP_PAYMENT_COUNTS,
+                            {'n': n, 'min_time': min_time, 'max_time': resolve_max_time(max_time)})
     return counts
 
 
-def get_top_payers(database: Database, n: int = 100, min_time: int = 0, max_time: int = int(datetime.utcnow().timestamp())):
+TOP_PAYERS = register_query('top_payers', """for payment in payments
+    filter payment.time > @min_time and payment.time < @max_time
+    collect from = payment._from into payment_groups = payment.amount
+    let payment_total = SUM(payment_groups)
+    let payment_count = LENGTH(payment_groups)
+    sort payment_total desc
+    limit @n
+    return {_from: last(split(from,'/')), total_amount: payment_total, num_payments: payment_count}""", EXAMPLE_TIME_WINDOW)
+
+
+def get_top_payers(database: Database, n: int = 100, min_time: int = 0, max_time: int = None):
     """
     Get top payers, sorted by amount paid. Also includes payment counts for each.
 
@@ -54,19 +276,21 @@ def get_top_payers(database: Database, n: int = 100, min_time: int = 0, max_time
     :param max_time: The maximum UTC timestamp to consider.
     :return: The list of top payment pairs (payer -> payee) by number of payments.
     """
-    aql = f"""for payment in payments
-    filter payment.time > {min_time} and payment.time < {max_time}
-    collect from = payment._from into payment_groups = payment.amount
+    totals = run_registered(database, TOP_PAYERS, {'n': n, 'min_time': min_time, 'max_time': resolve_max_time(max_time)})
+    return totals
+
+
+TOP_PAYEES = register_query('top_payees', """for payment in payments
+    filter payment.time > @min_time and payment.time < @max_time
+    collect to = payment._to into payment_groups = payment.amount
     let payment_total = SUM(payment_groups)
     let payment_count = LENGTH(payment_groups)
     sort payment_total desc
-    limit {n}
-    return {{_from: last(split(from,'/')), total_amount: payment_total, num_payments: payment_count}}"""
-    totals = database.fetch_list(aql)
-    return totals
+    limit @n
+    return {_to: last(split(to,'/')), total_amount: payment_total, num_payments: payment_count}""", EXAMPLE_TIME_WINDOW)
 
 
-def get_top_payees(database: Database, n: int = 100, min_time: int = 0, max_time: int = int(datetime.utcnow().timestamp())):
+def get_top_payees(database: Database, n: int = 100, min_time: int = 0, max_time: int = None):
     """
     Get top payees, sorted by amount paid. Also includes payment counts for each.
 
@@ -76,19 +300,21 @@ def get_top_payees(database: Database, n: int = 100, min_time: int = 0, max_time
     :param max_time: The maximum UTC timestamp to consider.
     :return: The list of top payment pairs (payer -> payee) by number of payments.
     """
-    aql = f"""for payment in payments
-    filter payment.time > {min_time} and payment.time < {max_time}
-    collect to = payment._to into payment_groups = payment.amount
+    totals = run_registered(database, TOP_PAYEES, {'n': n, 'min_time': min_time, 'max_time': resolve_max_time(max_time)})
+    return totals
+
+
+TOP_PAYERS_TO_PAYEE = register_query('top_payers_to_payee', """for payment in payments
+    filter payment._to == @account_id and payment.time > @min_time and payment.time < @max_time
+    collect from = payment._from into payment_groups = payment.amount
     let payment_total = SUM(payment_groups)
-    let payment_count = SUM(payment_groups)
+    let payment_count = LENGTH(payment_groups)
     sort payment_total desc
-    limit {n}
-    return {{_to: last(split(to,'/')), total_amount: payment_total, num_payments: payment_count}}"""
-    totals = database.fetch_list(aql)
-    return totals
+    limit @n
+    return {_from: last(split(from,'/')), total_amount: payment_total, num_payments: payment_count}""", EXAMPLE_ACCOUNT_WINDOW)
 
 
-def get_top_payers_to_payee(database: Database, address: str, n: int = 100, min_time: int = 0, max_time: int = int(datetime.utcnow().timestamp())):
+def get_top_payers_to_payee(database: Database, address: str, n: int = 100, min_time: int = 0, max_time: int = None):
     """
     Get payments to an account, grouped by payer and sorted by amount. Also includes payment counts for each.
 
@@ -99,19 +325,22 @@ def get_top_payers_to_payee(database: Database, address: str, n: int = 100, min_
     :param max_time: The maximum UTC timestamp to consider.
     :return: The list of top payees from this account, including amount paid and number of payments.
     """
-    aql = f"""for payment in payments
-    filter payment.time > {min_time} and payment.time < {max_time} and payment._to == 'accounts/{address}'
-    collect from = payment._from into payment_groups = payment.amount
+    bind_vars = {'account_id': f'accounts/{address}', 'n': n, 'min_time': min_time, 'max_time': resolve_max_time(max_time)}
+    totals = run_registered(database, TOP_PAYERS_TO_PAYEE, bind_vars)
+    return totals
+
+
+TOP_PAYEES_FROM_PAYER = register_query('top_payees_from_payer', """for payment in payments
+    filter payment._from == @account_id and payment.time > @min_time and payment.time < @max_time
+    collect to = payment._to into payment_groups = payment.amount
     let payment_total = SUM(payment_groups)
     let payment_count = LENGTH(payment_groups)
     sort payment_total desc
-    limit {n}
-    return {{_from: last(split(from,'/')), total_amount: payment_total, num_payments: payment_count}}"""
-    totals = database.fetch_list(aql)
-    return totals
+    limit @n
+    return {_to: last(split(to,'/')), total_amount: payment_total, num_payments: payment_count}""", EXAMPLE_ACCOUNT_WINDOW)
 
 
-def get_top_payees_from_payer(database: Database, address: str, n: int = 100, min_time: int = 0, max_time: int = int(datetime.utcnow().timestamp())):
+def get_top_payees_from_payer(database: Database, address: str, n: int = 100, min_time: int = 0, max_time: int = None):
     """
     Get payments from an account, grouped by payee and sorted by amount. Also includes payment counts for each.
 
@@ -122,19 +351,75 @@ def get_top_payees_from_payer(database: Database, address: str, n: int = 100, mi
     :param max_time: The maximum UTC timestamp to consider.
     :return: The list of top payers to this account, including amount paid and number of payments.
     """
-    aql = f"""for payment in payments
-    filter payment.time > {min_time} and payment.time < {max_time} and payment._from == 'accounts/{address}'
-    collect to = payment._to into payment_groups = payment.amount
-    let payment_total = SUM(payment_groups)
-    let payment_count = LENGTH(payment_groups)
-    sort payment_total desc
-    limit {n}
-    return {{_to: last(split(to,'/')), total_amount: payment_total, num_payments: payment_count}}"""
-    totals = database.fetch_list(aql)
+    bind_vars = {'account_id': f'accounts/{address}', 'n': n, 'min_time': min_time, 'max_time': resolve_max_time(max_time)}
+    totals = run_registered(database, TOP_PAYEES_FROM_PAYER, bind_vars)
     return totals
 
 
-def get_graph_to_top_payees(database: Database, n: int = 100, min_time: int = 0, max_time: int = int(datetime.utcnow().timestamp())):
+# per-counterparty flows of an account in one direction, found with the edge index on _from (outflow) or _to (inflow)
+ACCOUNT_FLOW = """let {name} = (for payment in payments
+        filter payment.{side} == @account_id and payment.time > @min_time and payment.time < @max_time
+        collect counterparty = payment.{other} aggregate total_amount = SUM(payment.amount), num_payments = LENGTH(1),
+            first_time = MIN(payment.time), last_time = MAX(payment.time)
+        return {{{other}: last(split(counterparty,'/')), total_amount, num_payments, first_time, last_time}})"""
+
+ACCOUNT_FLOW_SUMMARY = """{{
+        total_amount: SUM({name}[*].total_amount),
+        num_payments: SUM({name}[*].num_payments),
+        counterparties: LENGTH({name}),
+        first_time: MIN({name}[*].first_time),
+        last_time: MAX({name}[*].last_time),
+        top: (for row in {name} sort row.total_amount desc limit @n return row)
+    }}"""
+
+ACCOUNT_SUMMARY = register_query('account_summary', f"""{ACCOUNT_FLOW.format(name='outflow', side='_from', other='_to')}
+{ACCOUNT_FLOW.format(name='inflow', side='_to', other='_from')}
+return {{
+    outflow: {ACCOUNT_FLOW_SUMMARY.format(name='outflow')},
+    inflow: {ACCOUNT_FLOW_SUMMARY.format(name='inflow')}
+}}""", {**EXAMPLE_TIME_WINDOW, 'n': 10, 'account_id': f'accounts/{EXAMPLE_ACCOUNT}'})
+
+
+def get_account_summary(database: Database, address: str, n: int = 10, min_time: int = 0, max_time: int = None) -> dict:
+    """
+    Summarize the token flow of an account in both directions, in a single query.
+
+    :param database: The pyArango Database instance.
+    :param address: The HNT wallet address.
+    :param n: The max number of top counterparties to return per direction.
+    :param min_time: The minimum UTC timestamp to consider.
+    :param max_time: The maximum UTC timestamp to consider.
+    :return: Dict of outflow and inflow, each with the total amount, number of payments, number of counterparties, first and
+        last payment time, and the top counterparties by amount (with their own totals and first/last payment times).
+    """
+    summary = run_registered(database, ACCOUNT_SUMMARY, {'account_id': f'accounts/{address}', 'n': n, 'min_time': min_time,
+                                                         'max_time': resolve_max_time(max_time)})[0]
+    if not summary['outflow']['num_payments'] and not summary['inflow']['num_payments']:
+        raise AQLFetchError('No results matched for query.')
+    return {'address': address, **summary}
+
+
+GRAPH_TO_TOP_PAYEES = register_query('graph_to_top_payees', """let seeds = (for payment in payments
+        filter payment.time > @min_time and payment.time < @max_time
+        collect to = payment._to aggregate payment_total = SUM(payment.amount)
+        sort payment_total desc
+        limit @n
+        return to)
+    let edges = (for seed in seeds
+        for v, e, p in 1..1 inbound seed payments
+            collect from = e._from, to = e._to into edge_groups = e.amount
+            let payment_total = sum(edge_groups)
+            let payment_count = length(edge_groups)
+            sort payment_total desc
+            return {_to: to, _from: from, total_amount: payment_total, num_payments: payment_count})
+    return {
+        nodes: (for id in UNIQUE(APPEND(seeds, edges[*]._from)) return """ + NODE_PROJECTION + """),
+        edges: (for edge in edges return MERGE(edge, {_from: last(split(edge._from,'/')), _to: last(split(edge._to,'/'))}))
+    }""", {**EXAMPLE_TIME_WINDOW, 'n': 10, 'fields': None})
+
+
+def get_graph_to_top_payees(database: Database, n: int = 100, min_time: int = 0, max_time: int = None,
+                            fields: list = None):
     """
     Starting with the top payees, generate the graph of token flow from these accounts.
 
@@ -142,33 +427,34 @@ def get_graph_to_top_payees(database: Database, n: int = 100, min_time: int = 0,
     :param n: The max number of top payees to seed the graph.
     :param min_time: The minimum UTC timestamp to consider.
     :param max_time: The maximum UTC timestamp to consider.
+    :param fields: (optional) the account fields to include in each node. Defaults to the full document.
     :return: (nodes, edges) lists of the graph.
     """
-    top_accounts = get_top_payees(database, n, min_time, max_time)
-    node_addresses = []
-    nodes = []
-    for node in top_accounts:
-        address = node['_to']
-        node_addresses.append(address)
-        nodes.append(database['accounts'][address].getStore())
-    aql = f"""for account in accounts
-    filter account._key in {[node['_key'] for node in nodes]}
-    for v, e, p in 1..1 inbound account payments
-        collect from = e._from, to = e._to into edge_groups = e.amount
-        let payment_total = sum(edge_groups)
-        let payment_count = length(edge_groups)
-        sort payment_total desc
-        return {{_to: last(split(to,'/')), _from: last(split(from,'/')), total_amount: payment_total, num_payments: payment_count}}"""
-    edges = database.fetch_list(aql)
-    for edge in edges:
-        from_address = edge['_from']
-        if from_address not in node_addresses:
-            nodes.append(database['accounts'][from_address].getStore())
-            node_addresses.append(from_address)
-    return nodes, edges
+    bind_vars = {'n': n, 'min_time': min_time, 'max_time': resolve_max_time(max_time)}
+    return _fetch_graph(database, GRAPH_TO_TOP_PAYEES, bind_vars, fields)
 
 
-def get_graph_from_top_payers(database: Database, n: int = 100, min_time: int = 0, max_time: int = int(datetime.utcnow().timestamp())):
+GRAPH_FROM_TOP_PAYERS = register_query('graph_from_top_payers', """let seeds = (for payment in payments
+        filter payment.time > @min_time and payment.time < @max_time
+        collect from = payment._from aggregate payment_total = SUM(payment.amount)
+        sort payment_total desc
+        limit @n
+        return from)
+    let edges = (for seed in seeds
+        for v, e, p in 1..1 outbound seed payments
+            collect from = e._from, to = e._to into edge_groups = e.amount
+            let payment_total = sum(edge_groups)
+            let payment_count = length(edge_groups)
+            sort payment_total desc
+            return {_to: to, _from: from, total_amount: payment_total, num_payments: payment_count})
+    return {
+        nodes: (for id in UNIQUE(APPEND(seeds, edges[*]._to)) return """ + NODE_PROJECTION + """),
+        edges: (for edge in edges return MERGE(edge, {_from: last(split(edge._from,'/')), _to: last(split(edge._to,'/'))}))
+    }""", {**EXAMPLE_TIME_WINDOW, 'n': 10, 'fields': None})
+
+
+def get_graph_from_top_payers(database: Database, n: int = 100, min_time: int = 0, max_time: int = None,
+                              fields: list = None):
     """
     Starting with the top payers, generate the graph of token flow from these accounts.
 
@@ -176,30 +462,17 @@ def get_graph_from_top_payers(database: Database, n: int = 100, min_time: int =
     :param n: The max number of top payers to seed the graph.
     :param min_time: The minimum UTC timestamp to consider.
     :param max_time: The maximum UTC timestamp to consider.
+    :param fields: (optional) the account fields to include in each node. Defaults to the full document.
     :return: (nodes, edges) lists of the graph.
     """
-    top_accounts = get_top_payers(database, n, min_time, max_time)
-    node_addresses = []
-    nodes = []
-    for node in top_accounts:
-        address = node['_from']
-        node_addresses.append(address)
-        nodes.append(database['accounts'][address].getStore())
-    aql = f"""for account in accounts
-    filter account._key in {[node['_key'] for node in nodes]}
-    for v, e, p in 1..1 outbound account payments
-        collect from = e._from, to = e._to into edge_groups = e.amount
-        let payment_total = sum(edge_groups)
-        let payment_count = length(edge_groups)
-        sort payment_total desc
-        return {{_to: last(split(to,'/')), _from: last(split(from,'/')), total_amount: payment_total, num_payments: payment_count}}"""
-    edges = database.fetch_list(aql)
-    for edge in edges:
-        to_address = edge['_to']
-        if to_address not in node_addresses:
-            nodes.append(database['accounts'][to_address].getStore())
-            node_addresses.append(to_address)
-    return nodes, edges
+    bind_vars = {'n': n, 'min_time': min_time, 'max_time': resolve_max_time(max_time)}
+    return _fetch_graph(database, GRAPH_FROM_TOP_PAYERS, bind_vars, fields)
+
+
+OUTBOUND_WITNESSES = register_query('outbound_witnesses', """for hotspot in hotspots
+    filter hotspot.address == @address
+    for v, e, p in 1..1 outbound hotspot witnesses
+        return{witness: p.vertices[1]}""", {'address': EXAMPLE_HOTSPOT})
 
 
 def get_outbound_witnesses_for_hotspot(database: Database, address: str):
@@ -210,12 +483,13 @@ def get_outbound_witnesses_for_hotspot(database: Database, address: str):
     :param address: The hotspot address.
     :return: The list of witnesses.
     """
-    aql = f"""
-    for hotspot in hotspots
-    filter hotspot.address == '{address}'
-    for v, e, p in 1..1 outbound hotspot witnesses
-        return{{witness: p.vertices[1]}}"""
-    return [witness['witness'] for witness in database.fetch_list(aql)]
+    return [witness['witness'] for witness in run_registered(database, OUTBOUND_WITNESSES, {'address': address})]
+
+
+INBOUND_WITNESSES = register_query('inbound_witnesses', """for hotspot in hotspots
+    filter hotspot.address == @address
+    for v, e, p in 1..1 inbound hotspot witnesses
+        return{witness: p.vertices[1]}""", {'address': EXAMPLE_HOTSPOT})
 
 
 def get_inbound_witnesses_for_hotspot(database: Database, address: str):
@@ -226,67 +500,174 @@ def get_inbound_witnesses_for_hotspot(database: Database, address: str):
     :param address: The hotspot address.
     :return: The list of challengees.
     """
-    aql = f"""for hotspot in hotspots
-    filter hotspot.address == '{address}'
-    for v, e, p in 1..1 inbound hotspot witnesses
-        return{{witness: p.vertices[0]}}"""
-    return [witness['witness'] for witness in database.fetch_list(aql)]
+    return [witness['witness'] for witness in run_registered(database, INBOUND_WITNESSES, {'address': address})]
+
+
+BATCH_TOP_PAYEES_FROM_PAYERS = register_query('batch_top_payees_from_payers', """for address in @addresses
+    let payees = (for payment in payments
+        filter payment._from == CONCAT('accounts/', address) and payment.time > @min_time and payment.time < @max_time
+        collect to = payment._to into payment_groups = payment.amount
+        let payment_total = SUM(payment_groups)
+        sort payment_total desc
+        limit @n
+        return {_to: last(split(to,'/')), total_amount: payment_total, num_payments: LENGTH(payment_groups)})
+    return {address: address, payees: payees}""", {**EXAMPLE_TIME_WINDOW, 'addresses': [EXAMPLE_ACCOUNT]})
+
+BATCH_TOP_PAYERS_TO_PAYEES = register_query('batch_top_payers_to_payees', """for address in @addresses
+    let payers = (for payment in payments
+        filter payment._to == CONCAT('accounts/', address) and payment.time > @min_time and payment.time < @max_time
+        collect from = payment._from into payment_groups = payment.amount
+        let payment_total = SUM(payment_groups)
+        sort payment_total desc
+        limit @n
+        return {_from: last(split(from,'/')), total_amount: payment_total, num_payments: LENGTH(payment_groups)})
+    return {address: address, payers: payers}""", {**EXAMPLE_TIME_WINDOW, 'addresses': [EXAMPLE_ACCOUNT]})
+
+BATCH_OUTBOUND_WITNESSES = register_query('batch_outbound_witnesses', """for address in @addresses
+    let witnesses = (for hotspot in hotspots
+        filter hotspot.address == address
+        for v, e, p in 1..1 outbound hotspot witnesses
+            return p.vertices[1])
+    return {address: address, witnesses: witnesses}""", {'addresses': [EXAMPLE_HOTSPOT]})
+
+BATCH_INBOUND_WITNESSES = register_query('batch_inbound_witnesses', """for address in @addresses
+    let witnesses = (for hotspot in hotspots
+        filter hotspot.address == address
+        for v, e, p in 1..1 inbound hotspot witnesses
+            return p.vertices[1])
+    return {address: address, witnesses: witnesses}""", {'addresses': [EXAMPLE_HOTSPOT]})
 
 
-def get_witness_graph_near_coordinates(database: Database, lat: float, lon: float, limit: int = 10):
+def iter_batch_top_payees_from_payers(database: Database, addresses: list, n: int = 100, min_time: int = 0,
+                                      max_time: int = None, batch_size: int = 100) -> Iterator[list]:
     """
-    Starting with the closest hotspots to a given coordinate, generate the recent witness graph, including signal details.
+    Same as get_top_payees_from_payer for many accounts in a single query, yielding batches of {address, payees} rows.
 
     :param database: The pyArango Database instance.
-    :param lat: The latitude of the query coordinate.
-    :param lon: The longitude of the query coordinate.
-    :param limit: The max number of nearby hotspots to seed the graph. Note that the nodes list will also include any witnesses.
-    :return: (nodes, edges) lists of the graph.
+    :param addresses: The HNT wallet addresses of the payers.
+    :param n: The max number of payees to return per account.
+    :param min_time: The minimum UTC timestamp to consider.
+    :param max_time: The maximum UTC timestamp to consider.
+    :param batch_size: The number of accounts per batch.
+    :return: Generator of result batches.
+    """
+    bind_vars = {'addresses': addresses, 'n': n, 'min_time': min_time, 'max_time': resolve_max_time(max_time)}
+    return iter_registered(database, BATCH_TOP_PAYEES_FROM_PAYERS, bind_vars, batch_size=batch_size)
+
+
+def iter_batch_top_payers_to_payees(database: Database, addresses: list, n: int = 100, min_time: int = 0,
+                                    max_time: int = None, batch_size: int = 100) -> Iterator[list]:
     """
-    aql = f"""LET queryCoords = GEO_POINT({lon}, {lat})
-    FOR hotspot IN hotspots
+    Same as get_top_payers_to_payee for many accounts in a single query, yielding batches of {address, payers} rows.
+
+    :param database: The pyArango Database instance.
+    :param addresses: The HNT wallet addresses of the payees.
+    :param n: The max number of payers to return per account.
+    :param min_time: The minimum UTC timestamp to consider.
+    :param max_time: The maximum UTC timestamp to consider.
+    :param batch_size: The number of accounts per batch.
+    :return: Generator of result batches.
+    """
+    bind_vars = {'addresses': addresses, 'n': n, 'min_time': min_time, 'max_time': resolve_max_time(max_time)}
+    return iter_registered(database, BATCH_TOP_PAYERS_TO_PAYEES, bind_vars, batch_size=batch_size)
+
+
+def iter_batch_outbound_witnesses(database: Database, addresses: list, batch_size: int = 100) -> Iterator[list]:
+    """
+    Same as get_outbound_witnesses_for_hotspot for many hotspots in a single query, yielding batches of {address, witnesses}
+    rows.
+
+    :param database: The pyArango Database instance.
+    :param addresses: The hotspot addresses.
+    :param batch_size: The number of hotspots per batch.
+    :return: Generator of result batches.
+    """
+    return iter_registered(database, BATCH_OUTBOUND_WITNESSES, {'addresses': addresses}, batch_size=batch_size)
+
+
+def iter_batch_inbound_witnesses(database: Database, addresses: list, batch_size: int = 100) -> Iterator[list]:
+    """
+    Same as get_inbound_witnesses_for_hotspot for many hotspots in a single query, yielding batches of {address, witnesses}
+    rows.
+
+    :param database: The pyArango Database instance.
+    :param addresses: The hotspot addresses.
+    :param batch_size: The number of hotspots per batch.
+    :return: Generator of result batches.
+    """
+    return iter_registered(database, BATCH_INBOUND_WITNESSES, {'addresses': addresses}, batch_size=batch_size)
+
+
+WITNESS_GRAPH_NEAR_COORDINATES = register_query('witness_graph_near_coordinates', """LET queryCoords = GEO_POINT(@lon, @lat)
+    let edges = (FOR hotspot IN hotspots
         SORT GEO_DISTANCE(queryCoords, hotspot.geo_location)
-        LIMIT {limit}
+        LIMIT @limit
         for v, e, p in 1..1 outbound hotspot witnesses
             sort e._from
             let distance_m = GEO_DISTANCE(p.vertices[0].geo_location, p.vertices[1].geo_location)
-            RETURN {{_from: last(split(e._from, '/')), _to: last(split(e._to, '/')), snr: e.snr, rssi: e.signal, distance_m: distance_m}}"""
-    edges = database.fetch_list(aql)
-    address_list, nodes = [], []
-    vertex_list = [list(edge.values())[:2] for edge in edges]
-    for v_pair in vertex_list:
-        for v in v_pair:
-            if v not in address_list:
-                nodes.append(database['hotspots'][v].getStore())
-                address_list += v
-    return nodes, edges
+            RETURN {_from: e._from, _to: e._to, snr: e.snr == null ? null : ROUND(e.snr * 10) / 10, rssi: e.signal,
+                    distance_m: distance_m == null ? null : ROUND(distance_m)})
+    return {
+        nodes: (for id in UNIQUE(APPEND(edges[*]._from, edges[*]._to)) return """ + NODE_PROJECTION + """),
+        edges: (for edge in edges return MERGE(edge, {_from: last(split(edge._from,'/')), _to: last(split(edge._to,'/'))}))
+    }""", {'lat': 40.689306, 'lon': -74.0445, 'limit': 10, 'fields': None})
 
 
-def get_witness_graph_in_hex(database: Database, hex: str):
+def get_witness_graph_near_coordinates(database: Database, lat: float, lon: float, limit: int = 10, fields: list = None):
+    """
+    Starting with the closest hotspots to a given coordinate, generate the recent witness graph, including signal details.
+
+    :param database: The pyArango Database instance.
+    :param lat: The latitude of the query coordinate.
+    :param lon: The longitude of the query coordinate.
+    :param limit: The max number of nearby hotspots to seed the graph. Note that the nodes list will also include any
+        witnesses.
+    :param fields: (optional) the hotspot fields to include in each node. Defaults to the full document.
+    :return: (nodes, edges) lists of the graph.
+    """
+    return _fetch_graph(database, WITNESS_GRAPH_NEAR_COORDINATES, {'lat': lat, 'lon': lon, 'limit': limit}, fields)
+
+
+WITNESS_GRAPH_IN_HEX = register_query('witness_graph_in_hex', """let hex_poly = GEO_POLYGON(@poly_list)
+    let hotspots_in_hex = (for hotspot in hotspots
+        filter GEO_CONTAINS(hex_poly, hotspot.geo_location)
+        return hotspot)
+    return {
+        nodes: (for node in hotspots_in_hex return @fields == null ? node : KEEP(node, @fields)),
+        edges: (for hotspot in hotspots_in_hex
+            for v, e, p in 1..1 outbound hotspot witnesses
+                filter GEO_CONTAINS(hex_poly, p.vertices[1].geo_location)
+                let distance_m = GEO_DISTANCE(p.vertices[0].geo_location, p.vertices[1].geo_location)
+                RETURN {_from: last(split(e._from, '/')), _to: last(split(e._to, '/')),
+                        snr: e.snr == null ? null : ROUND(e.snr * 10) / 10, rssi: e.signal,
+                        distance_m: distance_m == null ? null : ROUND(distance_m)})
+    }""", {'poly_list': EXAMPLE_POLYGON, 'fields': None})
+
+
+def get_witness_graph_in_hex(database: Database, hex: str, fields: list = None):
     """
     Generate the witness graph within a hex.
 
     :param database: The pyArango Database instance.
     :param hex: An h3 hex to consider.
+    :param fields: (optional) the hotspot fields to include in each node. Defaults to the full document.
     :return: (nodes, edges) lists of the graph.
     """
+    import h3
     poly_list = [list(p) for p in h3.h3_to_geo_boundary(hex, geo_json=True)]
-    nodes_aql = f"""let hex_poly = GEO_POLYGON({poly_list})
-    for hotspot in hotspots
-    filter GEO_CONTAINS(hex_poly, hotspot.geo_location)
-    return {{hotspot}}
-    """
-    nodes = [hotspot['hotspot'] for hotspot in database.fetch_list(nodes_aql)]
-    node_addresses = [node['address'] for node in nodes]
-    edges_aql = f"""let hex_poly = GEO_POLYGON({poly_list})
-        for hotspot in hotspots
-        filter hotspot.address in {node_addresses}
-        for v, e, p in 1..1 outbound hotspot witnesses
-            filter GEO_CONTAINS(hex_poly, p.vertices[1].geo_location)
-            let distance_m = GEO_DISTANCE(p.vertices[0].geo_location, p.vertices[1].geo_location)
-            RETURN {{_from: last(split(e._from, '/')), _to: last(split(e._to, '/')), snr: e.snr, rssi: e.signal, distance_m: distance_m}}"""
-    edges = database.fetch_list(edges_aql)
-    return nodes, edges
+    return _fetch_graph(database, WITNESS_GRAPH_IN_HEX, {'poly_list': poly_list}, fields)
+
+
+RECENT_WITNESS_RECEIPTS = register_query('recent_witness_receipts', """for witness in witnesses
+    sort witness.time desc
+    limit @limit
+    return {receipt: witness}""", {'limit': 1000})
+
+RECENT_WITNESS_RECEIPTS_FOR_HOTSPOT = register_query('recent_witness_receipts_for_hotspot', """for witness in witnesses
+    filter witness.gateway == @address
+    sort witness.time desc
+    limit @limit
+    return {receipt: witness}""", {'address': EXAMPLE_HOTSPOT, 'limit': 1000})
 
 
 def get_sample_of_recent_witness_receipts(database: Database, address: str = None, limit: int = 1000) -> list:
@@ -299,21 +680,37 @@ def get_sample_of_recent_witness_receipts(database: Database, address: str = Non
     :return: The list of receipts.
     """
     if not address:
-        aql = f"""
-        for witness in witnesses
-        sort witness.time desc
-        limit {limit}
-        return {{receipt: witness}}
-        """
+        receipts = run_registered(database, RECENT_WITNESS_RECEIPTS, {'limit': limit})
+    else:
+        receipts = run_registered(database, RECENT_WITNESS_RECEIPTS_FOR_HOTSPOT, {'address': address, 'limit': limit})
+    return [receipt['receipt'] for receipt in receipts]
+
+
+def iter_sample_of_recent_witness_receipts(database: Database, address: str = None, limit: int = 1000,
+                                           batch_size: int = QUERY_BATCH_SIZE) -> Iterator[list]:
+    """
+    Same as get_sample_of_recent_witness_receipts, but yields batches of receipts from a streaming cursor.
+
+    :param database: The pyArango Database instance.
+    :param address: (optional) if specified, results will only include receipts in which this hotspot was a witness.
+    :param limit: The maximum number of results to return.
+    :param batch_size: The number of receipts per batch.
+    :return: Generator of lists of receipts.
+    """
+    if not address:
+        batches = iter_registered(database, RECENT_WITNESS_RECEIPTS, {'limit': limit}, batch_size)
     else:
-        aql = f"""
-        for witness in witnesses
-        filter witness.gateway == '{address}'
-        sort witness.time desc
-        limit {limit}
-        return {{receipt: witness}}
-        """
-    return [receipt['receipt'] for receipt in database.fetch_list(aql)]
+        batches = iter_registered(database, RECENT_WITNESS_RECEIPTS_FOR_HOTSPOT, {'address': address, 'limit': limit},
+                                  batch_size)
+    for batch in batches:
+        yield [receipt['receipt'] for receipt in batch]
+
+
+# coordinates are rounded to 6 decimal places (~0.1 m), which is well within the precision of asserted hotspot locations
+HOTSPOT_COORDINATES = register_query('hotspot_coordinates', """for hotspot in hotspots
+    filter hotspot.geo_location.coordinates != null
+    return [ROUND(hotspot.geo_location.coordinates[0] * 1000000) / 1000000,
+            ROUND(hotspot.geo_location.coordinates[1] * 1000000) / 1000000]""")
 
 
 def get_hotspot_coordinates(database: Database) -> list:
@@ -322,7 +719,15 @@ def get_hotspot_coordinates(database: Database) -> list:
     :param database: The pyArango Database instance.
     :return: The list of [lon, lat] coordinate pairs.
     """
-    aql = """for hotspot in hotspots
-    filter hotspot.geo_location.coordinates != null
-    return hotspot.geo_location.coordinates"""
-    return database.fetch_list(aql)
\ No newline at end of file
+    return run_registered(database, HOTSPOT_COORDINATES)
+
+
+def iter_hotspot_coordinates(database: Database, batch_size: int = QUERY_BATCH_SIZE) -> Iterator[list]:
+    """
+    Same as get_hotspot_coordinates, but yields batches of coordinates from a streaming cursor.
+
+    :param database: The pyArango Database instance.
+    :param batch_size: The number of coordinate pairs per batch.
+    :return: Generator of lists of [lon, lat] coordinate pairs.
+    """
+    return iter_registered(database, HOTSPOT_COORDINATES, batch_size=batch_size)
@@ -0,0 +1,193 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict, defaultdict
+from functools import wraps
+from typing import Awaitable, Callable, Optional
+from urllib.parse import urlencode
+import orjson
+from fastapi.responses import Response
+from query_executor import run_query, ClientDisconnectedError, OverloadedError
+from time_windows import is_historical, HISTORICAL_CACHE_TTL
+from change_feed import versioned
+
+
+REDIS_ACTIVE = os.getenv('REDIS_ACTIVE', '').lower() in ('1', 'true')
+REDIS_HOST = os.getenv('REDIS_HOST', 'redis')
+CACHE_LRU_SIZE = int(os.getenv('CACHE_LRU_SIZE', 1024))
+CACHE_KEY_PREFIX = 'cache:'
+
+# set by connect_redis in each worker process, so that workers never share a connection pool across a fork
+redis_client = None
+
+# key -> (expires_at, value), most recently used last
+_lru = OrderedDict()
+# key -> future of the computation currently filling that key, so concurrent misses share one computation
+_in_flight = {}
+# route -> counter name -> count
+stats = defaultdict(lambda: {'lru_hits': 0, 'redis_hits': 0, 'misses': 0})
+
+
+def connect_redis(pool_size: int = 10):
+    """
+    Create this process's Redis client, if REDIS_ACTIVE.
+
+    :param pool_size: The max number of connections to Redis, e.g. one per query worker thread.
+    """
+    global redis_client
+    if REDIS_ACTIVE:
+        import redis
+        redis_client = redis.Redis(connection_pool=redis.ConnectionPool(host=REDIS_HOST, max_connections=pool_size))
+
+
+def _lru_get(key: str):
+    entry = _lru.get(key)
+    if entry is None:
+        return None
+    expires_at, value = entry
+    if expires_at < time.monotonic():
+        del _lru[key]
+        return None
+    _lru.move_to_end(key)
+    return value
+
+
+def _lru_set(key: str, value, ttl: Optional[int]):
+    _lru[key] = (time.monotonic() + ttl if ttl is not None else float('inf'), value)
+    _lru.move_to_end(key)
+    while len(_lru) > CACHE_LRU_SIZE:
+        _lru.popitem(last=False)
+
+
+def clear_lru():
+    """Drop every entry in the in-process tier."""
+    _lru.clear()
+
+
+async def get_or_set_json(key: str, ttl: Optional[int], compute: Callable[[], Awaitable], route: str = None) -> bytes:
+    """
+    Get a cached JSON value, computing and storing it on a miss. Concurrent misses on the same key share one computation,
+    unless it fails because of the request that started it (see get_or_set_bytes).
+
+    :param key: The cache key.
+    :param ttl: The time to live in seconds, or None to keep the value until it is evicted.
+    :param compute: Coroutine function producing the (JSON-serializable) value on a miss.
+    :param route: (optional) the name to count hits/misses under. Defaults to the key.
+    :return: The orjson-encoded value.
+    """
+    async def encoded():
+        return orjson.dumps(await compute())
+
+    return await get_or_set_bytes(key, ttl, encoded, route)
+
+
+async def get_or_set_bytes(key: str, ttl: Optional[int], compute: Callable[[], Awaitable], route: str = None) -> bytes:
+    """
+    Same as get_or_set_json, for values that are already encoded, e.g. binary response bodies.
+
+    :param compute: Coroutine function producing the bytes on a miss.
+    """
+    route = route or key
+    body = _lru_get(key)
+    if body is not None:
+        stats[route]['lru_hits'] += 1
+        return body
+    if key in _in_flight:
+        leader = _in_flight[key]
+        try:
+            return await asyncio.shield(leader)
+        except (asyncio.CancelledError, ClientDisconnectedError, OverloadedError):
+            if not leader.done():
+                # this request itself was cancelled
+                raise
+        # the computation failed for reasons of the leader's own request (its client went away, or it was shed), so this
+        # request computes the value itself
+        return await get_or_set_bytes(key, ttl, compute, route)
+
+    future = asyncio.get_running_loop().create_future()
+    _in_flight[key] = future
+    try:
+        body = await run_query(redis_client.get, CACHE_KEY_PREFIX + key) if redis_client else None
+        if body is not None:
+            stats[route]['redis_hits'] += 1
+        else:
+            stats[route]['misses'] += 1
+            body = await compute()
+            if redis_client:
+                await run_query(redis_client.set, CACHE_KEY_PREFIX + key, body, ex=ttl)
+        _lru_set(key, body, ttl)
+        future.set_result(body)
+        return body
+    except BaseException as e:
+        future.set_exception(e)
+        # mark the exception as retrieved in case nobody else was waiting
+        future.exception()
+        raise
+    finally:
+        del _in_flight[key]
+
+
+def _snap_time_window(params: dict, time_bucket: int):
+    # floor both ends of the window so that "now"-relative queries land on the same key
+    for name in ('min_time', 'max_time'):
+        if params.get(name):
+            params[name] = params[name] - params[name] % time_bucket
+
+
+def _cache_key(path: str, params: dict, ttl: int, time_bucket: Optional[int], depends_on: Optional[tuple]) -> tuple:
+    # snaps the time window in params in place, so the route runs on the same window its entry is keyed on
+    historical = False
+    if time_bucket:
+        _snap_time_window(params, time_bucket)
+        historical = is_historical(params.get('max_time'))
+        if historical:
+            ttl = HISTORICAL_CACHE_TTL
+    query = sorted((name, value) for name, value in params.items() if name != 'request' and value is not None)
+    key = f'{path}?{urlencode(query)}'
+    if depends_on and not historical:
+        key, ttl = versioned(key, ttl, depends_on)
+    return key, ttl
+
+
+class _Uncacheable(Exception):
+    def __init__(self, response: Response):
+        self.response = response
+
+
+def cached(ttl: int, time_bucket: Optional[int] = None, unless: Optional[Callable[[dict], bool]] = None,
+           depends_on: Optional[tuple] = None):
+    """
+    Cache the JSON body of a route, keyed on the route path and its normalized query/path params. Routes must accept a
+    `request: Request` argument. Responses that are already Response objects (e.g. error messages) are not cached.
+
+    :param ttl: The time to live in seconds.
+    :param time_bucket: (optional) if set, min_time/max_time are floored to a multiple of this many seconds before the route
+        runs, and windows whose max_time is historical (see time_windows.is_historical) are cached for
+        time_windows.HISTORICAL_CACHE_TTL.
+    :param unless: (optional) predicate on the route params. If it returns True, the route bypasses the cache, e.g. for
+        streamed responses.
+    :param depends_on: (optional) the collections the route reads, see change_feed.py. If set, entries that are not historical
+        are keyed on the revisions of these collections, and kept for up to change_feed.CHANGE_FEED_MAX_TTL until one of them
+        changes.
+    """
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(**kwargs):
+            request = kwargs['request']
+            if unless is not None and unless(kwargs):
+                return await func(**kwargs)
+            key, entry_ttl = _cache_key(request.url.path, kwargs, ttl, time_bucket, depends_on)
+
+            async def compute():
+                value = await func(**kwargs)
+                if isinstance(value, Response):
+                    raise _Uncacheable(value)
+                return value
+
+            try:
+                body = await get_or_set_json(key, entry_ttl, compute, route=func.__name__)
+            except _Uncacheable as e:
+                return e.response
+            return Response(body, media_type='application/json')
+        return wrapper
+    return decorator
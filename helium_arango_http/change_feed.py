@@ -0,0 +1,110 @@
+"""
+Follow the writes of helium-arango-etl, so that cached results are dropped when the data behind them changes rather than on a
+timer.
+
+Every CHANGE_FEED_POLL_SECONDS, each worker reads the revision of the collections below. Arango bumps a collection's revision
+on every write, so it is a high-water mark that also covers updates, e.g. a hotspot asserting a new location. Cached results
+record the revisions of the collections they were computed from. Keys of shared (LRU/Redis) entries carry them (see versioned),
+and in-process structures compare them on read (see is_current). An entry is then stale as soon as a write lands, and can
+otherwise be kept for CHANGE_FEED_MAX_TTL, since quiet periods no longer need a short TTL.
+
+While the revisions are unknown (inactive, or the last poll failed), everything falls back to its fixed TTL.
+"""
+import os
+from functools import wraps
+from typing import Callable, Optional
+from pyArango.database import Database
+
+
+CHANGE_FEED_ACTIVE = os.getenv('CHANGE_FEED_ACTIVE', 'true').lower() in ('1', 'true')
+CHANGE_FEED_POLL_SECONDS = int(os.getenv('CHANGE_FEED_POLL_SECONDS', 10))
+CHANGE_FEED_MAX_TTL = int(os.getenv('CHANGE_FEED_MAX_TTL', 86400))
+
+# the collections each kind of result is computed from
+PAYMENTS = ('payments',)
+WITNESSES = ('witnesses', 'hotspots')
+HOTSPOTS = ('hotspots',)
+COLLECTIONS = ('payments', 'witnesses', 'hotspots')
+
+# collection -> revision as of the last successful poll. Empty while unknown
+revisions = {}
+
+
+def poll_revisions(database: Database):
+    """
+    Read the current revision of every collection in COLLECTIONS.
+
+    :param database: The pyArango Database instance.
+    """
+    try:
+        current = {name: database[name].revision() for name in COLLECTIONS}
+    except Exception:
+        # without a fresh high-water mark, entries must not outlive their fixed TTL
+        revisions.clear()
+        raise
+    revisions.update(current)
+
+
+def version(collections: tuple) -> Optional[str]:
+    """
+    :param collections: Names from COLLECTIONS.
+    :return: A token that changes whenever any of the collections is written to, or None if unknown.
+    """
+    if not CHANGE_FEED_ACTIVE or not all(name in revisions for name in collections):
+        return None
+    return ','.join(revisions[name] for name in collections)
+
+
+def live_ttl(ttl: int, entry_version: Optional[str]) -> int:
+    """
+    :param ttl: The fixed TTL of an entry.
+    :param entry_version: The version the entry was computed at.
+    :return: How long to keep the entry: CHANGE_FEED_MAX_TTL if it is versioned, since it is invalidated by writes, else ttl.
+    """
+    return ttl if entry_version is None else max(ttl, CHANGE_FEED_MAX_TTL)
+
+
+def versioned(key: str, ttl: int, collections: tuple) -> tuple:
+    """
+    Version the key of a shared cache entry, so that it misses once the collections change.
+
+    :param key: The cache key.
+    :param ttl: The fixed TTL of the entry.
+    :param collections: The collections the entry is computed from.
+    :return: (key, ttl) to store the entry under.
+    """
+    entry_version = version(collections)
+    if entry_version is None:
+        return key, ttl
+    return f'{key}@{entry_version}', live_ttl(ttl, entry_version)
+
+
+def is_current(entry_version: Optional[str], collections: tuple) -> bool:
+    """
+    :param entry_version: The version an in-process entry was computed at, or None if it was computed without one.
+    :param collections: The collections the entry is computed from.
+    :return: False if the entry is versioned and the collections have (or may have) changed since. Unversioned entries are only
+        bound by their TTL.
+    """
+    return entry_version is None or entry_version == version(collections)
+
+
+def when_changed(func: Callable, collections: tuple) -> Callable:
+    """
+    Wrap a periodic job so that it is skipped while the collections it reads have not changed since its last successful run.
+
+    :param func: The (synchronous) job function.
+    :param collections: The collections the job reads.
+    :return: The wrapped job.
+    """
+    last_run = {'version': None}
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        current = version(collections)
+        if current is not None and current == last_run['version']:
+            return None
+        result = func(*args, **kwargs)
+        last_run['version'] = current
+        return result
+    return wrapper
@@ -0,0 +1,122 @@
+"""
+Hotspot clustering, kept off the request path.
+
+Cluster centers for every n_clusters in CLUSTER_COUNTS are precomputed by a background job and updated incrementally as
+hotspots are added. The fits themselves run in a process pool, so they neither hold the GIL of the server process nor block the
+event loop.
+
+The job only runs in the worker that holds the background lock, so the fits are done once and every worker serves the same
+centers. It publishes them to Redis for the other workers. Without Redis, the other workers compute the centers on demand
+instead.
+"""
+import os
+import time
+import logging
+import numpy as np
+import orjson
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+from pyArango.database import Database
+from arango_queries import iter_hotspot_coordinates
+from utils import fit_cluster_model, update_cluster_model, get_cluster_centers
+import cache
+
+
+CLUSTERING_ACTIVE = os.getenv('CLUSTERING_ACTIVE', '').lower() in ('1', 'true')
+CLUSTER_COUNTS = tuple(int(n) for n in os.getenv('CLUSTER_COUNTS', '100,250,500,1000').split(','))
+CLUSTER_REFRESH_SECONDS = int(os.getenv('CLUSTER_REFRESH_SECONDS', 900))
+CLUSTER_WORKERS = int(os.getenv('CLUSTER_WORKERS', 1))
+# once this fraction of hotspots has moved or disappeared, models are refit (warm-started) instead of updated
+CLUSTER_REFIT_FRACTION = 0.05
+CLUSTER_KEY_PREFIX = 'clusters:'
+
+logger = logging.getLogger(__name__)
+
+process_pool = ProcessPoolExecutor(max_workers=CLUSTER_WORKERS)
+
+# n_clusters -> fitted model, and n_clusters -> {'centroids', 'error', 'updated_at'}. Only filled in the worker running the job
+_models = {}
+results = {}
+_coordinates = None
+
+
+def get_coordinate_array(database: Database) -> np.ndarray:
+    """
+    Get the coordinates of all hotspots as a float32 array.
+
+    :param database: The pyArango Database instance.
+    :return: Array of shape (n_hotspots, 2) holding [lon, lat] pairs.
+    """
+    batches = [np.asarray(batch, dtype=np.float32) for batch in iter_hotspot_coordinates(database)]
+    return np.concatenate(batches) if batches else np.empty((0, 2), dtype=np.float32)
+
+
+def _row_ids(coordinates: np.ndarray) -> np.ndarray:
+    # a float32 [lon, lat] pair is 8 bytes, so each row can be compared as a single int64
+    return np.ascontiguousarray(coordinates, dtype=np.float32).view(np.int64).ravel()
+
+
+def refresh_clusters(database: Database):
+    """
+    Bring the precomputed clusters up to date with the hotspots collection. Models are updated with just the added hotspots,
+    unless there are no models yet or many hotspots have moved, in which case they are refit warm-started from the current
+    centers.
+
+    :param database: The pyArango Database instance.
+    """
+    global _coordinates
+    coordinates = get_coordinate_array(database)
+    if _coordinates is None:
+        added, removed = coordinates, 0
+    else:
+        ids, previous_ids = _row_ids(coordinates), _row_ids(_coordinates)
+        added = coordinates[~np.isin(ids, previous_ids)]
+        removed = int(np.count_nonzero(~np.isin(previous_ids, ids)))
+        if len(added) == 0 and removed == 0:
+            return
+
+    futures = {}
+    for n_clusters in CLUSTER_COUNTS:
+        if n_clusters > len(coordinates):
+            continue
+        model = _models.get(n_clusters)
+        if model is None or removed > CLUSTER_REFIT_FRACTION * len(coordinates):
+            init = None if model is None else model.cluster_centers_
+            futures[n_clusters] = process_pool.submit(fit_cluster_model, coordinates, n_clusters, init)
+        else:
+            futures[n_clusters] = process_pool.submit(update_cluster_model, model, coordinates, added)
+    for n_clusters, future in futures.items():
+        model, inertia = future.result()
+        _models[n_clusters] = model
+        results[n_clusters] = {'centroids': model.cluster_centers_.tolist(), 'error': float(inertia),
+                               'updated_at': int(time.time())}
+        # one key per n_clusters in CLUSTER_COUNTS, overwritten by every refresh, so they are kept without expiry
+        if cache.redis_client:
+            cache.redis_client.set(CLUSTER_KEY_PREFIX + str(n_clusters), orjson.dumps(results[n_clusters]))
+    _coordinates = coordinates
+    logger.info(f'Refreshed clusters for {len(coordinates)} hotspots ({len(added)} added, {removed} removed)')
+
+
+def get_precomputed_clusters(n_clusters: int) -> Optional[dict]:
+    """
+    :param n_clusters: The number of clusters.
+    :return: The precomputed {'centroids', 'error', 'updated_at'} for n_clusters, from this worker or Redis, or None if there
+        are none.
+    """
+    if n_clusters in results:
+        return results[n_clusters]
+    if n_clusters not in CLUSTER_COUNTS or not cache.redis_client:
+        return None
+    body = cache.redis_client.get(CLUSTER_KEY_PREFIX + str(n_clusters))
+    return orjson.loads(body) if body is not None else None
+
+
+def compute_cluster_centers(coordinates, n_clusters: int) -> tuple[list, float]:
+    """
+    Same as utils.get_cluster_centers, run in the clustering process pool. Used for n_clusters values that are not precomputed.
+
+    :param coordinates: Array-like of [lon, lat] pairs.
+    :param n_clusters: The number of clusters.
+    :return: The cluster centers and the inertia of the fit.
+    """
+    return process_pool.submit(get_cluster_centers, np.asarray(coordinates, dtype=np.float32), n_clusters).result()
@@ -0,0 +1,145 @@
+import json
+import numpy as np
+
+
+ARROW_STREAM_MEDIA_TYPE = 'application/vnd.apache.arrow.stream'
+MSGPACK_MEDIA_TYPE = 'application/msgpack'
+GRAPH_FORMATS = {'json': 'application/json', 'arrow': ARROW_STREAM_MEDIA_TYPE, 'msgpack': MSGPACK_MEDIA_TYPE}
+GRAPH_TABLES = ('edges', 'nodes')
+SCALAR_TYPES = (str, int, float, bool, type(None))
+
+
+def columnar(rows: list) -> dict:
+    """
+    Convert a list of dicts into parallel arrays, e.g. [{'_from': a, 'snr': 1}, ...] -> {'_from': [a, ...], 'snr': [1, ...]}.
+    Keys are taken from the first row; rows missing a key get None in that column.
+
+    :param rows: The list of dicts, e.g. graph edges.
+    :return: Dict of column name -> list of values.
+    """
+    if not rows:
+        return {}
+    return {key: [row.get(key) for row in rows] for key in rows[0]}
+
+
+def negotiate_graph_format(format: str = None, accept: str = None) -> str:
+    """
+    Pick the graph encoding from an explicit format= param, falling back to the Accept header.
+
+    :param format: (optional) one of GRAPH_FORMATS.
+    :param accept: (optional) the Accept header of the request.
+    :return: One of GRAPH_FORMATS, or None if format= is not supported.
+    """
+    if format:
+        return format if format in GRAPH_FORMATS else None
+    for media_range in (accept or '').split(','):
+        media_type = media_range.split(';')[0].strip()
+        for name, supported in GRAPH_FORMATS.items():
+            if media_type == supported or (name == 'msgpack' and media_type == 'application/x-msgpack'):
+                return name
+    return 'json'
+
+
+def _scalar_columns(rows: list, exclude: tuple = ()) -> dict:
+    # nested values are dropped, except for geo_location which is flattened to lon/lat
+    first_values = {}
+    for row in rows:
+        for key, value in row.items():
+            if key not in first_values and key not in exclude and value is not None:
+                first_values[key] = value
+    columns = {}
+    for key, value in first_values.items():
+        if key == 'geo_location':
+            coordinates = [(row.get(key) or {}).get('coordinates') or [None, None] for row in rows]
+            columns['lon'] = [c[0] for c in coordinates]
+            columns['lat'] = [c[1] for c in coordinates]
+        elif isinstance(value, SCALAR_TYPES):
+            columns[key] = [row.get(key) if isinstance(row.get(key), SCALAR_TYPES) else None for row in rows]
+    return columns
+
+
+def index_graph(nodes: list, edges: list) -> dict:
+    """
+    Dictionary-encode node keys to integer ids (sorted by key, so ids are stable) and express edges as (src, dst) id pairs.
+
+    :param nodes: The list of node documents, each with a _key.
+    :param edges: The list of edges, each with _from and _to node keys.
+    :return: Dict with node_keys, node_columns, src and dst (int32 arrays) and edge_columns.
+    """
+    nodes_by_key = {node['_key']: node for node in nodes}
+    for edge in edges:
+        # edge endpoints that were not returned as nodes still need an id
+        nodes_by_key.setdefault(edge['_from'], {'_key': edge['_from']})
+        nodes_by_key.setdefault(edge['_to'], {'_key': edge['_to']})
+    node_keys = sorted(nodes_by_key)
+    ids = {key: i for i, key in enumerate(node_keys)}
+    return {
+        'node_keys': node_keys,
+        'node_columns': _scalar_columns([nodes_by_key[key] for key in node_keys], exclude=('_key', '_id', '_rev')),
+        'src': np.fromiter((ids[edge['_from']] for edge in edges), dtype=np.int32, count=len(edges)),
+        'dst': np.fromiter((ids[edge['_to']] for edge in edges), dtype=np.int32, count=len(edges)),
+        'edge_columns': _scalar_columns(edges, exclude=('_from', '_to'))
+    }
+
+
+def graph_to_msgpack(nodes: list, edges: list) -> bytes:
+    """
+    Encode a graph as msgpack. src/dst are little-endian int32 buffers, so clients can wrap them with np.frombuffer without
+    copying.
+
+    :param nodes: The list of node documents.
+    :param edges: The list of edges.
+    :return: The msgpack payload: {node_keys, nodes: {column: values}, edges: {src, dst, column: values}}.
+    """
+    import msgpack
+
+    graph = index_graph(nodes, edges)
+    return msgpack.packb({
+        'node_keys': graph['node_keys'],
+        'nodes': graph['node_columns'],
+        'edges': {'src': graph['src'].astype('<i4').tobytes(), 'dst': graph['dst'].astype('<i4').tobytes(),
+                  **graph['edge_columns']}
+    })
+
+
+def _arrow_column(values: list):
+    """
+    :param values: The scalar values of a column of schemaless documents.
+    :return: The Arrow array, with its type inferred from the values. Columns whose values do not share a type (e.g. int and
+        str) fall back to strings: str values as they are, others JSON-encoded.
+    """
+    import pyarrow as pa
+
+    try:
+        return pa.array(values)
+    except (pa.ArrowException, OverflowError):
+        return pa.array([value if value is None or isinstance(value, str) else json.dumps(value) for value in values],
+                        type=pa.string())
+
+
+def graph_to_arrow(nodes: list, edges: list, table: str = 'edges') -> bytes:
+    """
+    Encode one table of a graph as an Arrow IPC stream. The edges table has src/dst columns that are dictionary-encoded against
+    the node keys, so their int32 indices are the node ids. Row i of the nodes table is node id i.
+
+    :param nodes: The list of node documents.
+    :param edges: The list of edges.
+    :param table: Which table to encode, 'edges' or 'nodes'.
+    :return: The Arrow stream.
+    """
+    import pyarrow as pa
+
+    graph = index_graph(nodes, edges)
+    node_keys = pa.array(graph['node_keys'], type=pa.string())
+    if table == 'nodes':
+        columns = {'id': pa.array(np.arange(len(node_keys), dtype=np.int32)), 'key': node_keys,
+                   **{name: _arrow_column(values) for name, values in graph['node_columns'].items()}}
+    else:
+        columns = {'src': pa.DictionaryArray.from_arrays(pa.array(graph['src']), node_keys),
+                   'dst': pa.DictionaryArray.from_arrays(pa.array(graph['dst']), node_keys),
+                   **{name: _arrow_column(values) for name, values in graph['edge_columns'].items()}}
+    arrow_table = pa.table(columns)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, arrow_table.schema) as writer:
+        writer.write_table(arrow_table)
+    return sink.getvalue().to_pybytes()
@@ -0,0 +1,44 @@
+"""
+Dump the EXPLAIN output of every registered AQL query, to confirm which indexes are used.
+
+    python explain_queries.py            # summary of index usage per query
+    python explain_queries.py --json     # full plans
+"""
+import json
+import sys
+from arango_connection import connect
+from arango_queries import explain_registered_queries
+
+
+def summarize_plan(explanation: dict) -> dict:
+    """
+    Reduce an Arango EXPLAIN response down to the parts relevant for index tuning.
+
+    :param explanation: The response from Database.explainAQLQuery.
+    :return: Dict with the estimated cost, collections scanned in full, indexes used and optimizer rules applied.
+    """
+    plan = explanation.get('plan', {})
+    full_scans, indexes = [], []
+    for node in plan.get('nodes', []):
+        if node['type'] == 'EnumerateCollectionNode':
+            full_scans.append(node['collection'])
+        for index in node.get('indexes', []):
+            indexes.append(f"{node.get('collection', node['type'])}: {index['type']}{index.get('fields', [])}")
+        if node['type'] == 'TraversalNode':
+            indexes.append(f"{node['type']}: {[edge['name'] for edge in node.get('edgeCollections', [])]}")
+    return {
+        'estimated_cost': plan.get('estimatedCost'),
+        'full_scans': full_scans,
+        'indexes': indexes,
+        'rules': plan.get('rules', []),
+        'warnings': [warning['message'] for warning in explanation.get('warnings', [])]
+    }
+
+
+if __name__ == '__main__':
+    explanations = explain_registered_queries(connect())
+    if '--json' in sys.argv:
+        print(json.dumps(explanations, indent=2))
+    else:
+        for name, explanation in explanations.items():
+            print(name, json.dumps(summarize_plan(explanation), indent=2))
@@ -0,0 +1,31 @@
+"""
+Production entry point: one uvicorn worker process per core, each with its own Arango/Redis connection pools and query threads.
+
+    gunicorn -c gunicorn.conf.py server:app
+
+To aggregate /metrics across workers, point PROMETHEUS_MULTIPROC_DIR at an empty directory that the workers can write to.
+"""
+import multiprocessing
+import os
+import secrets
+
+
+bind = os.getenv('BIND', '0.0.0.0:8000')
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+# inherited by the workers, e.g. so that pagination knows whether state kept in process can serve every request
+os.environ['WEB_CONCURRENCY'] = str(workers)
+# every worker must sign and verify pagination cursors with the same key
+os.environ.setdefault('CURSOR_SECRET', secrets.token_hex(32))
+worker_class = 'uvicorn.workers.UvicornWorker'
+# each worker connects in its startup hook; preloading would share sockets across the fork
+preload_app = False
+# long analytical queries are bounded by QUERY_TIMEOUT_SECONDS, so only restart workers that are well past it
+timeout = int(os.getenv('QUERY_TIMEOUT_SECONDS', 60)) + 30
+graceful_timeout = 30
+keepalive = 5
+
+
+def child_exit(server, worker):
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,229 @@
+"""
+Precomputed H3 cells for every hotspot, so hex and proximity queries become index lookups instead of geo scans.
+
+The cells are kept in the hotspot_cells collection, which is owned by this service rather than helium-arango-etl: one document
+per hotspot, keyed by the hotspot's _key, with an h3_r{resolution} field for every resolution in H3_RESOLUTIONS, each backed by
+a persistent index. They are (re)computed for hotspots that are new or have moved since they were last indexed, and removed for
+hotspots that are gone, so ETL replaces never drop them and writing them never invalidates what is cached on the hotspots
+collection.
+"""
+import os
+from pyArango.database import Database
+from arango_queries import register_query, run_registered, _fetch_graph, NODE_PROJECTION, get_witness_graph_in_hex, \
+    get_witness_graph_near_coordinates
+
+
+H3_INDEX_ACTIVE = os.getenv('H3_INDEX_ACTIVE', '').lower() in ('1', 'true')
+H3_RESOLUTIONS = tuple(sorted(int(r) for r in os.getenv('H3_RESOLUTIONS', '4,6,8,10').split(',')))
+H3_REFRESH_SECONDS = int(os.getenv('H3_REFRESH_SECONDS', 600))
+H3_UPDATE_BATCH_SIZE = 10000
+H3_COLLECTION = 'hotspot_cells'
+# the max number of k-rings searched around the query point before falling back to a coarser resolution
+NEAREST_MAX_RINGS = 8
+
+EXAMPLE_CELLS = {'h3_field': 'h3_r8', 'cells': ['882a100d25fffff']}
+EXAMPLE_NEAREST = {**EXAMPLE_CELLS, 'lat': 40.689306, 'lon': -74.0445, 'limit': 10}
+
+
+def h3_field(resolution: int) -> str:
+    return f'h3_r{resolution}'
+
+
+def ensure_h3_indexes(database: Database):
+    """
+    Create the hotspot_cells collection, and the persistent indexes on its per-resolution H3 fields, if they do not exist.
+
+    :param database: The pyArango Database instance.
+    """
+    if not database.hasCollection(H3_COLLECTION):
+        database.createCollection(name=H3_COLLECTION)
+    for resolution in H3_RESOLUTIONS:
+        database[H3_COLLECTION].ensurePersistentIndex([h3_field(resolution)], sparse=True)
+
+
+HOTSPOTS_TO_INDEX = register_query('hotspots_to_h3_index', """for hotspot in hotspots
+    filter hotspot.geo_location.coordinates != null
+    filter DOCUMENT('hotspot_cells', hotspot._key).coordinates != hotspot.geo_location.coordinates
+    limit @limit
+    return {_key: hotspot._key, coordinates: hotspot.geo_location.coordinates}""", {'limit': H3_UPDATE_BATCH_SIZE})
+
+UPDATE_HOTSPOT_CELLS = register_query('update_hotspot_h3_cells', """for doc in @docs
+    upsert {_key: doc._key} insert doc replace doc in hotspot_cells""", {'docs': []})
+
+REMOVE_STALE_HOTSPOT_CELLS = register_query('remove_stale_hotspot_h3_cells', """for cell in hotspot_cells
+    let hotspot = DOCUMENT('hotspots', cell._key)
+    filter hotspot == null or hotspot.geo_location.coordinates == null
+    remove cell in hotspot_cells""")
+
+
+def update_hotspot_cells(database: Database) -> int:
+    """
+    Compute the H3 cells of every hotspot that is new or has moved since it was last indexed, and drop those of removed
+    hotspots.
+
+    :param database: The pyArango Database instance.
+    :return: The number of hotspots updated.
+    """
+    import h3
+    updated = 0
+    while True:
+        hotspots = run_registered(database, HOTSPOTS_TO_INDEX, {'limit': H3_UPDATE_BATCH_SIZE}, raise_if_empty=False)
+        if not hotspots:
+            break
+        docs = []
+        for hotspot in hotspots:
+            lon, lat = hotspot['coordinates']
+            doc = {'_key': hotspot['_key'], 'coordinates': hotspot['coordinates']}
+            for resolution in H3_RESOLUTIONS:
+                doc[h3_field(resolution)] = h3.geo_to_h3(lat, lon, resolution)
+            docs.append(doc)
+        run_registered(database, UPDATE_HOTSPOT_CELLS, {'docs': docs}, raise_if_empty=False)
+        updated += len(docs)
+    run_registered(database, REMOVE_STALE_HOTSPOT_CELLS, raise_if_empty=False)
+    return updated
+
+
+def cells_for_hex(hex: str):
+    """
+    Express a hex as a list of cells at a stored resolution. A hex coarser than the stored resolutions is expanded to its
+    children at the nearest stored resolution.
+
+    :param hex: An h3 hex.
+    :return: (resolution, cells), or None if the hex is finer than every stored resolution.
+    """
+    import h3
+    resolution = h3.h3_get_resolution(hex)
+    stored = [r for r in H3_RESOLUTIONS if r >= resolution]
+    if not stored:
+        return None
+    if stored[0] == resolution:
+        return resolution, [hex]
+    return stored[0], list(h3.h3_to_children(hex, stored[0]))
+
+
+NEAREST_IN_CELLS = register_query('nearest_hotspot_in_h3_cells', """let distances = (for cell in hotspot_cells
+        filter cell.@h3_field in @cells
+        let distance = GEO_DISTANCE([@lon, @lat], cell.coordinates)
+        sort distance
+        limit @limit
+        return distance)
+    RETURN {count: LENGTH(distances), distance: LAST(distances)}""", EXAMPLE_NEAREST)
+
+
+def _outside_distance(lat: float, lon: float, origin: str, k: int) -> float:
+    """
+    :return: A lower bound, in meters, on the distance from the query coordinate to any point outside the k-ring of origin.
+        Such a point is at least as far as the ring just outside it, and a cell is at least as far as its center minus its
+        circumradius.
+    """
+    import h3
+    bound = float('inf')
+    for cell in h3.hex_ring(origin, k + 1):
+        center = h3.h3_to_geo(cell)
+        radius = max(h3.point_dist(center, vertex, unit='m') for vertex in h3.h3_to_geo_boundary(cell))
+        bound = min(bound, h3.point_dist((lat, lon), center, unit='m') - radius)
+    return bound
+
+
+def cells_near_coordinates(database: Database, lat: float, lon: float, limit: int):
+    """
+    Find a set of cells that is guaranteed to contain the nearest `limit` hotspots to a coordinate. Starting from the finest
+    stored resolution, the k-ring around the query point is widened until the `limit`-th nearest hotspot inside it is closer
+    than any point outside it.
+
+    :param database: The pyArango Database instance.
+    :param lat: The latitude of the query coordinate.
+    :param lon: The longitude of the query coordinate.
+    :param limit: The number of nearby hotspots needed.
+    :return: (resolution, cells), or None if no resolution holds enough hotspots within NEAREST_MAX_RINGS rings.
+    """
+    import h3
+    for resolution in reversed(H3_RESOLUTIONS):
+        origin = h3.geo_to_h3(lat, lon, resolution)
+        for k in range(1, NEAREST_MAX_RINGS + 1):
+            cells = list(h3.k_ring(origin, k))
+            nearest = run_registered(database, NEAREST_IN_CELLS, {'h3_field': h3_field(resolution), 'cells': cells, 'lat': lat,
+                                                                  'lon': lon, 'limit': limit})[0]
+            if nearest['count'] < limit:
+                # too sparse at this resolution
+                break
+            if nearest['distance'] <= _outside_distance(lat, lon, origin, k):
+                return resolution, cells
+    return None
+
+
+WITNESS_GRAPH_IN_CELLS = register_query('witness_graph_in_h3_cells', """let hotspots_in_cells = (for cell in hotspot_cells
+        filter cell.@h3_field in @cells
+        let hotspot = DOCUMENT('hotspots', cell._key)
+        filter hotspot != null
+        return hotspot)
+    return {
+        nodes: (for node in hotspots_in_cells return @fields == null ? node : KEEP(node, @fields)),
+        edges: (for hotspot in hotspots_in_cells
+            for v, e, p in 1..1 outbound hotspot witnesses
+                let witness_cell = DOCUMENT('hotspot_cells', v._key)
+                filter witness_cell.@h3_field in @cells
+                let distance_m = GEO_DISTANCE(p.vertices[0].geo_location, p.vertices[1].geo_location)
+                RETURN {_from: last(split(e._from, '/')), _to: last(split(e._to, '/')),
+                        snr: e.snr == null ? null : ROUND(e.snr * 10) / 10, rssi: e.signal,
+                        distance_m: distance_m == null ? null : ROUND(distance_m)})
+    }""", {**EXAMPLE_CELLS, 'fields': None})
+
+
+def get_witness_graph_in_hex_indexed(database: Database, hex: str, fields: list = None):
+    """
+    Same as arango_queries.get_witness_graph_in_hex, using the precomputed H3 cells. Hexes coarser than the stored resolutions
+    are supported by H3 parent/child containment; hexes finer than every stored resolution fall back to the polygon query.
+
+    :param database: The pyArango Database instance.
+    :param hex: An h3 hex to consider.
+    :param fields: (optional) the hotspot fields to include in each node. Defaults to the full document.
+    :return: (nodes, edges) lists of the graph.
+    """
+    lookup = cells_for_hex(hex)
+    if lookup is None:
+        return get_witness_graph_in_hex(database, hex, fields)
+    resolution, cells = lookup
+    return _fetch_graph(database, WITNESS_GRAPH_IN_CELLS, {'h3_field': h3_field(resolution), 'cells': cells}, fields)
+
+
+WITNESS_GRAPH_NEAR_COORDINATES_IN_CELLS = register_query('witness_graph_near_coordinates_in_h3_cells', """
+    LET queryCoords = GEO_POINT(@lon, @lat)
+    let edges = (FOR cell IN hotspot_cells
+        FILTER cell.@h3_field in @cells
+        let hotspot = DOCUMENT('hotspots', cell._key)
+        FILTER hotspot != null
+        SORT GEO_DISTANCE(queryCoords, hotspot.geo_location)
+        LIMIT @limit
+        for v, e, p in 1..1 outbound hotspot witnesses
+            sort e._from
+            let distance_m = GEO_DISTANCE(p.vertices[0].geo_location, p.vertices[1].geo_location)
+            RETURN {_from: e._from, _to: e._to, snr: e.snr == null ? null : ROUND(e.snr * 10) / 10, rssi: e.signal,
+                    distance_m: distance_m == null ? null : ROUND(distance_m)})
+    return {
+        nodes: (for id in UNIQUE(APPEND(edges[*]._from, edges[*]._to)) return """ + NODE_PROJECTION + """),
+        edges: (for edge in edges return MERGE(edge, {_from: last(split(edge._from,'/')), _to: last(split(edge._to,'/'))}))
+    }""", {**EXAMPLE_CELLS, 'lat': 40.689306, 'lon': -74.0445, 'limit': 10, 'fields': None})
+
+
+def get_witness_graph_near_coordinates_indexed(database: Database, lat: float, lon: float, limit: int = 10,
+                                               fields: list = None):
+    """
+    Same as arango_queries.get_witness_graph_near_coordinates, using k-ring expansion over the precomputed H3 cells instead of
+    sorting every hotspot by distance. The candidates are still sorted by GEO_DISTANCE, so the result is exact, see
+    cells_near_coordinates.
+
+    :param database: The pyArango Database instance.
+    :param lat: The latitude of the query coordinate.
+    :param lon: The longitude of the query coordinate.
+    :param limit: The max number of nearby hotspots to seed the graph. Note that the nodes list will also include any
+        witnesses.
+    :param fields: (optional) the hotspot fields to include in each node. Defaults to the full document.
+    :return: (nodes, edges) lists of the graph.
+    """
+    lookup = cells_near_coordinates(database, lat, lon, limit)
+    if lookup is None:
+        return get_witness_graph_near_coordinates(database, lat, lon, limit, fields)
+    resolution, cells = lookup
+    return _fetch_graph(database, WITNESS_GRAPH_NEAR_COORDINATES_IN_CELLS,
+                        {'h3_field': h3_field(resolution), 'cells': cells, 'lat': lat, 'lon': lon, 'limit': limit}, fields)
@@ -1,7 +1,8 @@
 title = 'helium-arango-http'
 
 description = """
-A RESTful API providing routes for blockchain data stored in a native graph database, which is populated by [`helium-arango-etl`](https://github.com/evandiewald/helium-arango-etl).
+A RESTful API providing routes for blockchain data stored in a native graph database, which is populated by
+[`helium-arango-etl`](https://github.com/evandiewald/helium-arango-etl).
 """
 
 version = '0.0.1'
@@ -24,5 +25,9 @@ tags_metadata = [
     {
         'name': 'hotspots',
         'description': 'Get information about hotspot adjacency, expressed as witness paths.'
+    },
+    {
+        'name': 'service',
+        'description': 'Operational endpoints for monitoring the API itself.'
     }
 ]
@@ -0,0 +1,127 @@
+"""
+Prometheus metrics for the API: per-route latency, Arango round trips and AQL execution stats, and response cache hit ratios.
+
+Per-request Arango accounting is collected in a context variable, which query_executor.run_query carries over to the worker
+threads.
+"""
+import os
+import time
+from contextvars import ContextVar
+from typing import Optional
+from prometheus_client import CollectorRegistry, Counter, Histogram, REGISTRY, generate_latest, multiprocess
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from cache import stats as cache_stats
+
+
+SERVER_TIMING = os.getenv('SERVER_TIMING', '').lower() in ('1', 'true')
+
+REQUEST_LATENCY = Histogram('http_request_duration_seconds', 'Time to produce a response, by route.',
+                            ['route', 'method', 'status'])
+REQUEST_ROUND_TRIPS = Histogram('http_request_arango_round_trips', 'Arango HTTP round trips per request, by route.', ['route'],
+                                buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100, 500))
+REQUEST_ARANGO_SECONDS = Histogram('http_request_arango_seconds', 'Time spent waiting on Arango per request, by route.',
+                                   ['route'])
+REQUEST_ROWS = Histogram('http_request_rows', 'Rows returned by Arango per request, by route.', ['route'],
+                         buckets=(0, 1, 10, 100, 1000, 10000, 100000, 1000000))
+
+QUERY_DURATION = Histogram('arango_query_duration_seconds', 'Wall time of each query, including every batch.', ['query'])
+QUERY_ROUND_TRIPS = Counter('arango_query_round_trips', 'Arango HTTP round trips (cursor batches).', ['query'])
+QUERY_ROWS = Counter('arango_query_rows', 'Rows returned by Arango.', ['query'])
+AQL_SCANNED_FULL = Counter('aql_scanned_full', 'Documents read by full collection scans, from the cursor stats.', ['query'])
+AQL_SCANNED_INDEX = Counter('aql_scanned_index', 'Documents read from indexes, from the cursor stats.', ['query'])
+AQL_EXECUTION_SECONDS = Histogram('aql_execution_seconds', 'Server-side execution time, from the cursor stats.', ['query'])
+AQL_PEAK_MEMORY = Histogram('aql_peak_memory_bytes', 'Peak memory usage, from the cursor stats.', ['query'],
+                            buckets=tuple(2 ** n for n in range(16, 34, 2)))
+
+# the Arango accounting of the request currently being handled, if any
+request_timing: ContextVar[Optional[dict]] = ContextVar('request_timing', default=None)
+
+
+def record_query(name: str, seconds: float, round_trips: int, rows: int, aql_stats: Optional[dict]):
+    """
+    Record one executed query, against both the query metrics and the request it was run for.
+
+    :param name: The registered name of the query.
+    :param seconds: The wall time of the query, including every batch.
+    :param round_trips: The number of HTTP round trips to Arango.
+    :param rows: The number of rows returned.
+    :param aql_stats: (optional) the stats from the 'extra' of the cursor response.
+    """
+    QUERY_DURATION.labels(name).observe(seconds)
+    QUERY_ROUND_TRIPS.labels(name).inc(round_trips)
+    QUERY_ROWS.labels(name).inc(rows)
+    if aql_stats:
+        AQL_SCANNED_FULL.labels(name).inc(aql_stats.get('scannedFull', 0))
+        AQL_SCANNED_INDEX.labels(name).inc(aql_stats.get('scannedIndex', 0))
+        if 'executionTime' in aql_stats:
+            AQL_EXECUTION_SECONDS.labels(name).observe(aql_stats['executionTime'])
+        if 'peakMemoryUsage' in aql_stats:
+            AQL_PEAK_MEMORY.labels(name).observe(aql_stats['peakMemoryUsage'])
+    timing = request_timing.get()
+    if timing is not None:
+        timing['round_trips'] += round_trips
+        timing['arango_seconds'] += seconds
+        timing['rows'] += rows
+
+
+def start_request() -> dict:
+    timing = {'started_at': time.perf_counter(), 'round_trips': 0, 'arango_seconds': 0.0, 'rows': 0}
+    request_timing.set(timing)
+    return timing
+
+
+def finish_request(timing: dict, route: str, method: str, status: int) -> Optional[str]:
+    """
+    Record a handled request.
+
+    :param timing: The accounting returned by start_request.
+    :param route: The name of the route, or 'unmatched'.
+    :param method: The HTTP method.
+    :param status: The response status code.
+    :return: The Server-Timing header value, if SERVER_TIMING is enabled.
+    """
+    seconds = time.perf_counter() - timing['started_at']
+    REQUEST_LATENCY.labels(route, method, status).observe(seconds)
+    REQUEST_ROUND_TRIPS.labels(route).observe(timing['round_trips'])
+    REQUEST_ARANGO_SECONDS.labels(route).observe(timing['arango_seconds'])
+    REQUEST_ROWS.labels(route).observe(timing['rows'])
+    if not SERVER_TIMING:
+        return None
+    return (f'arango;dur={timing["arango_seconds"] * 1000:.1f};'
+            f'desc="{timing["round_trips"]} round trips, {timing["rows"]} rows", total;dur={seconds * 1000:.1f}')
+
+
+class CacheCollector:
+    """Exposes the response cache counters of cache.stats, plus the hit ratio of each route."""
+
+    def collect(self):
+        lookups = CounterMetricFamily('response_cache_lookups', 'Response cache lookups, by route and result.',
+                                      labels=['route', 'result'])
+        hit_ratio = GaugeMetricFamily('response_cache_hit_ratio', 'Fraction of lookups served from either cache tier.',
+                                      labels=['route'])
+        for route, counts in list(cache_stats.items()):
+            for result, count in counts.items():
+                lookups.add_metric([route, result], count)
+            total = sum(counts.values())
+            if total:
+                hit_ratio.add_metric([route], (counts['lru_hits'] + counts['redis_hits']) / total)
+        yield lookups
+        yield hit_ratio
+
+
+REGISTRY.register(CacheCollector())
+
+
+def render_metrics() -> bytes:
+    """
+    Render every metric in the Prometheus text format. Under gunicorn, set PROMETHEUS_MULTIPROC_DIR so that the counters and
+    histograms are aggregated across worker processes. The response cache metrics are always those of the worker answering.
+
+    :return: The exposition body.
+    """
+    if not os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        return generate_latest()
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    registry.register(CacheCollector())
+    return generate_latest(registry)
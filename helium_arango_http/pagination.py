@@ -0,0 +1,220 @@
+"""
+Cursor-based pagination with opaque continuation tokens.
+
+Receipts are paged by keyset: the token holds the (time, _key) of the last receipt returned, and the next page starts right
+after it on the [time, _key] index. Top-N aggregates cannot be resumed that way, so the first page materializes the next
+MATERIALIZED_PAGES pages of the ordered result in chunks, and the token holds the result id and offset, so those pages cost
+O(page), not O(offset). Past them, or when the chunks cannot be shared by every worker (several workers without Redis), the
+token only holds the offset and each page re-runs the query up to it, to at most MAX_MATERIALIZED_ROWS rows. Either way, the
+first page pins an open-ended window to the time it was served, so every page of a chain covers the same window.
+
+Tokens are signed with CURSOR_SECRET, so clients cannot forge an offset or a result id.
+"""
+import base64
+import binascii
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+import time
+import uuid
+from functools import partial
+from typing import Callable, Optional
+import orjson
+from pyArango.database import Database
+from arango_queries import register_query, run_registered, EXAMPLE_HOTSPOT
+from time_windows import resolve_max_time
+import cache
+
+
+PAGE_RESULT_TTL_SECONDS = int(os.getenv('PAGE_RESULT_TTL_SECONDS', 900))
+MAX_MATERIALIZED_ROWS = int(os.getenv('MAX_MATERIALIZED_ROWS', 100000))
+# the first page materializes this many pages of rows, so the cost of a first page is bounded by its limit
+MATERIALIZED_PAGES = int(os.getenv('MATERIALIZED_PAGES', 10))
+# set for every worker by gunicorn.conf.py. Chunks kept in process can only serve the next page if there is a single worker
+WORKERS = int(os.getenv('WEB_CONCURRENCY', 1))
+MATERIALIZED_CHUNK_SIZE = 1000
+# gunicorn.conf.py generates one for all workers if unset. Set it to keep cursors valid across restarts and hosts
+CURSOR_SECRET = os.getenv('CURSOR_SECRET') or secrets.token_hex(32)
+CURSOR_SIGNATURE_BYTES = 16
+PAGE_KEY_PREFIX = 'page:'
+
+# sort after every real (time, _key), so the first page needs no special case
+FIRST_PAGE = {'time': 2 ** 53, 'key': '\uffff'}
+
+
+class InvalidCursorError(Exception):
+    """Raised when a continuation token is malformed, forged, belongs to another route or has expired."""
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+
+def _signature(payload: str) -> str:
+    digest = hmac.new(CURSOR_SECRET.encode(), payload.encode(), hashlib.sha256).digest()
+    return _b64encode(digest[:CURSOR_SIGNATURE_BYTES])
+
+
+def encode_cursor(state: dict) -> str:
+    payload = _b64encode(orjson.dumps(state))
+    return f'{payload}.{_signature(payload)}'
+
+
+def decode_cursor(cursor: str) -> dict:
+    payload, _, signature = cursor.partition('.')
+    if not hmac.compare_digest(signature.encode(), _signature(payload).encode()):
+        raise InvalidCursorError(cursor)
+    try:
+        state = orjson.loads(base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4)))
+    except (binascii.Error, ValueError):
+        raise InvalidCursorError(cursor)
+    if not isinstance(state, dict):
+        raise InvalidCursorError(cursor)
+    return state
+
+
+# materialized chunks live in Redis when it is active, so any worker can serve the next page, otherwise in this process
+_chunks = {}
+_chunks_lock = threading.Lock()
+
+
+def _store_chunk(key: str, body: bytes):
+    if cache.redis_client:
+        cache.redis_client.set(PAGE_KEY_PREFIX + key, body, ex=PAGE_RESULT_TTL_SECONDS)
+        return
+    now = time.monotonic()
+    with _chunks_lock:
+        for expired in [k for k, (expires_at, _) in _chunks.items() if expires_at < now]:
+            del _chunks[expired]
+        _chunks[key] = (now + PAGE_RESULT_TTL_SECONDS, body)
+
+
+def _load_chunk(key: str) -> Optional[bytes]:
+    if cache.redis_client:
+        return cache.redis_client.get(PAGE_KEY_PREFIX + key)
+    with _chunks_lock:
+        expires_at, body = _chunks.get(key, (0, None))
+    return body if expires_at >= time.monotonic() else None
+
+
+def can_share_chunks() -> bool:
+    return cache.redis_client is not None or WORKERS == 1
+
+
+def _materialized_rows(state: dict, limit: int, cursor: str) -> list:
+    offset, end = state['offset'], min(state['offset'] + limit, state['total'])
+    rows = []
+    for chunk in range(offset // MATERIALIZED_CHUNK_SIZE, (end - 1) // MATERIALIZED_CHUNK_SIZE + 1):
+        body = _load_chunk(f"{state['id']}:{chunk}")
+        if body is None:
+            raise InvalidCursorError(cursor)
+        rows.extend(orjson.loads(body))
+    skip = offset % MATERIALIZED_CHUNK_SIZE
+    return rows[skip:skip + end - offset]
+
+
+def get_materialized_page(scope: str, compute: Callable[..., list], limit: int, cursor: str = None,
+                          max_time: Optional[int] = None) -> tuple:
+    """
+    Page through an ordered result that can only be computed as a whole, e.g. a top-N aggregation.
+
+    :param scope: Identifies the route the cursor belongs to, e.g. the request path.
+    :param compute: Function of (n, max_time=...) returning the first n rows of the result, e.g.
+        partial(get_top_payers, db, min_time=...). Called for the first page, and for pages past the materialized ones.
+    :param limit: The max number of rows in the page.
+    :param cursor: (optional) the continuation token of the previous page.
+    :param max_time: (optional) the maximum UTC timestamp of the window, or None for "up to now". Only read on the first page,
+        later pages use the one pinned in the cursor.
+    :return: (rows, next cursor). The next cursor is None on the last page.
+    """
+    if cursor is None:
+        state = {'scope': scope, 'offset': 0, 'max_time': resolve_max_time(max_time)}
+        compute = partial(compute, max_time=state['max_time'])
+        if can_share_chunks():
+            depth = min(MATERIALIZED_PAGES * limit, MAX_MATERIALIZED_ROWS)
+            # one extra row tells whether the result goes on past the materialized pages
+            rows = compute(depth + 1)
+            state.update(id=uuid.uuid4().hex, total=min(len(rows), depth), more=len(rows) > depth)
+            for i in range(0, state['total'], MATERIALIZED_CHUNK_SIZE):
+                chunk = rows[i:min(i + MATERIALIZED_CHUNK_SIZE, depth)]
+                _store_chunk(f"{state['id']}:{i // MATERIALIZED_CHUNK_SIZE}", orjson.dumps(chunk))
+    else:
+        state = decode_cursor(cursor)
+        if state.get('scope') != scope or not isinstance(state.get('offset'), int) or state['offset'] < 0:
+            raise InvalidCursorError(cursor)
+        if not isinstance(state.get('max_time'), int):
+            raise InvalidCursorError(cursor)
+        compute = partial(compute, max_time=state['max_time'])
+        if 'id' in state and not (isinstance(state['id'], str) and isinstance(state.get('total'), int)):
+            raise InvalidCursorError(cursor)
+
+    offset = state['offset']
+    if 'id' in state and (cursor is None or offset < state['total']):
+        page = rows[:min(limit, state['total'])] if cursor is None else _materialized_rows(state, limit, cursor)
+        offset += len(page)
+        more = offset < state['total'] or state['more']
+    else:
+        # re-run the query up to the end of the page, plus one row to tell whether there is another one
+        end = min(offset + limit, MAX_MATERIALIZED_ROWS)
+        rows = compute(end + 1) if offset < end else []
+        page = rows[offset:end]
+        offset += len(page)
+        more = len(rows) > end and end < MAX_MATERIALIZED_ROWS
+    if not page or not more:
+        return page, None
+    if 'id' in state and offset < state['total']:
+        return page, encode_cursor({**state, 'offset': offset})
+    return page, encode_cursor({'scope': scope, 'offset': offset, 'max_time': state['max_time']})
+
+
+def ensure_pagination_indexes(database: Database):
+    """
+    Create the indexes that keyset pagination of receipts relies on.
+
+    :param database: The pyArango Database instance.
+    """
+    database['witnesses'].ensurePersistentIndex(['time', '_key'], sparse=False)
+    database['witnesses'].ensurePersistentIndex(['gateway', 'time', '_key'], sparse=False)
+
+
+WITNESS_RECEIPTS_PAGE = register_query('witness_receipts_page', """for witness in witnesses
+    filter witness.time <= @after_time
+    filter witness.time < @after_time or witness._key < @after_key
+    sort witness.time desc, witness._key desc
+    limit @limit
+    return witness""", {'after_time': FIRST_PAGE['time'], 'after_key': FIRST_PAGE['key'], 'limit': 1000})
+
+WITNESS_RECEIPTS_PAGE_FOR_HOTSPOT = register_query('witness_receipts_page_for_hotspot', """for witness in witnesses
+    filter witness.gateway == @address and witness.time <= @after_time
+    filter witness.time < @after_time or witness._key < @after_key
+    sort witness.time desc, witness._key desc
+    limit @limit
+    return witness""", {'address': EXAMPLE_HOTSPOT, 'after_time': FIRST_PAGE['time'], 'after_key': FIRST_PAGE['key'],
+                        'limit': 1000})
+
+
+def get_witness_receipts_page(database: Database, address: str = None, limit: int = 1000, cursor: str = None) -> tuple:
+    """
+    Get a page of witness receipts, most recent first.
+
+    :param database: The pyArango Database instance.
+    :param address: (optional) if specified, results will only include receipts in which this hotspot was a witness.
+    :param limit: The max number of receipts in the page.
+    :param cursor: (optional) the continuation token of the previous page.
+    :return: (receipts, next cursor). The next cursor is None on the last page.
+    """
+    after = FIRST_PAGE if cursor is None else decode_cursor(cursor)
+    if not isinstance(after.get('time'), (int, float)) or not isinstance(after.get('key'), str):
+        raise InvalidCursorError(cursor)
+    bind_vars = {'after_time': after['time'], 'after_key': after['key'], 'limit': limit}
+    if not address:
+        receipts = run_registered(database, WITNESS_RECEIPTS_PAGE, bind_vars, raise_if_empty=cursor is None)
+    else:
+        receipts = run_registered(database, WITNESS_RECEIPTS_PAGE_FOR_HOTSPOT, {**bind_vars, 'address': address},
+                                  raise_if_empty=cursor is None)
+    next_cursor = None
+    if len(receipts) == limit:
+        next_cursor = encode_cursor({'time': receipts[-1]['time'], 'key': receipts[-1]['_key']})
+    return receipts, next_cursor
@@ -0,0 +1,150 @@
+import asyncio
+import contextvars
+import fcntl
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Callable, Optional
+from starlette.requests import Request
+
+
+# pyArango is synchronous, so queries are run on a bounded pool of worker threads instead of on the event loop
+QUERY_WORKERS = int(os.getenv('QUERY_WORKERS', 16))
+QUERY_TIMEOUT_SECONDS = float(os.getenv('QUERY_TIMEOUT_SECONDS', 60))
+DISCONNECT_POLL_SECONDS = 0.25
+# queries of requests beyond this many waiting for a worker are shed with 503, rather than queued behind minutes of work
+QUERY_QUEUE_DEPTH = int(os.getenv('QUERY_QUEUE_DEPTH', 4 * QUERY_WORKERS))
+RETRY_AFTER_SECONDS = int(os.getenv('RETRY_AFTER_SECONDS', 5))
+# background jobs (index builds, rollups, snapshot refreshes, ...) run without a timeout, so they get their own small pool
+# instead of holding query workers for minutes
+BACKGROUND_WORKERS = int(os.getenv('BACKGROUND_WORKERS', 2))
+# with several worker processes, only the one holding this lock runs the background jobs that write to Arango
+BACKGROUND_LOCK_FILE = os.getenv('BACKGROUND_LOCK_FILE', '/tmp/helium-arango-http.lock')
+
+logger = logging.getLogger(__name__)
+
+executor = ThreadPoolExecutor(max_workers=QUERY_WORKERS, thread_name_prefix='arango-query')
+background_executor = ThreadPoolExecutor(max_workers=BACKGROUND_WORKERS, thread_name_prefix='arango-background')
+# the number of queries submitted to the executor that have not finished yet, running or waiting
+pending = 0
+
+
+class QueryTimeoutError(Exception):
+    """Raised when a query does not complete within its timeout."""
+
+
+class ClientDisconnectedError(Exception):
+    """Raised when the client goes away before its query has completed."""
+
+
+class OverloadedError(Exception):
+    """Raised to shed a request instead of queueing it. Answered with status_code and a Retry-After header."""
+    def __init__(self, status_code: int, message: str):
+        super().__init__(message)
+        self.status_code = status_code
+        self.message = message
+
+
+async def _wait_for_disconnect(request: Request):
+    while not await request.is_disconnected():
+        await asyncio.sleep(DISCONNECT_POLL_SECONDS)
+
+
+def _finished(future):
+    global pending
+    pending -= 1
+
+
+async def run_query(func: Callable, *args, request: Optional[Request] = None, timeout: Optional[float] = QUERY_TIMEOUT_SECONDS,
+                    **kwargs):
+    """
+    Run a blocking query function on the query executor without stalling the event loop.
+
+    :param func: The (synchronous) query function, e.g. one of the get_* functions in arango_queries.py.
+    :param args: Positional arguments for func.
+    :param request: (optional) the incoming request. If supplied, the query is abandoned as soon as the client disconnects, and
+        OverloadedError is raised instead of queueing it if QUERY_QUEUE_DEPTH queries are already waiting for a worker.
+    :param timeout: The max number of seconds to wait for a result, or None to wait indefinitely.
+    :param kwargs: Keyword arguments for func.
+    :return: The return value of func.
+    """
+    global pending
+    if request is not None and pending >= QUERY_WORKERS + QUERY_QUEUE_DEPTH:
+        raise OverloadedError(503, 'Server overloaded')
+    loop = asyncio.get_running_loop()
+    # run in a copy of the caller's context, so per-request accounting (see metrics.py) follows the query onto the worker
+    future = loop.run_in_executor(executor, contextvars.copy_context().run, partial(func, *args, **kwargs))
+    pending += 1
+    future.add_done_callback(_finished)
+    waiters = {future}
+    watcher = None
+    if request is not None:
+        watcher = asyncio.ensure_future(_wait_for_disconnect(request))
+        waiters.add(watcher)
+    try:
+        done, _ = await asyncio.wait(waiters, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        if watcher is not None:
+            watcher.cancel()
+    if future in done:
+        return future.result()
+    # the worker thread cannot be interrupted, but Arango aborts the query itself once maxRuntime is exceeded
+    future.cancel()
+    if watcher is not None and watcher in done:
+        raise ClientDisconnectedError
+    raise QueryTimeoutError(f'Query did not complete within {timeout} seconds')
+
+
+async def run_background(func: Callable, *args, **kwargs):
+    """
+    Run a blocking background job on the background executor, without a timeout. It does not take a query worker, nor count
+    towards QUERY_QUEUE_DEPTH.
+
+    :param func: The (synchronous) job function.
+    :param args: Positional arguments for func.
+    :param kwargs: Keyword arguments for func.
+    :return: The return value of func.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(background_executor, partial(func, *args, **kwargs))
+
+
+async def run_periodically(func: Callable, interval_seconds: float, *args, **kwargs):
+    """
+    Run a blocking job on the background executor every interval_seconds, forever. Errors are logged and the job is retried on
+    the next interval.
+
+    :param func: The (synchronous) job function.
+    :param interval_seconds: The number of seconds to sleep between runs.
+    :param args: Positional arguments for func.
+    :param kwargs: Keyword arguments for func.
+    """
+    while True:
+        try:
+            await run_background(func, *args, **kwargs)
+        except Exception:
+            logger.exception(f'Background job {func.__name__} failed')
+        await asyncio.sleep(interval_seconds)
+
+
+_background_lock = None
+
+
+def acquire_background_lock() -> bool:
+    """
+    Try to become the process that runs the background jobs which write to Arango, e.g. the rollups.
+
+    :return: True if this process holds the lock (until it exits).
+    """
+    global _background_lock
+    if _background_lock is not None:
+        return True
+    lock = open(BACKGROUND_LOCK_FILE, 'w')
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock.close()
+        return False
+    _background_lock = lock
+    return True
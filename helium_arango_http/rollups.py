@@ -0,0 +1,298 @@
+"""
+Pre-aggregated payment rollups, so the top-N payment routes do not need to scan every payment in the time window.
+
+Hourly and daily sums/counts are kept per (payer, payee) pair, per payer and per payee in the payment_rollups collection.
+They are built incrementally up to a watermark on payment.time, which is kept in the service_state collection. Queries
+combine whole days and hours from the rollups and only scan raw payments for the partial hours at either end of the window.
+
+    python rollups.py backfill [--since TIMESTAMP]
+    python rollups.py update
+    python rollups.py check [--min-time TIMESTAMP] [--max-time TIMESTAMP] [--limit N]
+"""
+import argparse
+import os
+from pyArango.database import Database
+from time_windows import resolve_max_time
+from arango_queries import register_query, run_registered, get_top_payment_totals as get_raw_payment_totals, \
+    get_top_payment_counts as get_raw_payment_counts, get_top_payers as get_raw_payers, get_top_payees as get_raw_payees
+
+
+HOUR = 3600
+DAY = 86400
+KINDS = ('pair', 'payer', 'payee')
+ROLLUP_COLLECTION = 'payment_rollups'
+STATE_COLLECTION = 'service_state'
+WATERMARK_KEY = 'payment_rollups'
+PAYMENT_ROLLUPS_ACTIVE = os.getenv('PAYMENT_ROLLUPS_ACTIVE', '').lower() in ('1', 'true')
+ROLLUP_INTERVAL_SECONDS = int(os.getenv('ROLLUP_INTERVAL_SECONDS', 300))
+
+
+def ensure_rollup_collections(database: Database):
+    """
+    Create the rollup and state collections, and the index used to look up buckets, if they do not exist.
+
+    :param database: The pyArango Database instance.
+    """
+    for name in (ROLLUP_COLLECTION, STATE_COLLECTION):
+        if not database.hasCollection(name):
+            database.createCollection(name=name)
+    database[ROLLUP_COLLECTION].ensurePersistentIndex(['kind', 'granularity', 'bucket'], sparse=False)
+
+
+GET_STATE = register_query('get_service_state', """RETURN DOCUMENT(@collection, @key)""",
+                           {'collection': STATE_COLLECTION, 'key': WATERMARK_KEY})
+
+SET_STATE = register_query('set_service_state', """UPSERT {_key: @key}
+    INSERT MERGE({_key: @key}, @state)
+    UPDATE @state
+    IN @@collection""", {'@collection': STATE_COLLECTION, 'key': WATERMARK_KEY, 'state': {'watermark': 0}})
+
+PAYMENT_TIME_BOUNDS = register_query('payment_time_bounds', """RETURN {
+    first: FIRST(for payment in payments sort payment.time asc limit 1 return payment.time),
+    last: FIRST(for payment in payments sort payment.time desc limit 1 return payment.time)
+}""")
+
+ROLL_UP_HOURS = register_query('roll_up_payment_hours', """for payment in payments
+    filter payment.time >= @lo and payment.time < @hi
+    collect bucket = payment.time - payment.time % 3600,
+        from = @kind == 'payee' ? null : payment._from,
+        to = @kind == 'payer' ? null : payment._to
+        aggregate total = SUM(payment.amount), count = LENGTH(1)
+    let from_key = from == null ? null : last(split(from,'/'))
+    let to_key = to == null ? null : last(split(to,'/'))
+    insert {_key: CONCAT_SEPARATOR(':', 'hour', @kind, bucket, from_key, to_key), kind: @kind, granularity: 'hour',
+            bucket: bucket, from: from_key, to: to_key, total: total, count: count}
+    into payment_rollups options {overwriteMode: 'replace'}""", {'kind': 'pair', 'lo': 1640995200 - DAY, 'hi': 1640995200})
+
+ROLL_UP_DAYS = register_query('roll_up_payment_days', """for rollup in payment_rollups
+    filter rollup.kind == @kind and rollup.granularity == 'hour' and rollup.bucket >= @lo and rollup.bucket < @hi
+    collect bucket = rollup.bucket - rollup.bucket % 86400, from = rollup.from, to = rollup.to
+        aggregate total = SUM(rollup.total), count = SUM(rollup.count)
+    insert {_key: CONCAT_SEPARATOR(':', 'day', @kind, bucket, from, to), kind: @kind, granularity: 'day',
+            bucket: bucket, from: from, to: to, total: total, count: count}
+    into payment_rollups options {overwriteMode: 'replace'}""", {'kind': 'pair', 'lo': 1640995200 - DAY, 'hi': 1640995200})
+
+EXAMPLE_ROLLUP_WINDOW = {'kind': 'pair', 'sort_by': 'total', 'n': 100, 'min_time': 0, 'max_time': 1640995200, 'lo': HOUR,
+                         'hi': 1640995200 - HOUR, 'day_lo': DAY, 'day_hi': 1640995200 - DAY}
+
+TOP_FROM_ROLLUPS = register_query('top_payments_from_rollups', """let rolled = UNION(
+        (for rollup in payment_rollups
+            filter rollup.kind == @kind and rollup.granularity == 'day'
+            filter rollup.bucket >= @day_lo and rollup.bucket < @day_hi
+            return rollup),
+        (for rollup in payment_rollups
+            filter rollup.kind == @kind and rollup.granularity == 'hour'
+            filter rollup.bucket >= @lo and rollup.bucket < @day_lo
+            return rollup),
+        (for rollup in payment_rollups
+            filter rollup.kind == @kind and rollup.granularity == 'hour'
+            filter rollup.bucket >= @day_hi and rollup.bucket < @hi
+            return rollup))
+    let raw = (for payment in payments
+        filter (payment.time > @min_time and payment.time < @lo) or (payment.time >= @hi and payment.time < @max_time)
+        return {from: @kind == 'payee' ? null : last(split(payment._from,'/')),
+                to: @kind == 'payer' ? null : last(split(payment._to,'/')),
+                total: payment.amount, count: 1})
+    for row in APPEND(rolled, raw)
+        collect from = row.from, to = row.to aggregate total = SUM(row.total), count = SUM(row.count)
+        sort (@sort_by == 'count' ? count : total) desc
+        limit @n
+        return {from: from, to: to, total: total, count: count}""", EXAMPLE_ROLLUP_WINDOW)
+
+
+def _floor(timestamp: int, size: int) -> int:
+    return timestamp - timestamp % size
+
+
+def _ceil(timestamp: int, size: int) -> int:
+    return -_floor(-timestamp, size)
+
+
+def get_state(database: Database, key: str) -> dict:
+    """
+    Get a document from the service_state collection.
+
+    :param database: The pyArango Database instance.
+    :param key: The _key of the state document.
+    :return: The state document, or an empty dict if it does not exist yet.
+    """
+    return run_registered(database, GET_STATE, {'collection': STATE_COLLECTION, 'key': key})[0] or {}
+
+
+def set_state(database: Database, key: str, **state):
+    """
+    Merge fields into a document in the service_state collection.
+
+    :param database: The pyArango Database instance.
+    :param key: The _key of the state document.
+    :param state: The fields to set.
+    """
+    run_registered(database, SET_STATE, {'@collection': STATE_COLLECTION, 'key': key, 'state': state}, raise_if_empty=False)
+
+
+def get_watermark(database: Database):
+    """
+    Get the payment.time up to which the rollups are complete.
+
+    :param database: The pyArango Database instance.
+    :return: The watermark (always on an hour boundary), or None if the rollups have not been backfilled.
+    """
+    return get_state(database, WATERMARK_KEY).get('watermark')
+
+
+def update_rollups(database: Database, since: int = None, chunk_seconds: int = DAY) -> int:
+    """
+    Roll up every complete hour of payments past the watermark, and every day that has been completed by those hours.
+
+    :param database: The pyArango Database instance.
+    :param since: (optional) restart from the start of the day of this UTC timestamp instead of the stored watermark, e.g. to
+        backfill.
+    :param chunk_seconds: The span of payments rolled up per query, which bounds the memory used by each query.
+    :return: The new watermark.
+    """
+    bounds = run_registered(database, PAYMENT_TIME_BOUNDS)[0]
+    if bounds['last'] is None:
+        return get_watermark(database)
+    # backfills start on a day boundary, so that the first daily rollup is built from complete hours
+    if since is not None:
+        watermark = _floor(since, DAY)
+    else:
+        watermark = get_watermark(database)
+        if watermark is None:
+            watermark = _floor(bounds['first'], DAY)
+    # the hour holding the latest payment may still be receiving blocks
+    target = _floor(bounds['last'], HOUR)
+    while watermark < target:
+        hi = min(_floor(watermark + chunk_seconds, HOUR), target)
+        for kind in KINDS:
+            run_registered(database, ROLL_UP_HOURS, {'kind': kind, 'lo': watermark, 'hi': hi}, raise_if_empty=False)
+        # days that were completed by this chunk are rebuilt from their hourly rollups
+        if _floor(hi, DAY) > _floor(watermark, DAY):
+            for kind in KINDS:
+                run_registered(database, ROLL_UP_DAYS, {'kind': kind, 'lo': _floor(watermark, DAY), 'hi': _floor(hi, DAY)},
+                               raise_if_empty=False)
+        watermark = hi
+        set_state(database, WATERMARK_KEY, watermark=watermark)
+    return watermark
+
+
+def split_window(min_time: int, max_time: int, watermark: int) -> dict:
+    """
+    Split an (exclusive) time window into whole days and hours covered by the rollups, plus raw edges.
+
+    :param min_time: The minimum UTC timestamp to consider.
+    :param max_time: The maximum UTC timestamp to consider.
+    :param watermark: The payment.time up to which the rollups are complete.
+    :return: Bind variables for the rollup query, or None if no whole hour of the window is covered by the rollups.
+    """
+    lo = _ceil(min_time + 1, HOUR)
+    hi = min(_floor(max_time, HOUR), watermark)
+    if hi <= lo:
+        return None
+    day_lo, day_hi = _ceil(lo, DAY), _floor(hi, DAY)
+    if day_hi <= day_lo:
+        day_lo = day_hi = hi
+    return {'min_time': min_time, 'max_time': max_time, 'lo': lo, 'hi': hi, 'day_lo': day_lo, 'day_hi': day_hi}
+
+
+def _get_top_from_rollups(database: Database, kind: str, sort_by: str, n: int, min_time: int, max_time: int):
+    watermark = get_watermark(database)
+    window = split_window(min_time, resolve_max_time(max_time), watermark) if watermark is not None else None
+    if window is None:
+        return None
+    return run_registered(database, TOP_FROM_ROLLUPS, {**window, 'kind': kind, 'sort_by': sort_by, 'n': n})
+
+
+def get_top_payment_totals(database: Database, n: int = 100, min_time: int = 0, max_time: int = None):
+    """
+    Same as arango_queries.get_top_payment_totals, answered from the rollups.
+    """
+    rows = _get_top_from_rollups(database, 'pair', 'total', n, min_time, max_time)
+    if rows is None:
+        return get_raw_payment_totals(database, n, min_time, max_time)
+    return [{'_from': row['from'], '_to': row['to'], 'payment_total': row['total']} for row in rows]
+
+
+def get_top_payment_counts(database: Database, n: int = 100, min_time: int = 0, max_time: int = None):
+    """
+    Same as arango_queries.get_top_payment_counts, answered from the rollups.
+    """
+    rows = _get_top_from_rollups(database, 'pair', 'count', n, min_time, max_time)
+    if rows is None:
+        return get_raw_payment_counts(database, n, min_time, max_time)
+    return [{'_from': row['from'], '_to': row['to'], 'payment_count': row['count']} for row in rows]
+
+
+def get_top_payers(database: Database, n: int = 100, min_time: int = 0, max_time: int = None):
+    """
+    Same as arango_queries.get_top_payers, answered from the rollups.
+    """
+    rows = _get_top_from_rollups(database, 'payer', 'total', n, min_time, max_time)
+    if rows is None:
+        return get_raw_payers(database, n, min_time, max_time)
+    return [{'_from': row['from'], 'total_amount': row['total'], 'num_payments': row['count']} for row in rows]
+
+
+def get_top_payees(database: Database, n: int = 100, min_time: int = 0, max_time: int = None):
+    """
+    Same as arango_queries.get_top_payees, answered from the rollups.
+    """
+    rows = _get_top_from_rollups(database, 'payee', 'total', n, min_time, max_time)
+    if rows is None:
+        return get_raw_payees(database, n, min_time, max_time)
+    return [{'_to': row['to'], 'total_amount': row['total'], 'num_payments': row['count']} for row in rows]
+
+
+def check_rollups(database: Database, n: int = 100, min_time: int = 0, max_time: int = None) -> dict:
+    """
+    Compare the rollup answers against the raw queries over the same window.
+
+    :param database: The pyArango Database instance.
+    :param n: The number of top rows to compare per query.
+    :param min_time: The minimum UTC timestamp to consider.
+    :param max_time: The maximum UTC timestamp to consider.
+    :return: Dict of query name -> list of mismatched rows (empty if consistent).
+    """
+    checks = {
+        'payment_totals': (get_top_payment_totals, get_raw_payment_totals, ('_from', '_to'), ('payment_total',)),
+        'payment_counts': (get_top_payment_counts, get_raw_payment_counts, ('_from', '_to'), ('payment_count',)),
+        'payers': (get_top_payers, get_raw_payers, ('_from',), ('total_amount', 'num_payments')),
+        'payees': (get_top_payees, get_raw_payees, ('_to',), ('total_amount', 'num_payments'))
+    }
+    # resolved once, so that both sides see the same window
+    max_time = resolve_max_time(max_time)
+    mismatches = {}
+    for name, (rollup_query, raw_query, key_fields, value_fields) in checks.items():
+        # compare against a deeper raw result, so that ties at the cut-off do not show up as mismatches
+        raw = {tuple(row[f] for f in key_fields): row for row in raw_query(database, n * 2, min_time, max_time)}
+        mismatches[name] = []
+        for row in rollup_query(database, n, min_time, max_time):
+            expected = raw.get(tuple(row[f] for f in key_fields))
+            if expected is None or any(abs(row[f] - expected[f]) > 1e-6 * max(1, abs(expected[f])) for f in value_fields):
+                mismatches[name].append({'rollup': row, 'raw': expected})
+    return mismatches
+
+
+if __name__ == '__main__':
+    from arango_connection import connect
+
+    parser = argparse.ArgumentParser(description='Maintain the pre-aggregated payment rollups.')
+    parser.add_argument('command', choices=['backfill', 'update', 'check'])
+    parser.add_argument('--since', type=int, default=None,
+                        help='backfill from this UTC timestamp (defaults to the first payment)')
+    parser.add_argument('--min-time', type=int, default=0)
+    parser.add_argument('--max-time', type=int, default=None, help='defaults to now')
+    parser.add_argument('--limit', type=int, default=100)
+    args = parser.parse_args()
+
+    db = connect()
+    ensure_rollup_collections(db)
+    if args.command == 'backfill':
+        since = args.since if args.since is not None else run_registered(db, PAYMENT_TIME_BOUNDS)[0]['first']
+        print('watermark:', update_rollups(db, since=since))
+    elif args.command == 'update':
+        print('watermark:', update_rollups(db))
+    else:
+        results = check_rollups(db, args.limit, args.min_time, args.max_time)
+        for name, rows in results.items():
+            print(name, 'OK' if not rows else f'{len(rows)} mismatches: {rows[:5]}')
@@ -1,37 +1,76 @@
+import asyncio
+from functools import partial
 import pyArango.theExceptions
-import redis
-from arango_queries import *
-from utils import get_cluster_centers
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import JSONResponse
-from pyArango.connection import Connection
+from arango_queries import get_account_summary, get_top_payees_from_payer, get_top_payers_to_payee, \
+    get_graph_from_top_payers, get_graph_to_top_payees, get_outbound_witnesses_for_hotspot, \
+    get_inbound_witnesses_for_hotspot, get_hotspot_coordinates, iter_batch_top_payees_from_payers, \
+    iter_batch_top_payers_to_payees, iter_batch_outbound_witnesses, iter_batch_inbound_witnesses, \
+    iter_sample_of_recent_witness_receipts, iter_hotspot_coordinates, ping, update_ingested_time, ERROR_QUERY_KILLED, \
+    ERROR_RESOURCE_LIMIT, QUERY_BATCH_SIZE
+from arango_connection import connect
+from rollups import PAYMENT_ROLLUPS_ACTIVE, ROLLUP_INTERVAL_SECONDS, ensure_rollup_collections, update_rollups
+from h3_index import H3_INDEX_ACTIVE, H3_REFRESH_SECONDS, ensure_h3_indexes, update_hotspot_cells
+from query_executor import run_periodically, run_background, run_query, acquire_background_lock, \
+    QueryTimeoutError, ClientDisconnectedError, OverloadedError, QUERY_WORKERS, BACKGROUND_WORKERS, RETRY_AFTER_SECONDS
+from admission import limited
+from encoding import columnar, negotiate_graph_format, graph_to_arrow, graph_to_msgpack, GRAPH_TABLES, \
+    ARROW_STREAM_MEDIA_TYPE, MSGPACK_MEDIA_TYPE
+from streaming import ndjson_response
+from metrics import start_request, finish_request, render_metrics
+from prometheus_client import CONTENT_TYPE_LATEST
+from change_feed import CHANGE_FEED_ACTIVE, CHANGE_FEED_POLL_SECONDS, PAYMENTS, WITNESSES, HOTSPOTS, poll_revisions, \
+    versioned, when_changed
+from cache import cached, connect_redis, get_or_set_bytes, get_or_set_json, stats as cache_stats
+from traversals import get_payment_traversal, get_witness_traversal, DIRECTIONS, MAX_TRAVERSAL_DEPTH, MAX_TRAVERSAL_NODES, \
+    MAX_TRAVERSAL_EDGES
+from pagination import get_materialized_page, get_witness_receipts_page, ensure_pagination_indexes, InvalidCursorError
+from time_windows import TopSpec, historical_boundary, historical_depth, merge_top, resolve_max_time, LIVE_TAIL_MAX_GROUPS, \
+    HISTORICAL_CACHE_TTL, INGESTED_POLL_SECONDS
+from analytics import GRAPHS, METRICS, get_metrics, get_node_metrics
+from witness_stats import DIRECTIONS as STATS_DIRECTIONS, get_hotspot_witness_stats, get_hex_witness_stats
+from tiles import TILE_POINTS_MIN_ZOOM, get_tile, tile_json, valid_tile, cells_ttl
+from witness_graph import WITNESS_SNAPSHOT_ACTIVE, WITNESS_SNAPSHOT_REFRESH_SECONDS, refresh_snapshot
+import witness_graph
+from clustering import CLUSTERING_ACTIVE, CLUSTER_REFRESH_SECONDS, refresh_clusters, compute_cluster_centers, \
+    get_precomputed_clusters
+from fastapi import Body, FastAPI, Request
+from fastapi.responses import ORJSONResponse, Response
 import os
 from dotenv import load_dotenv
-from typing import Optional
-import uvicorn
-import h3
-from datetime import datetime
+from typing import List, Optional
 from metadata import title, description, version, license_info, contact, tags_metadata
-import pickle
+import orjson
+import logging
 
 
 load_dotenv()
 
-try:
-    conn = Connection(
-        arangoURL=os.getenv('ARANGO_URL'),
-        username=os.getenv('ARANGO_USERNAME'),
-        password=os.getenv('ARANGO_PASSWORD')
-    )
-except requests.exceptions.ConnectionError:
-    raise Exception('Unable to connect to the ArangoDB instance. Please check that it is running and that you have supplied the correct URL/credentials in the .env file.')
-db = conn['helium']
+if PAYMENT_ROLLUPS_ACTIVE:
+    # answer the top-N payment routes from the pre-aggregated rollups instead of scanning payments
+    from rollups import get_top_payment_totals, get_top_payment_counts, get_top_payers, get_top_payees
 
-# start the redis cache
-REDIS_EXPIRATION_SECONDS = 360
+if H3_INDEX_ACTIVE:
+    # answer the hex and proximity graph routes from the precomputed H3 cells instead of geo scans
+    from h3_index import get_witness_graph_in_hex_indexed as get_witness_graph_in_hex, \
+        get_witness_graph_near_coordinates_indexed as get_witness_graph_near_coordinates
 
-if os.getenv('REDIS_ACTIVE'):
-    r = redis.Redis('redis')
+logger = logging.getLogger(__name__)
+
+# connected in the startup hook, so that each worker process gets its own connection pool
+db = None
+ready = False
+
+# per-route cache TTLs. min_time/max_time are snapped to TIME_BUCKET_SECONDS so that nearby windows share entries, and windows
+# that ended before time_windows.IMMUTABLE_AFTER_SECONDS are cached for time_windows.HISTORICAL_CACHE_TTL. Routes that
+# depend_on collections keep their other entries until those collections are written to (see change_feed.py), and fall back to
+# these TTLs while that is unknown
+PAYMENTS_CACHE_TTL = int(os.getenv('PAYMENTS_CACHE_TTL', 300))
+HOTSPOTS_CACHE_TTL = int(os.getenv('HOTSPOTS_CACHE_TTL', 120))
+CLUSTERS_CACHE_TTL = int(os.getenv('CLUSTERS_CACHE_TTL', 360))
+TIME_BUCKET_SECONDS = int(os.getenv('TIME_BUCKET_SECONDS', 300))
+MAX_BATCH_ADDRESSES = int(os.getenv('MAX_BATCH_ADDRESSES', 10000))
+WARMUP_ACTIVE = os.getenv('WARMUP_ACTIVE', 'true').lower() in ('1', 'true')
+READY_CHECK_TIMEOUT_SECONDS = 2
 
 # fields from metadata.py
 app = FastAPI(
@@ -40,135 +79,742 @@ app = FastAPI(
     version=version,
     license_info=license_info,
     contact=contact,
-    tags_metadata=tags_metadata
+    tags_metadata=tags_metadata,
+    default_response_class=ORJSONResponse
 )
 
 
-@app.get('/payments/{address}/from', response_class=JSONResponse, tags=['payments'])
-async def flows_from_account(address: str, limit: Optional[int] = 100, min_time: Optional[int] = 0, max_time: Optional[int] = int(datetime.utcnow().timestamp())):
+@app.on_event('startup')
+async def connect_and_start_background_jobs():
+    global db
+    # every query worker and background worker thread may hold a connection at once
+    db = await run_query(connect, QUERY_WORKERS + BACKGROUND_WORKERS)
+    connect_redis(QUERY_WORKERS + BACKGROUND_WORKERS)
+    asyncio.ensure_future(warm_up())
+
+    # jobs that write to Arango or Redis, or that are too expensive to repeat in every worker, run in a single worker process
+    if acquire_background_lock():
+        # building the receipt pagination indexes can take a while on a large collection, so it is not awaited
+        asyncio.ensure_future(run_background(ensure_pagination_indexes, db))
+        if PAYMENT_ROLLUPS_ACTIVE:
+            await run_background(ensure_rollup_collections, db)
+            asyncio.ensure_future(run_periodically(update_rollups, ROLLUP_INTERVAL_SECONDS, db))
+        if H3_INDEX_ACTIVE:
+            await run_background(ensure_h3_indexes, db)
+            asyncio.ensure_future(run_periodically(when_changed(update_hotspot_cells, HOTSPOTS), H3_REFRESH_SECONDS, db))
+        if CLUSTERING_ACTIVE:
+            asyncio.ensure_future(run_periodically(when_changed(refresh_clusters, HOTSPOTS), CLUSTER_REFRESH_SECONDS, db))
+    # in-memory structures are needed in every worker, and are only rebuilt after writes to the collections they are built from
+    asyncio.ensure_future(run_periodically(update_ingested_time, INGESTED_POLL_SECONDS, db))
+    if CHANGE_FEED_ACTIVE:
+        asyncio.ensure_future(run_periodically(poll_revisions, CHANGE_FEED_POLL_SECONDS, db))
+    if WITNESS_SNAPSHOT_ACTIVE:
+        asyncio.ensure_future(run_periodically(when_changed(refresh_snapshot, WITNESSES), WITNESS_SNAPSHOT_REFRESH_SECONDS,
+                                               db))
+
+
+async def warm_up():
+    """
+    Open a keep-alive connection for every query worker and run a few representative queries, so that the first requests do not
+    pay for cold connections and caches. /readyz reports ready once this has finished.
+    """
+    global ready
+    if WARMUP_ACTIVE:
+        await asyncio.gather(*(run_query(ping, db) for _ in range(QUERY_WORKERS)), return_exceptions=True)
+        for func, args in ((get_top_payment_totals, (10,)), (get_top_payers, (10,)),
+                           (get_witness_graph_near_coordinates, (40.689306, -74.0445, 10))):
+            try:
+                await run_query(func, db, *args)
+            except Exception:
+                logger.exception(f'Warm-up query {func.__name__} failed')
+    ready = True
+
+
+@app.middleware('http')
+async def instrument_requests(request: Request, call_next):
+    timing = start_request()
+    response = await call_next(request)
+    # routing has filled in the endpoint by now, so the label is the route's function name rather than the raw path
+    endpoint = request.scope.get('endpoint')
+    server_timing = finish_request(timing, endpoint.__name__ if endpoint else 'unmatched', request.method,
+                                   response.status_code)
+    if server_timing:
+        response.headers['Server-Timing'] = server_timing
+    return response
+
+
+EDGE_FORMATS = ('rows', 'columnar')
+
+
+def is_streamed(params: dict) -> bool:
+    return params.get('format') == 'ndjson'
+
+
+def is_paged(params: dict) -> bool:
+    # pages are served from materialized chunks that expire on their own, so they must not outlive them in the response cache
+    return bool(params.get('paginate') or params.get('cursor'))
+
+
+def wants_binary_graph(params: dict) -> bool:
+    # binary graph encodings are negotiated per request, so they bypass the JSON response cache
+    return negotiate_graph_format(params.get('format'), params['request'].headers.get('accept')) not in ('json', None)
+
+
+async def graph_response(nodes: list, edges: list, graph_format: str, edge_format: str, table: str):
+    if graph_format == 'arrow':
+        return Response(await run_query(graph_to_arrow, nodes, edges, table), media_type=ARROW_STREAM_MEDIA_TYPE)
+    if graph_format == 'msgpack':
+        return Response(await run_query(graph_to_msgpack, nodes, edges), media_type=MSGPACK_MEDIA_TYPE)
+    return {'nodes': nodes, 'edges': columnar(edges) if edge_format == 'columnar' else edges}
+
+
+def split_fields(fields: Optional[str]) -> Optional[list]:
+    # comma-separated projection, e.g. fields=address,geo_location
+    if not fields:
+        return None
+    return [field.strip() for field in fields.split(',') if field.strip()]
+
+
+def invalid_traversal(depth: int, direction: str, fan_out: int, max_nodes: int, max_edges: int) -> Optional[str]:
+    if direction not in DIRECTIONS:
+        return 'Invalid direction'
+    if not 1 <= depth <= MAX_TRAVERSAL_DEPTH:
+        return f'depth must be between 1 and {MAX_TRAVERSAL_DEPTH}'
+    if fan_out < 1 or not 1 <= max_nodes <= MAX_TRAVERSAL_NODES or not 1 <= max_edges <= MAX_TRAVERSAL_EDGES:
+        return f'fan_out must be positive, max_nodes at most {MAX_TRAVERSAL_NODES} and max_edges at most {MAX_TRAVERSAL_EDGES}'
+    return None
+
+
+def invalid_analytics(graph: str, metric: str, weight: str) -> Optional[str]:
+    if metric not in METRICS:
+        return f'metric must be one of {", ".join(METRICS)}'
+    if weight not in GRAPHS[graph][1]:
+        return f'weight must be one of {", ".join(GRAPHS[graph][1])}'
+    return None
+
+
+def invalid_batch(addresses: list) -> Optional[str]:
+    if not addresses or len(addresses) > MAX_BATCH_ADDRESSES:
+        return f'Supply between 1 and {MAX_BATCH_ADDRESSES} addresses'
+    return None
+
+
+def analytics_response(body, window: tuple) -> ORJSONResponse:
+    # both ends of a window are floored to ANALYTICS_TIME_BUCKET_SECONDS, so the one that was actually used is reported
+    return ORJSONResponse(body, headers={'X-Window-Min-Time': str(window[0]), 'X-Window-Max-Time': str(window[1])})
+
+
+async def paged(request: Request, compute, limit: int, cursor: Optional[str], max_time: Optional[int]) -> dict:
+    rows, next_cursor = await run_query(get_materialized_page, request.url.path, compute, limit, cursor, max_time,
+                                        request=request)
+    return {'results': rows, 'next': next_cursor}
+
+
+# how the historical and live parts of each top-N payment query are merged
+PAIR_TOTALS = TopSpec(('_from', '_to'), ('payment_total',), 'payment_total')
+PAIR_COUNTS = TopSpec(('_from', '_to'), ('payment_count',), 'payment_count')
+PAYER_TOTALS = TopSpec(('_from',), ('total_amount', 'num_payments'), 'total_amount')
+PAYEE_TOTALS = TopSpec(('_to',), ('total_amount', 'num_payments'), 'total_amount')
+
+
+def rows_or_empty(func, *args) -> list:
+    try:
+        return func(*args)
+    except pyArango.theExceptions.AQLFetchError:
+        return []
+
+
+async def top_with_live_tail(request: Request, func, spec: TopSpec, *args, n: int, min_time: int,
+                             max_time: Optional[int]) -> list:
+    """
+    Answer a top-N payment query from the cached top rows of the historical part of the window, merged with its live tail.
+    Falls back to querying the whole window if it has no historical part, or if the merge would not be exact.
+
+    :param func: The query function, called as func(db, *args, n, min_time, max_time).
+    :param spec: How rows of func are merged.
+    """
+    boundary = historical_boundary(min_time, max_time)
+    if boundary is not None:
+        depth = historical_depth(n)
+        max_time = resolve_max_time(max_time)
+
+        async def historical_rows():
+            return await run_query(rows_or_empty, func, db, *args, depth, min_time, boundary, request=request)
+
+        key = f'historical:{func.__module__}.{func.__name__}?' + '&'.join(map(str, (*args, depth, min_time, boundary)))
+        historical = orjson.loads(await get_or_set_json(key, HISTORICAL_CACHE_TTL, historical_rows,
+                                                        route=f'{func.__name__}_historical'))
+        # payment.time is an integer, so the tail picks up exactly where the (exclusive) historical window ends
+        tail = await run_query(rows_or_empty, func, db, *args, LIVE_TAIL_MAX_GROUPS, boundary - 1, max_time, request=request)
+        rows = merge_top(spec, n, historical, len(historical) < depth, tail) if len(tail) < LIVE_TAIL_MAX_GROUPS else None
+        if rows is not None:
+            if not rows:
+                raise pyArango.theExceptions.AQLFetchError('No results matched for query.')
+            return rows
+    return await run_query(func, db, *args, n, min_time, max_time, request=request)
+
+
+@app.exception_handler(InvalidCursorError)
+async def invalid_cursor_handler(request: Request, exc: InvalidCursorError):
+    return ORJSONResponse({'Message': 'Invalid or expired cursor'})
+
+
+@app.exception_handler(QueryTimeoutError)
+async def query_timeout_handler(request: Request, exc: QueryTimeoutError):
+    return ORJSONResponse({'Message': 'Query timed out'}, status_code=504)
+
+
+@app.exception_handler(OverloadedError)
+async def overloaded_handler(request: Request, exc: OverloadedError):
+    return ORJSONResponse({'Message': exc.message}, status_code=exc.status_code,
+                          headers={'Retry-After': str(RETRY_AFTER_SECONDS)})
+
+
+@app.exception_handler(pyArango.theExceptions.AQLQueryError)
+@app.exception_handler(pyArango.theExceptions.QueryError)
+async def query_error_handler(request: Request, exc: pyArango.theExceptions.pyArangoException):
+    error = exc.errors.get('errorNum') if isinstance(exc.errors, dict) else None
+    if error == ERROR_RESOURCE_LIMIT:
+        return ORJSONResponse({'Message': 'Query exceeded its memory limit, try a narrower time window or a lower limit'},
+                              status_code=422)
+    if error == ERROR_QUERY_KILLED:
+        return ORJSONResponse({'Message': 'Query timed out'}, status_code=504)
+    logger.error(f'Query failed: {exc}')
+    return ORJSONResponse({'Message': 'Query failed'}, status_code=500)
+
+
+@app.exception_handler(ClientDisconnectedError)
+async def client_disconnected_handler(request: Request, exc: ClientDisconnectedError):
+    # nobody is listening, so just close out the request
+    return Response(status_code=499)
+
+
+@app.get('/payments/{address}/from', response_class=ORJSONResponse, tags=['payments'])
+@cached(ttl=PAYMENTS_CACHE_TTL, time_bucket=TIME_BUCKET_SECONDS, unless=is_paged, depends_on=PAYMENTS)
+@limited()
+async def flows_from_account(request: Request, address: str, limit: Optional[int] = 100, min_time: Optional[int] = 0,
+                             max_time: Optional[int] = None, paginate: Optional[bool] = False, cursor: Optional[str] = None):
+    try:
+        if paginate or cursor:
+            return await paged(request, partial(get_top_payees_from_payer, db, address, min_time=min_time), limit, cursor,
+                               max_time)
+        return await top_with_live_tail(request, get_top_payees_from_payer, PAYEE_TOTALS, address, n=limit, min_time=min_time,
+                                        max_time=max_time)
+    except pyArango.theExceptions.AQLFetchError:
+        return ORJSONResponse({'Message': 'No results returned for query'})
+
+
+@app.get('/payments/{address}/to', response_class=ORJSONResponse, tags=['payments'])
+@cached(ttl=PAYMENTS_CACHE_TTL, time_bucket=TIME_BUCKET_SECONDS, unless=is_paged, depends_on=PAYMENTS)
+@limited()
+async def flows_to_account(request: Request, address: str, limit: Optional[int] = 100, min_time: Optional[int] = 0,
+                           max_time: Optional[int] = None, paginate: Optional[bool] = False, cursor: Optional[str] = None):
+    try:
+        if paginate or cursor:
+            return await paged(request, partial(get_top_payers_to_payee, db, address, min_time=min_time), limit, cursor,
+                               max_time)
+        return await top_with_live_tail(request, get_top_payers_to_payee, PAYER_TOTALS, address, n=limit, min_time=min_time,
+                                        max_time=max_time)
+    except pyArango.theExceptions.AQLFetchError:
+        return ORJSONResponse({'Message': 'No results returned for query'})
+
+
+@app.get('/accounts/{address}/summary', response_class=ORJSONResponse, tags=['payments'])
+@cached(ttl=PAYMENTS_CACHE_TTL, time_bucket=TIME_BUCKET_SECONDS, depends_on=PAYMENTS)
+@limited()
+async def account_summary(request: Request, address: str, limit: Optional[int] = 10, min_time: Optional[int] = 0,
+                          max_time: Optional[int] = None):
+    try:
+        return await run_query(get_account_summary, db, address, limit, min_time, max_time, request=request)
+    except pyArango.theExceptions.AQLFetchError:
+        return ORJSONResponse({'Message': 'No results returned for query'})
+
+
+@app.post('/payments/batch/from', tags=['payments'])
+@limited()
+async def batch_flows_from_accounts(addresses: List[str] = Body(..., embed=True), limit: Optional[int] = 100,
+                                    min_time: Optional[int] = 0, max_time: Optional[int] = None,
+                                    batch_size: Optional[int] = 100):
+    message = invalid_batch(addresses)
+    if message:
+        return ORJSONResponse({'Message': message})
+    return await ndjson_response(iter_batch_top_payees_from_payers(db, addresses, limit, min_time, max_time, batch_size))
+
+
+@app.post('/payments/batch/to', tags=['payments'])
+@limited()
+async def batch_flows_to_accounts(addresses: List[str] = Body(..., embed=True), limit: Optional[int] = 100,
+                                  min_time: Optional[int] = 0, max_time: Optional[int] = None,
+                                  batch_size: Optional[int] = 100):
+    message = invalid_batch(addresses)
+    if message:
+        return ORJSONResponse({'Message': message})
+    return await ndjson_response(iter_batch_top_payers_to_payees(db, addresses, limit, min_time, max_time, batch_size))
+
+
+@app.get('/payments/totals', response_class=ORJSONResponse, tags=['payments'])
+@cached(ttl=PAYMENTS_CACHE_TTL, time_bucket=TIME_BUCKET_SECONDS, unless=is_paged, depends_on=PAYMENTS)
+@limited()
+async def top_payment_totals(request: Request, limit: Optional[int] = 100, min_time: Optional[int] = 0,
+                             max_time: Optional[int] = None, paginate: Optional[bool] = False, cursor: Optional[str] = None):
+    try:
+        if paginate or cursor:
+            return await paged(request, partial(get_top_payment_totals, db, min_time=min_time), limit, cursor, max_time)
+        return await top_with_live_tail(request, get_top_payment_totals, PAIR_TOTALS, n=limit, min_time=min_time,
+                                        max_time=max_time)
+    except pyArango.theExceptions.AQLFetchError:
+        return ORJSONResponse({'Message': 'No results returned for query'})
+
+
+@app.get('/payments/counts', response_class=ORJSONResponse, tags=['payments'])
+@cached(ttl=PAYMENTS_CACHE_TTL, time_bucket=TIME_BUCKET_SECONDS, unless=is_paged, depends_on=PAYMENTS)
+@limited()
+async def top_payment_counts(request: Request, limit: Optional[int] = 100, min_time: Optional[int] = 0,
+                             max_time: Optional[int] = None, paginate: Optional[bool] = False, cursor: Optional[str] = None):
     try:
-        return get_top_payees_from_payer(db, address, limit, min_time, max_time)
+        if paginate or cursor:
+            return await paged(request, partial(get_top_payment_counts, db, min_time=min_time), limit, cursor, max_time)
+        return await top_with_live_tail(request, get_top_payment_counts, PAIR_COUNTS, n=limit, min_time=min_time,
+                                        max_time=max_time)
     except pyArango.theExceptions.AQLFetchError:
-        return JSONResponse({'Message': 'No results returned for query'})
+        return ORJSONResponse({'Message': 'No results returned for query'})
 
 
-@app.get('/payments/{address}/to', response_class=JSONResponse, tags=['payments'])
-async def flows_to_account(address: str, limit: Optional[int] = 100, min_time: Optional[int] = 0, max_time: Optional[int] = int(datetime.utcnow().timestamp())):
+@app.get('/payments/payers', response_class=ORJSONResponse, tags=['payments'])
+@cached(ttl=PAYMENTS_CACHE_TTL, time_bucket=TIME_BUCKET_SECONDS, unless=is_paged, depends_on=PAYMENTS)
+@limited()
+async def top_payers(request: Request, limit: Optional[int] = 100, min_time: Optional[int] = 0, max_time: Optional[int] = None,
+                     paginate: Optional[bool] = False, cursor: Optional[str] = None):
     try:
-        return get_top_payers_to_payee(db, address, limit, min_time, max_time)
+        if paginate or cursor:
+            return await paged(request, partial(get_top_payers, db, min_time=min_time), limit, cursor, max_time)
+        return await top_with_live_tail(request, get_top_payers, PAYER_TOTALS, n=limit, min_time=min_time, max_time=max_time)
     except pyArango.theExceptions.AQLFetchError:
-        return JSONResponse({'Message': 'No results returned for query'})
+        return ORJSONResponse({'Message': 'No results returned for query'})
 
 
-@app.get('/payments/totals', response_class=JSONResponse, tags=['payments'])
-async def top_payment_totals(limit: Optional[int] = 100, min_time: Optional[int] = 0, max_time: Optional[int] = int(datetime.utcnow().timestamp())):
+@app.get('/payments/payees', response_class=ORJSONResponse, tags=['payments'])
+@cached(ttl=PAYMENTS_CACHE_TTL, time_bucket=TIME_BUCKET_SECONDS, unless=is_paged, depends_on=PAYMENTS)
+@limited()
+async def top_payees(request: Request, limit: Optional[int] = 100, min_time: Optional[int] = 0, max_time: Optional[int] = None,
+                     paginate: Optional[bool] = False, cursor: Optional[str] = None):
     try:
-        return get_top_payment_totals(db, limit, min_time, max_time)
+        if paginate or cursor:
+            return await paged(request, partial(get_top_payees, db, min_time=min_time), limit, cursor, max_time)
+        return await top_with_live_tail(request, get_top_payees, PAYEE_TOTALS, n=limit, min_time=min_time, max_time=max_time)
     except pyArango.theExceptions.AQLFetchError:
-        return JSONResponse({'Message': 'No results returned for query'})
+        return ORJSONResponse({'Message': 'No results returned for query'})
 
-@app.get('/payments/counts', response_class=JSONResponse, tags=['payments'])
-async def top_payment_counts(limit: Optional[int] = 100, min_time: Optional[int] = 0, max_time: Optional[int] = int(datetime.utcnow().timestamp())):
+
+@app.get('/payments/payers/graph', response_class=ORJSONResponse, tags=['payments'])
+@cached(ttl=PAYMENTS_CACHE_TTL, time_bucket=TIME_BUCKET_SECONDS, unless=wants_binary_graph, depends_on=PAYMENTS)
+@limited()
+async def top_payers_graph(request: Request, limit: Optional[int] = 10, min_time: Optional[int] = 0,
+                           max_time: Optional[int] = None, fields: Optional[str] = None, edge_format: Optional[str] = 'rows',
+                           format: Optional[str] = None, table: Optional[str] = 'edges'):
+    graph_format = negotiate_graph_format(format, request.headers.get('accept'))
+    if graph_format is None or table not in GRAPH_TABLES:
+        return ORJSONResponse({'Message': 'Invalid format'})
+    if edge_format not in EDGE_FORMATS:
+        return ORJSONResponse({'Message': 'Invalid edge_format'})
     try:
-        return get_top_payment_counts(db, limit, min_time, max_time)
+        nodes, edges = await run_query(get_graph_from_top_payers, db, limit, min_time, max_time, split_fields(fields),
+                                       request=request)
+        return await graph_response(nodes, edges, graph_format, edge_format, table)
     except pyArango.theExceptions.AQLFetchError:
-        return JSONResponse({'Message': 'No results returned for query'})
+        return ORJSONResponse({'Message': 'No results returned for query'})
+
+
+@app.get('/payments/payees/graph', response_class=ORJSONResponse, tags=['payments'])
+@cached(ttl=PAYMENTS_CACHE_TTL, time_bucket=TIME_BUCKET_SECONDS, unless=wants_binary_graph, depends_on=PAYMENTS)
+@limited()
+async def top_payees_graph(request: Request, limit: Optional[int] = 10, min_time: Optional[int] = 0,
+                           max_time: Optional[int] = None, fields: Optional[str] = None, edge_format: Optional[str] = 'rows',
+                           format: Optional[str] = None, table: Optional[str] = 'edges'):
+    graph_format = negotiate_graph_format(format, request.headers.get('accept'))
+    if graph_format is None or table not in GRAPH_TABLES:
+        return ORJSONResponse({'Message': 'Invalid format'})
+    if edge_format not in EDGE_FORMATS:
+        return ORJSONResponse({'Message': 'Invalid edge_format'})
+    try:
+        nodes, edges = await run_query(get_graph_to_top_payees, db, limit, min_time, max_time, split_fields(fields),
+                                       request=request)
+        return await graph_response(nodes, edges, graph_format, edge_format, table)
+    except pyArango.theExceptions.AQLFetchError:
+        return ORJSONResponse({'Message': 'No results returned for query'})
+
 
-@app.get('/payments/payers', response_class=JSONResponse, tags=['payments'])
-async def top_payers(limit: Optional[int] = 100, min_time: Optional[int] = 0, max_time: Optional[int] = int(datetime.utcnow().timestamp())):
+@app.get('/payments/{address}/traversal', response_class=ORJSONResponse, tags=['payments'])
+@cached(ttl=PAYMENTS_CACHE_TTL, time_bucket=TIME_BUCKET_SECONDS, unless=wants_binary_graph, depends_on=PAYMENTS)
+@limited()
+async def payment_traversal(request: Request, address: str, depth: Optional[int] = 2, direction: Optional[str] = 'outbound',
+                            min_time: Optional[int] = 0, max_time: Optional[int] = None, fan_out: Optional[int] = 10,
+                            max_nodes: Optional[int] = 500, max_edges: Optional[int] = 2000, fields: Optional[str] = None,
+                            edge_format: Optional[str] = 'rows', format: Optional[str] = None, table: Optional[str] = 'edges'):
+    graph_format = negotiate_graph_format(format, request.headers.get('accept'))
+    if graph_format is None or table not in GRAPH_TABLES:
+        return ORJSONResponse({'Message': 'Invalid format'})
+    if edge_format not in EDGE_FORMATS:
+        return ORJSONResponse({'Message': 'Invalid edge_format'})
+    message = invalid_traversal(depth, direction, fan_out, max_nodes, max_edges)
+    if message:
+        return ORJSONResponse({'Message': message})
     try:
-        return get_top_payers(db, limit, min_time, max_time)
+        nodes, edges = await run_query(get_payment_traversal, db, address, depth, direction, min_time, max_time, fan_out,
+                                       max_nodes, max_edges, split_fields(fields), request=request)
+        return await graph_response(nodes, edges, graph_format, edge_format, table)
     except pyArango.theExceptions.AQLFetchError:
-        return JSONResponse({'Message': 'No results returned for query'})
+        return ORJSONResponse({'Message': 'No results returned for query'})
 
-@app.get('/payments/payees', response_class=JSONResponse, tags=['payments'])
-async def top_payees(limit: Optional[int] = 100, min_time: Optional[int] = 0, max_time: Optional[int] = int(datetime.utcnow().timestamp())):
+
+@app.get('/payments/analytics', response_class=ORJSONResponse, tags=['payments'])
+@limited()
+async def payment_graph_analytics(request: Request, metric: Optional[str] = 'pagerank', weight: Optional[str] = 'amount',
+                                  limit: Optional[int] = 100, min_time: Optional[int] = 0, max_time: Optional[int] = None):
+    message = invalid_analytics('payments', metric, weight)
+    if message:
+        return ORJSONResponse({'Message': message})
     try:
-        return get_top_payees(db, limit, min_time, max_time)
+        metrics = await run_query(get_metrics, db, 'payments', weight, min_time, max_time, request=request)
+        return analytics_response(metrics.top(metric, limit), metrics.window)
     except pyArango.theExceptions.AQLFetchError:
-        return JSONResponse({'Message': 'No results returned for query'})
+        return ORJSONResponse({'Message': 'No results returned for query'})
+
 
-@app.get('/payments/payers/graph', response_class=JSONResponse, tags=['payments'])
-async def top_payers_graph(limit: Optional[int] = 10, min_time: Optional[int] = 0, max_time: Optional[int] = int(datetime.utcnow().timestamp())):
+@app.get('/payments/analytics/components', response_class=ORJSONResponse, tags=['payments'])
+@limited()
+async def payment_graph_components(request: Request, limit: Optional[int] = 10, min_time: Optional[int] = 0,
+                                   max_time: Optional[int] = None):
     try:
-        nodes, edges = get_graph_from_top_payers(db, limit, min_time, max_time)
-        return {'nodes': nodes, 'edges': edges}
+        metrics = await run_query(get_metrics, db, 'payments', 'amount', min_time, max_time, request=request)
+        return analytics_response(metrics.component_summary(limit), metrics.window)
     except pyArango.theExceptions.AQLFetchError:
-        return JSONResponse({'Message': 'No results returned for query'})
+        return ORJSONResponse({'Message': 'No results returned for query'})
+
 
-@app.get('/payments/payees/graph', response_class=JSONResponse, tags=['payments'])
-async def top_payees_graph(limit: Optional[int] = 10, min_time: Optional[int] = 0, max_time: Optional[int] = int(datetime.utcnow().timestamp())):
+@app.get('/payments/{address}/analytics', response_class=ORJSONResponse, tags=['payments'])
+@limited()
+async def account_graph_analytics(request: Request, address: str, weight: Optional[str] = 'amount',
+                                  min_time: Optional[int] = 0, max_time: Optional[int] = None):
+    message = invalid_analytics('payments', 'pagerank', weight)
+    if message:
+        return ORJSONResponse({'Message': message})
     try:
-        nodes, edges = get_graph_to_top_payees(db, limit, min_time, max_time)
-        return {'nodes': nodes, 'edges': edges}
+        node, window = await run_query(get_node_metrics, db, 'payments', weight, address, min_time, max_time, request=request)
     except pyArango.theExceptions.AQLFetchError:
-        return JSONResponse({'Message': 'No results returned for query'})
+        node = None
+    if node is None:
+        return ORJSONResponse({'Message': 'No results returned for query'})
+    return analytics_response(node, window)
 
 
-@app.get('/hotspots/coords/graph', response_class=JSONResponse, tags=['hotspots'])
-async def witnesses_near_coords_graph(lat: float, lon: float, limit: Optional[int] = 10):
+@app.get('/hotspots/coords/graph', response_class=ORJSONResponse, tags=['hotspots'])
+@cached(ttl=HOTSPOTS_CACHE_TTL, unless=wants_binary_graph, depends_on=WITNESSES)
+@limited()
+async def witnesses_near_coords_graph(request: Request, lat: float, lon: float, limit: Optional[int] = 10,
+                                      fields: Optional[str] = None, edge_format: Optional[str] = 'rows',
+                                      format: Optional[str] = None, table: Optional[str] = 'edges'):
+    graph_format = negotiate_graph_format(format, request.headers.get('accept'))
+    if graph_format is None or table not in GRAPH_TABLES:
+        return ORJSONResponse({'Message': 'Invalid format'})
+    if edge_format not in EDGE_FORMATS:
+        return ORJSONResponse({'Message': 'Invalid edge_format'})
     try:
-        nodes, edges = get_witness_graph_near_coordinates(db, lat, lon, limit)
-        return {'nodes': nodes, 'edges': edges}
+        nodes, edges = await run_query(get_witness_graph_near_coordinates, db, lat, lon, limit, split_fields(fields),
+                                       request=request)
+        return await graph_response(nodes, edges, graph_format, edge_format, table)
     except pyArango.theExceptions.AQLFetchError:
-        return JSONResponse({'Message': 'No results returned for query'})
+        return ORJSONResponse({'Message': 'No results returned for query'})
 
 
-@app.get('/hotspots/hex/graph', response_class=JSONResponse, tags=['hotspots'])
-async def witnesses_in_hex_graph(hex: str):
+@app.get('/hotspots/hex/graph', response_class=ORJSONResponse, tags=['hotspots'])
+@cached(ttl=HOTSPOTS_CACHE_TTL, unless=wants_binary_graph, depends_on=WITNESSES)
+@limited()
+async def witnesses_in_hex_graph(request: Request, hex: str, fields: Optional[str] = None, edge_format: Optional[str] = 'rows',
+                                 format: Optional[str] = None, table: Optional[str] = 'edges'):
+    graph_format = negotiate_graph_format(format, request.headers.get('accept'))
+    if graph_format is None or table not in GRAPH_TABLES:
+        return ORJSONResponse({'Message': 'Invalid format'})
+    if edge_format not in EDGE_FORMATS:
+        return ORJSONResponse({'Message': 'Invalid edge_format'})
+    import h3
     if h3.h3_is_valid(hex) is False:
-        return JSONResponse({'Message': 'Invalid hex'})
+        return ORJSONResponse({'Message': 'Invalid hex'})
     else:
         try:
-            nodes, edges = get_witness_graph_in_hex(db, hex)
-            return {'nodes': nodes, 'edges': edges}
+            nodes, edges = await run_query(get_witness_graph_in_hex, db, hex, split_fields(fields), request=request)
+            return await graph_response(nodes, edges, graph_format, edge_format, table)
         except pyArango.theExceptions.AQLFetchError:
-            return JSONResponse({'Message': 'No results returned for query'})
+            return ORJSONResponse({'Message': 'No results returned for query'})
 
 
-@app.get('/hotspots/{address}/outbound', response_class=JSONResponse, tags=['hotspots'])
-async def outbound_witnesses_for_hotspot(address: str):
+@app.get('/hotspots/{address}/traversal', response_class=ORJSONResponse, tags=['hotspots'])
+@cached(ttl=HOTSPOTS_CACHE_TTL, time_bucket=TIME_BUCKET_SECONDS, unless=wants_binary_graph, depends_on=WITNESSES)
+@limited()
+async def witness_traversal(request: Request, address: str, depth: Optional[int] = 2, direction: Optional[str] = 'outbound',
+                            min_time: Optional[int] = 0, max_time: Optional[int] = None, fan_out: Optional[int] = 10,
+                            max_nodes: Optional[int] = 500, max_edges: Optional[int] = 2000, fields: Optional[str] = None,
+                            edge_format: Optional[str] = 'rows', format: Optional[str] = None, table: Optional[str] = 'edges'):
+    graph_format = negotiate_graph_format(format, request.headers.get('accept'))
+    if graph_format is None or table not in GRAPH_TABLES:
+        return ORJSONResponse({'Message': 'Invalid format'})
+    if edge_format not in EDGE_FORMATS:
+        return ORJSONResponse({'Message': 'Invalid edge_format'})
+    message = invalid_traversal(depth, direction, fan_out, max_nodes, max_edges)
+    if message:
+        return ORJSONResponse({'Message': message})
     try:
-        return {'witnesses': get_outbound_witnesses_for_hotspot(db, address)}
+        nodes, edges = await run_query(get_witness_traversal, db, address, depth, direction, min_time, max_time, fan_out,
+                                       max_nodes, max_edges, split_fields(fields), request=request)
+        return await graph_response(nodes, edges, graph_format, edge_format, table)
     except pyArango.theExceptions.AQLFetchError:
-        return JSONResponse({'Message': 'No results returned for query'})
+        return ORJSONResponse({'Message': 'No results returned for query'})
 
 
-@app.get('/hotspots/{address}/inbound', response_class=JSONResponse, tags=['hotspots'])
-async def inbound_witnesses_for_hotspot(address: str):
+@app.get('/hotspots/hex/stats', response_class=ORJSONResponse, tags=['hotspots'])
+@cached(ttl=HOTSPOTS_CACHE_TTL, time_bucket=TIME_BUCKET_SECONDS, depends_on=WITNESSES)
+@limited()
+async def hex_witness_stats(request: Request, hex: str, direction: Optional[str] = 'outbound', min_time: Optional[int] = 0,
+                            max_time: Optional[int] = None):
+    import h3
+    if h3.h3_is_valid(hex) is False:
+        return ORJSONResponse({'Message': 'Invalid hex'})
+    if direction not in STATS_DIRECTIONS:
+        return ORJSONResponse({'Message': 'Invalid direction'})
     try:
-        return {'witnesses': get_inbound_witnesses_for_hotspot(db, address)}
+        return await run_query(get_hex_witness_stats, db, hex, direction, min_time, max_time, request=request)
     except pyArango.theExceptions.AQLFetchError:
-        return JSONResponse({'Message': 'No results returned for query'})
+        return ORJSONResponse({'Message': 'No results returned for query'})
 
 
-@app.get('/hotspots/receipts', response_class=JSONResponse, tags=['hotspots'])
-async def witness_receipts(address: Optional[str] = None, limit: Optional[int] = 1000):
+@app.get('/hotspots/{address}/stats', response_class=ORJSONResponse, tags=['hotspots'])
+@cached(ttl=HOTSPOTS_CACHE_TTL, time_bucket=TIME_BUCKET_SECONDS, depends_on=WITNESSES)
+@limited()
+async def hotspot_witness_stats(request: Request, address: str, direction: Optional[str] = 'outbound',
+                                min_time: Optional[int] = 0, max_time: Optional[int] = None):
+    if direction not in STATS_DIRECTIONS:
+        return ORJSONResponse({'Message': 'Invalid direction'})
     try:
-        return {'receipts': get_sample_of_recent_witness_receipts(db, address, limit)}
+        return await run_query(get_hotspot_witness_stats, db, address, direction, min_time, max_time, request=request)
     except pyArango.theExceptions.AQLFetchError:
-        return JSONResponse({'Message': 'No results returned for query'})
+        return ORJSONResponse({'Message': 'No results returned for query'})
 
 
-@app.get('/hotspots/clusters', response_class=JSONResponse, tags=['hotspots'])
-async def cluster_centers(n_clusters: Optional[str] = 500):
-    if os.getenv('REDIS_ACTIVE'):
-        centroid_key = f'centroids_{n_clusters}'
-        if r.exists(centroid_key):
-            (centroids, error) = pickle.loads(r.get(centroid_key))
-        else:
-            if r.exists('hotspot_coordinates'):
-                coords = pickle.loads(r.get('hotspot_coordinates'))
-            else:
-                coords = get_hotspot_coordinates(db)
-                r.set('hotspot_coordinates', pickle.dumps(coords), ex=REDIS_EXPIRATION_SECONDS)
-            (centroids, error) = get_cluster_centers(coords, int(n_clusters))
-            r.set(centroid_key, pickle.dumps((centroids, error)), ex=REDIS_EXPIRATION_SECONDS)
-    else:
-        coords = get_hotspot_coordinates(db)
-        (centroids, error) = get_cluster_centers(coords, int(n_clusters))
+@app.post('/hotspots/batch/outbound', tags=['hotspots'])
+@limited()
+async def batch_outbound_witnesses(addresses: List[str] = Body(..., embed=True), batch_size: Optional[int] = 100):
+    message = invalid_batch(addresses)
+    if message:
+        return ORJSONResponse({'Message': message})
+    return await ndjson_response(iter_batch_outbound_witnesses(db, addresses, batch_size))
+
+
+@app.post('/hotspots/batch/inbound', tags=['hotspots'])
+@limited()
+async def batch_inbound_witnesses(addresses: List[str] = Body(..., embed=True), batch_size: Optional[int] = 100):
+    message = invalid_batch(addresses)
+    if message:
+        return ORJSONResponse({'Message': message})
+    return await ndjson_response(iter_batch_inbound_witnesses(db, addresses, batch_size))
+
+
+def snapshot_witnesses(address: str, direction: str) -> Optional[Response]:
+    """
+    Answer an adjacency lookup from the witness graph snapshot. Goes before @cached and @limited, since a lookup is cheaper
+    than either of them.
+
+    :param address: The hotspot address.
+    :param direction: 'outbound' or 'inbound'.
+    :return: The response, or None if the hotspot is not in the snapshot and Arango must be queried.
+    """
+    snapshot = witness_graph.snapshot
+    if snapshot is None or address not in snapshot.ids:
+        return None
+    body = snapshot.witnesses_json(address, direction)
+    if body is None:
+        return ORJSONResponse({'Message': 'No results returned for query'})
+    return Response(body, media_type='application/json')
+
+
+@app.get('/hotspots/{address}/outbound', response_class=ORJSONResponse, tags=['hotspots'])
+async def outbound_witnesses_for_hotspot(request: Request, address: str):
+    response = snapshot_witnesses(address, 'outbound')
+    if response is not None:
+        return response
+    return await query_outbound_witnesses(request=request, address=address)
+
+
+@cached(ttl=HOTSPOTS_CACHE_TTL)
+@limited()
+async def query_outbound_witnesses(request: Request, address: str):
+    try:
+        return {'witnesses': await run_query(get_outbound_witnesses_for_hotspot, db, address, request=request)}
+    except pyArango.theExceptions.AQLFetchError:
+        return ORJSONResponse({'Message': 'No results returned for query'})
+
+
+@app.get('/hotspots/{address}/inbound', response_class=ORJSONResponse, tags=['hotspots'])
+async def inbound_witnesses_for_hotspot(request: Request, address: str):
+    response = snapshot_witnesses(address, 'inbound')
+    if response is not None:
+        return response
+    return await query_inbound_witnesses(request=request, address=address)
+
+
+@cached(ttl=HOTSPOTS_CACHE_TTL)
+@limited()
+async def query_inbound_witnesses(request: Request, address: str):
+    try:
+        return {'witnesses': await run_query(get_inbound_witnesses_for_hotspot, db, address, request=request)}
+    except pyArango.theExceptions.AQLFetchError:
+        return ORJSONResponse({'Message': 'No results returned for query'})
+
+
+@app.get('/hotspots/receipts', response_class=ORJSONResponse, tags=['hotspots'])
+@cached(ttl=HOTSPOTS_CACHE_TTL, unless=is_streamed, depends_on=WITNESSES)
+@limited()
+async def witness_receipts(request: Request, address: Optional[str] = None, limit: Optional[int] = 1000,
+                           format: Optional[str] = 'json',
+                           batch_size: Optional[int] = QUERY_BATCH_SIZE, cursor: Optional[str] = None):
+    if format not in ('json', 'ndjson'):
+        return ORJSONResponse({'Message': 'Invalid format'})
+    if format == 'ndjson':
+        return await ndjson_response(iter_sample_of_recent_witness_receipts(db, address, limit, batch_size))
+    try:
+        receipts, next_cursor = await run_query(get_witness_receipts_page, db, address, limit, cursor, request=request)
+        return {'receipts': receipts, 'next': next_cursor}
+    except pyArango.theExceptions.AQLFetchError:
+        return ORJSONResponse({'Message': 'No results returned for query'})
+
+
+@app.get('/hotspots/coordinates', response_class=ORJSONResponse, tags=['hotspots'])
+@cached(ttl=HOTSPOTS_CACHE_TTL, unless=is_streamed, depends_on=HOTSPOTS)
+@limited()
+async def hotspot_coordinates(request: Request, format: Optional[str] = 'json', batch_size: Optional[int] = QUERY_BATCH_SIZE):
+    if format not in ('json', 'ndjson'):
+        return ORJSONResponse({'Message': 'Invalid format'})
+    if format == 'ndjson':
+        return await ndjson_response(iter_hotspot_coordinates(db, batch_size))
+    try:
+        return {'coordinates': await run_query(get_hotspot_coordinates, db, request=request)}
+    except pyArango.theExceptions.AQLFetchError:
+        return ORJSONResponse({'Message': 'No results returned for query'})
+
+
+@app.get('/hotspots/tiles/{z}/{x}/{y}', tags=['hotspots'])
+@limited()
+async def hotspot_tile(request: Request, z: int, x: int, y: int, format: Optional[str] = 'binary'):
+    if not valid_tile(z, x, y):
+        return ORJSONResponse({'Message': 'Invalid tile'})
+    if format not in ('binary', 'json'):
+        return ORJSONResponse({'Message': 'Invalid format'})
+    kind = 'points' if z >= TILE_POINTS_MIN_ZOOM else 'cells'
+    key, ttl = versioned(f'{request.url.path}?format={format}', HOTSPOTS_CACHE_TTL, HOTSPOTS)
+    if kind == 'cells':
+        ttl = cells_ttl(ttl)
+    if format == 'json':
+        async def compute_json():
+            return tile_json(*await run_query(get_tile, db, z, x, y, request=request))
+
+        body = await get_or_set_json(key, ttl, compute_json, route='hotspot_tile')
+        return Response(body, media_type='application/json')
+
+    async def compute_binary():
+        _, rows, _ = await run_query(get_tile, db, z, x, y, request=request)
+        return rows.astype('<f4').tobytes()
+
+    body = await get_or_set_bytes(key, ttl, compute_binary, route='hotspot_tile')
+    return Response(body, media_type='application/octet-stream', headers={'X-Tile-Kind': kind})
+
+
+@app.get('/hotspots/clusters', response_class=ORJSONResponse, tags=['hotspots'])
+@cached(ttl=CLUSTERS_CACHE_TTL)
+@limited(concurrency=1)
+async def cluster_centers(request: Request, n_clusters: Optional[int] = 500):
+    if CLUSTERING_ACTIVE:
+        precomputed = await run_query(get_precomputed_clusters, n_clusters)
+        if precomputed is not None:
+            return precomputed
+    key, ttl = versioned('hotspot_coordinates', CLUSTERS_CACHE_TTL, HOTSPOTS)
+    coords = orjson.loads(await get_or_set_json(key, ttl, lambda: run_query(get_hotspot_coordinates, db)))
+    (centroids, error) = await run_query(compute_cluster_centers, coords, n_clusters, request=request)
     return {'centroids': centroids, 'error': error}
 
 
+@app.get('/cache/stats', response_class=ORJSONResponse, tags=['service'])
+async def cache_statistics():
+    return cache_stats
+
+
+@app.get('/metrics', tags=['service'])
+async def prometheus_metrics():
+    return Response(render_metrics(), media_type=CONTENT_TYPE_LATEST)
+
+
+@app.get('/healthz', response_class=ORJSONResponse, tags=['service'])
+async def health():
+    return {'status': 'ok'}
+
+
+@app.get('/readyz', response_class=ORJSONResponse, tags=['service'])
+async def readiness():
+    if not ready:
+        return ORJSONResponse({'Message': 'Warming up'}, status_code=503)
+    try:
+        await run_query(ping, db, timeout=READY_CHECK_TIMEOUT_SECONDS)
+    except Exception:
+        return ORJSONResponse({'Message': 'Database unavailable'}, status_code=503)
+    return {'status': 'ready'}
+
+
+@app.get('/witnesses/analytics', response_class=ORJSONResponse, tags=['hotspots'])
+@limited()
+async def witness_graph_analytics(request: Request, metric: Optional[str] = 'pagerank', weight: Optional[str] = 'count',
+                                  limit: Optional[int] = 100, min_time: Optional[int] = 0, max_time: Optional[int] = None):
+    message = invalid_analytics('witnesses', metric, weight)
+    if message:
+        return ORJSONResponse({'Message': message})
+    try:
+        metrics = await run_query(get_metrics, db, 'witnesses', weight, min_time, max_time, request=request)
+        return analytics_response(metrics.top(metric, limit), metrics.window)
+    except pyArango.theExceptions.AQLFetchError:
+        return ORJSONResponse({'Message': 'No results returned for query'})
+
+
+@app.get('/witnesses/analytics/components', response_class=ORJSONResponse, tags=['hotspots'])
+@limited()
+async def witness_graph_components(request: Request, limit: Optional[int] = 10, min_time: Optional[int] = 0,
+                                   max_time: Optional[int] = None):
+    try:
+        metrics = await run_query(get_metrics, db, 'witnesses', 'count', min_time, max_time, request=request)
+        return analytics_response(metrics.component_summary(limit), metrics.window)
+    except pyArango.theExceptions.AQLFetchError:
+        return ORJSONResponse({'Message': 'No results returned for query'})
+
+
+@app.get('/hotspots/{address}/analytics', response_class=ORJSONResponse, tags=['hotspots'])
+@limited()
+async def hotspot_graph_analytics(request: Request, address: str, weight: Optional[str] = 'count', min_time: Optional[int] = 0,
+                                  max_time: Optional[int] = None):
+    message = invalid_analytics('witnesses', 'pagerank', weight)
+    if message:
+        return ORJSONResponse({'Message': message})
+    try:
+        node, window = await run_query(get_node_metrics, db, 'witnesses', weight, address, min_time, max_time, request=request)
+    except pyArango.theExceptions.AQLFetchError:
+        node = None
+    if node is None:
+        return ORJSONResponse({'Message': 'No results returned for query'})
+    return analytics_response(node, window)
+
+
+@app.get('/witnesses/snapshot/stats', response_class=ORJSONResponse, tags=['service'])
+async def witness_snapshot_statistics():
+    if witness_graph.snapshot is None:
+        return ORJSONResponse({'Message': 'No witness graph snapshot loaded'})
+    return witness_graph.snapshot.stats()
+
+
 if __name__ == '__main__':
+    import uvicorn
     uvicorn.run(app, host='0.0.0.0', port=8000)
@@ -0,0 +1,77 @@
+import threading
+import weakref
+from typing import AsyncIterator, Iterator, Optional
+import orjson
+from fastapi.responses import StreamingResponse
+from query_executor import run_query, background_executor
+
+
+class BlockingBatches:
+    def __init__(self, batches: Iterator[list]):
+        """
+        Pull batches from a blocking generator (e.g. arango_queries.iter_registered) on the query executor.
+        Calls are serialized, so the generator can be closed while a batch fetched for an abandoned stream is still in flight.
+
+        :param batches: Generator of result batches.
+        """
+        self.batches = iter(batches)
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def _next(self) -> Optional[list]:
+        with self.lock:
+            return next(self.batches, None)
+
+    def _close(self):
+        with self.lock:
+            if hasattr(self.batches, 'close'):
+                self.batches.close()
+
+    async def next(self) -> Optional[list]:
+        """
+        :return: The next batch, or None once the generator is exhausted.
+        """
+        return await run_query(self._next)
+
+    def close(self):
+        """
+        Close the generator, e.g. so that it releases its Arango cursor, without waiting for it. Only the first call has an
+        effect.
+        """
+        if not self.closed:
+            self.closed = True
+            background_executor.submit(self._close)
+
+
+async def _ndjson_lines(batches: BlockingBatches, first: list) -> AsyncIterator[bytes]:
+    # each batch is only fetched once the previous one has been written, so a slow client applies backpressure all the way to
+    # the Arango cursor
+    try:
+        batch = first
+        while batch is not None:
+            if batch:
+                yield b'\n'.join(orjson.dumps(row) for row in batch) + b'\n'
+            batch = await batches.next()
+    finally:
+        batches.close()
+
+
+async def ndjson_response(batches: Iterator[list]) -> StreamingResponse:
+    """
+    Stream results as newline-delimited JSON, one row per line, writing each batch to the socket as it arrives. The first batch
+    is fetched before the response starts, so a query that fails outright is answered with an error status rather than a 200
+    that breaks off. The generator is closed once the stream ends or is abandoned, e.g. when the client disconnects.
+
+    :param batches: Generator of result batches.
+    :return: The streaming response.
+    """
+    batches = BlockingBatches(batches)
+    try:
+        first = await batches.next()
+    except BaseException:
+        batches.close()
+        raise
+    body = _ndjson_lines(batches, first or [])
+    # a body that is dropped before it starts never runs its finally
+    weakref.finalize(body, batches.close)
+    return StreamingResponse(body, media_type='application/x-ndjson')
@@ -1,3 +1,5 @@
+import json
+import time
 from fastapi.testclient import TestClient
 from server import app
 
@@ -8,6 +10,15 @@ TEST_HOTSPOT = '112nUEtrKPrgWtczpbira7aDU5271qduDfJm8Y2WSXjWwpkAHdgJ'
 client = TestClient(app)
 
 
+def setup_module():
+    # run the startup hooks, which connect to Arango
+    client.__enter__()
+
+
+def teardown_module():
+    client.__exit__(None, None, None)
+
+
 def test_routes():
     response = client.get(f'/payments/{TEST_ACCOUNT}/from')
     assert response.status_code == 200
@@ -19,23 +30,31 @@ def test_routes():
     response = client.get(f'/payments/{TEST_ACCOUNT}/to')
     assert response.status_code == 200
 
-    response = client.get(f'/payments/totals', params={'limit': 10})
+    response = client.post('/payments/batch/from', json={'addresses': [TEST_ACCOUNT, TEST_ACCOUNT]}, params={'limit': 10})
+    assert response.status_code == 200
+    assert [row['address'] for row in map(json.loads, response.text.splitlines())] == [TEST_ACCOUNT, TEST_ACCOUNT]
+
+    response = client.get('/payments/totals', params={'limit': 10})
     assert response.status_code == 200
     assert len(response.json()) == 10
 
-    response = client.get(f'/payments/counts', params={'limit': 10})
+    first = client.get('/payments/totals', params={'limit': 5, 'paginate': True}).json()
+    second = client.get('/payments/totals', params={'limit': 5, 'cursor': first['next']}).json()
+    assert client.get('/payments/totals', params={'limit': 10}).json() == first['results'] + second['results']
+
+    response = client.get('/payments/counts', params={'limit': 10})
     assert response.status_code == 200
     assert len(response.json()) == 10
 
-    response = client.get(f'/payments/payers', params={'limit': 10})
+    response = client.get('/payments/payers', params={'limit': 10})
     assert response.status_code == 200
     assert len(response.json()) == 10
 
-    response = client.get(f'/payments/payees', params={'limit': 10})
+    response = client.get('/payments/payees', params={'limit': 10})
     assert response.status_code == 200
     assert len(response.json()) == 10
 
-    response = client.get(f'/payments/payers/graph', params={'limit': 10})
+    response = client.get('/payments/payers/graph', params={'limit': 10})
     assert response.status_code == 200
     try:
         data = response.json()
@@ -43,7 +62,16 @@ def test_routes():
     except KeyError:
         raise AssertionError
 
-    response = client.get(f'/payments/payees/graph', params={'limit': 10})
+    response = client.get('/payments/payers/graph', params={'limit': 10, 'fields': '_key'})
+    assert response.status_code == 200
+    assert all(list(node.keys()) == ['_key'] for node in response.json()['nodes'])
+
+    response = client.get('/payments/payers/graph', params={'limit': 10},
+                          headers={'Accept': 'application/vnd.apache.arrow.stream'})
+    assert response.status_code == 200
+    assert response.headers['content-type'] == 'application/vnd.apache.arrow.stream'
+
+    response = client.get('/payments/payees/graph', params={'limit': 10})
     assert response.status_code == 200
     try:
         data = response.json()
@@ -51,7 +79,14 @@ def test_routes():
     except KeyError:
         raise AssertionError
 
-    response = client.get(f'/hotspots/coords/graph', params={'lat': 40.689306, 'lon': -74.044500})
+    response = client.get(f'/payments/{TEST_ACCOUNT}/traversal', params={'depth': 2, 'fan_out': 5})
+    assert response.status_code == 200
+    assert all(edge['level'] in (1, 2) for edge in response.json()['edges'])
+
+    response = client.get(f'/payments/{TEST_ACCOUNT}/traversal', params={'direction': 'sideways'})
+    assert response.json() == {'Message': 'Invalid direction'}
+
+    response = client.get('/hotspots/coords/graph', params={'lat': 40.689306, 'lon': -74.044500})
     assert response.status_code == 200
     try:
         data = response.json()
@@ -59,7 +94,7 @@ def test_routes():
     except KeyError:
         raise AssertionError
 
-    response = client.get(f'/hotspots/hex/graph', params={'hex': '862a84707ffffff'})
+    response = client.get('/hotspots/hex/graph', params={'hex': '862a84707ffffff'})
     assert response.status_code == 200
     try:
         data = response.json()
@@ -67,29 +102,140 @@ def test_routes():
     except KeyError:
         raise AssertionError
 
-    response = client.get(f'/hotspots/hex/graph', params={'hex': 'not a hex!'})
+    response = client.get('/hotspots/hex/graph', params={'hex': '862a84707ffffff', 'edge_format': 'columnar'})
+    assert response.status_code == 200
+    edges = response.json()['edges']
+    assert len(set(len(column) for column in edges.values())) <= 1
+
+    # a coarser parent of the same hex
+    response = client.get('/hotspots/hex/graph', params={'hex': '842a847ffffffff'})
+    assert response.status_code == 200
+
+    response = client.get('/hotspots/hex/graph', params={'hex': 'not a hex!'})
     assert response.status_code == 200
     assert response.json() == {'Message': 'Invalid hex'}
 
+    response = client.get(f'/hotspots/{TEST_HOTSPOT}/traversal', params={'depth': 2, 'direction': 'any'})
+    assert response.status_code == 200
+
     response = client.get(f'/hotspots/{TEST_HOTSPOT}/outbound')
     assert response.status_code == 200
 
     response = client.get(f'/hotspots/{TEST_HOTSPOT}/inbound')
     assert response.status_code == 200
 
-    response = client.get(f'/hotspots/receipts', params={'limit': 50})
+    response = client.post('/hotspots/batch/outbound', json={'addresses': [TEST_HOTSPOT]})
     assert response.status_code == 200
+    assert len(response.text.splitlines()) == 1
 
-    response = client.get(f'/hotspots/receipts', params={'address': TEST_HOTSPOT, 'limit': 50})
+    response = client.get('/hotspots/receipts', params={'limit': 50})
     assert response.status_code == 200
 
+    response = client.get('/hotspots/receipts', params={'address': TEST_HOTSPOT, 'limit': 50})
+    assert response.status_code == 200
 
+    first = client.get('/hotspots/receipts', params={'limit': 10}).json()
+    second = client.get('/hotspots/receipts', params={'limit': 10, 'cursor': first['next']}).json()
+    assert not {receipt['_key'] for receipt in first['receipts']} & {receipt['_key'] for receipt in second['receipts']}
 
+    response = client.get('/hotspots/receipts', params={'cursor': 'not a cursor'})
+    assert response.json() == {'Message': 'Invalid or expired cursor'}
 
+    response = client.get('/hotspots/receipts', params={'limit': 50, 'format': 'ndjson', 'batch_size': 10})
+    assert response.status_code == 200
+    assert len(response.text.splitlines()) == 50
 
 
+def test_cache_stats():
+    client.get('/payments/totals', params={'limit': 10})
+    client.get('/payments/totals', params={'limit': 10})
+    response = client.get('/cache/stats')
+    assert response.status_code == 200
+    assert response.json()['top_payment_totals']['lru_hits'] >= 1
+
+
+def test_witness_snapshot_stats():
+    stats = client.get('/witnesses/snapshot/stats').json()
+    if 'Message' in stats:
+        # inactive, or still loading in the background
+        assert stats == {'Message': 'No witness graph snapshot loaded'}
+        return
+    assert stats['edges'] > 0 and stats['hotspots'] > 0
+    assert stats['memory_bytes']['total'] == sum(stats['memory_bytes'][part] for part in ('arrays', 'documents', 'index'))
+
+
+def test_metrics():
+    client.get('/payments/totals', params={'limit': 10})
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert 'http_request_duration_seconds_count{method="GET",route="top_payment_totals",status="200"}' in response.text
+
+
+def test_health():
+    assert client.get('/healthz').status_code == 200
+    # warm-up runs in the background after startup, so readiness has to be waited for
+    deadline = time.monotonic() + 60
+    response = client.get('/readyz')
+    while response.status_code == 503 and time.monotonic() < deadline:
+        assert response.json() == {'Message': 'Warming up'}
+        time.sleep(0.5)
+        response = client.get('/readyz')
+    assert response.status_code == 200
+    assert response.json() == {'status': 'ready'}
+
+
+def test_graph_analytics():
+    response = client.get('/payments/analytics', params={'metric': 'pagerank', 'limit': 10, 'min_time': 1600001234})
+    assert response.status_code == 200
+    # the window is floored to the hour
+    assert response.headers['x-window-min-time'] == str(1600001234 - 1600001234 % 3600)
+    response = client.get('/payments/analytics', params={'metric': 'closeness'})
+    assert 'Message' in response.json()
+    response = client.get('/witnesses/analytics/components', params={'limit': 5})
+    assert response.status_code == 200
+
+
+def test_witness_stats():
+    response = client.get(f'/hotspots/{TEST_HOTSPOT}/stats', params={'direction': 'inbound'})
+    assert response.status_code == 200
+    response = client.get('/hotspots/hex/stats', params={'hex': '862a84707ffffff'})
+    assert response.status_code == 200
+
+
+def test_hotspot_tiles():
+    response = client.get('/hotspots/tiles/2/1/1')
+    assert response.status_code == 200
+    assert response.headers['x-tile-kind'] == 'cells'
+    assert len(response.content) % 12 == 0
+    response = client.get('/hotspots/tiles/12/1205/1540', params={'format': 'json'})
+    assert response.json()['kind'] == 'points'
+
 
+def test_admission_limits():
+    response = client.get('/payments/totals', params={'limit': 10000000})
+    assert 'Message' in response.json()
+    response = client.get('/hotspots/clusters', params={'n_clusters': 100000})
+    assert 'Message' in response.json()
 
 
+def test_account_summary():
+    response = client.get(f'/accounts/{TEST_ACCOUNT}/summary', params={'limit': 5})
+    summary = response.json()
+    assert summary['address'] == TEST_ACCOUNT
+    assert len(summary['outflow']['top']) <= 5
+    assert summary['outflow']['counterparties'] >= len(summary['outflow']['top'])
 
 
+def test_traversal_scan_limit():
+    import server
+    from arango_queries import run_registered
+    from traversals import PAYMENT_LEVELS
+    # the top payer is the busiest hub the test data has
+    hub = 'accounts/' + client.get('/payments/payers', params={'limit': 1}).json()[0]['_from']
+    bind_vars = {'frontier': [hub], 'min_time': 0, 'max_time': 2 ** 31, 'max_scanned': 3, 'fan_out': 100, 'max_edges': 100}
+    edges = run_registered(server.db, PAYMENT_LEVELS['any'], {**bind_vars, 'visited': {hub: True}}, raise_if_empty=False)
+    # every edge read is counted in some group, so no more than max_scanned of them are
+    assert sum(edge['num_payments'] for edge in edges) <= 3
+    # once the neighbors behind the first max_scanned edges are visited, nothing is left within the scan limit
+    visited = {hub: True, **{edge['_to'] if edge['_from'] == hub else edge['_from']: True for edge in edges}}
+    assert run_registered(server.db, PAYMENT_LEVELS['any'], {**bind_vars, 'visited': visited}, raise_if_empty=False) == []
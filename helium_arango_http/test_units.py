@@ -0,0 +1,512 @@
+"""Tests of the pure logic behind the routes, which need no database."""
+import asyncio
+import gc
+import threading
+import time
+import numpy as np
+import pytest
+from fastapi.responses import StreamingResponse
+import cache
+import time_windows
+from time_windows import TopSpec, merge_top
+from rollups import split_window, HOUR, DAY
+import pagination
+from pagination import encode_cursor, decode_cursor, InvalidCursorError
+from query_executor import ClientDisconnectedError, OverloadedError
+from admission import RouteLimiter, limited, MAX_LIMIT
+from streaming import BlockingBatches, ndjson_response
+import witness_graph
+import h3_index
+import change_feed
+import tiles
+import analytics
+from tiles import tile_bounds, valid_tile
+from encoding import index_graph, graph_to_msgpack, graph_to_arrow, negotiate_graph_format
+
+
+TOTALS = TopSpec(key_fields=('account',), value_fields=('total',), sort_by='total')
+
+
+def test_merge_top():
+    historical = [{'account': 'a', 'total': 10}, {'account': 'b', 'total': 8}, {'account': 'c', 'total': 5}]
+
+    # the tail moves groups within the historical top-k, and 'd' cannot have been above the k-th historical value (5) + 1
+    tail = [{'account': 'b', 'total': 4}, {'account': 'd', 'total': 1}]
+    assert merge_top(TOTALS, 2, historical, False, tail) == [{'account': 'b', 'total': 12}, {'account': 'a', 'total': 10}]
+
+    # 'd' may have up to 5 historically, so with its tail of 6 it could be anywhere up to 11, above the 2nd merged value
+    tail = [{'account': 'd', 'total': 6}]
+    assert merge_top(TOTALS, 2, historical, False, tail) is None
+
+    # once the historical part is complete, every group is known exactly
+    assert merge_top(TOTALS, 2, historical, True, tail) == [{'account': 'a', 'total': 10}, {'account': 'b', 'total': 8}]
+    assert merge_top(TOTALS, 4, historical, True, tail)[2] == {'account': 'd', 'total': 6}
+
+    # too few rows to know the n-th one
+    assert merge_top(TOTALS, 4, historical, False, []) is None
+    # the input rows are not modified
+    assert historical[0] == {'account': 'a', 'total': 10}
+
+
+def test_historical_requires_ingested_time(monkeypatch):
+    monkeypatch.setattr(time_windows, '_ingested', {'time': None})
+    assert not time_windows.is_historical(0)
+    assert time_windows.historical_boundary(0, None) is None
+
+    ingested = time_windows.now() - 10 * DAY
+    time_windows.set_ingested_time(ingested)
+    # never moves backwards
+    time_windows.set_ingested_time(ingested - DAY)
+    assert time_windows.is_historical(ingested - time_windows.IMMUTABLE_AFTER_SECONDS)
+    assert not time_windows.is_historical(ingested - time_windows.IMMUTABLE_AFTER_SECONDS + 1)
+    assert not time_windows.is_historical(None)
+    boundary = time_windows.historical_boundary(0, None)
+    assert boundary <= ingested - time_windows.IMMUTABLE_AFTER_SECONDS
+    assert boundary % time_windows.HISTORICAL_BUCKET_SECONDS == 0
+
+
+def test_split_window():
+    watermark = 10 * DAY
+    # partial hours at either end are left to the raw payments, whole days and hours in between come from the rollups
+    window = split_window(DAY + 30, 3 * DAY + 2 * HOUR + 30, watermark)
+    assert window == {'min_time': DAY + 30, 'max_time': 3 * DAY + 2 * HOUR + 30, 'lo': DAY + HOUR, 'hi': 3 * DAY + 2 * HOUR,
+                      'day_lo': 2 * DAY, 'day_hi': 3 * DAY}
+
+    # min_time is exclusive, so a window starting right before an hour boundary still starts at that hour
+    assert split_window(DAY - 1, 2 * DAY, watermark)['lo'] == DAY
+    assert split_window(DAY, 2 * DAY, watermark)['lo'] == DAY + HOUR
+
+    # no whole day: the day range is empty
+    window = split_window(0, 5 * HOUR, watermark)
+    assert window['day_lo'] == window['day_hi']
+
+    # clipped to the watermark, and nothing to do if no whole hour is below it
+    assert split_window(0, 20 * DAY, watermark)['hi'] == watermark
+    assert split_window(watermark, 20 * DAY, watermark) is None
+    assert split_window(30, HOUR + 30, watermark) is None
+
+
+def test_cursor_round_trip():
+    state = {'scope': 'top_payment_totals?n=5', 'offset': 10, 'key': '\uffff'}
+    cursor = encode_cursor(state)
+    # url safe and unpadded
+    assert '=' not in cursor and '+' not in cursor and '/' not in cursor
+    assert decode_cursor(cursor) == state
+
+    payload, signature = cursor.split('.')
+    forged = encode_cursor({**state, 'offset': 0}).split('.')[0]
+    # unsigned, truncated, or a payload that was changed under its signature
+    for cursor in ('not a cursor!', cursor[:-3], payload, f'{forged}.{signature}'):
+        with pytest.raises(InvalidCursorError):
+            decode_cursor(cursor)
+    # a signed cursor that is not an object
+    with pytest.raises(InvalidCursorError):
+        decode_cursor(encode_cursor([1]))
+
+
+def test_materialized_page_pins_max_time(monkeypatch):
+    monkeypatch.setattr(pagination, 'MATERIALIZED_PAGES', 1)
+    monkeypatch.setattr(pagination.cache, 'redis_client', None)
+    monkeypatch.setattr(pagination, 'WORKERS', 1)
+    calls = []
+
+    def compute(n, max_time):
+        calls.append(max_time)
+        return list(range(10))[:n]
+
+    monkeypatch.setattr(time_windows, 'now', lambda: 1000)
+    rows, cursor = pagination.get_materialized_page('/top', compute, 3)
+    assert rows == [0, 1, 2] and calls == [1000]
+    # past the materialized page, the query is re-run for the window of the first page
+    monkeypatch.setattr(time_windows, 'now', lambda: 2000)
+    rows, cursor = pagination.get_materialized_page('/top', compute, 3, cursor, max_time=None)
+    assert rows == [3, 4, 5] and calls == [1000, 1000]
+    rows, cursor = pagination.get_materialized_page('/top', compute, 3, cursor)
+    assert rows == [6, 7, 8] and calls[-1] == 1000
+    with pytest.raises(InvalidCursorError):
+        pagination.get_materialized_page('/other', compute, 3, cursor)
+    rows, _ = pagination.get_materialized_page('/top', compute, 3, max_time=1500)
+    assert calls[-1] == 1500
+
+
+def test_single_flight():
+    cache.clear_lru()
+    calls = []
+
+    def compute_after(seconds: float, value: bytes = b'1', error: Exception = None):
+        async def compute():
+            calls.append(value)
+            await asyncio.sleep(seconds)
+            if error is not None:
+                raise error
+            return value
+        return compute
+
+    async def shared():
+        # concurrent misses share one computation
+        results = await asyncio.gather(*(cache.get_or_set_bytes('shared', 60, compute_after(0.01)) for _ in range(5)))
+        assert results == [b'1'] * 5 and len(calls) == 1
+
+    async def leader_disconnects():
+        # the leader's client went away: the follower computes the value itself instead of failing with it
+        disconnecting = compute_after(0.01, error=ClientDisconnectedError())
+        leader = asyncio.ensure_future(cache.get_or_set_bytes('disconnected', 60, disconnecting))
+        await asyncio.sleep(0)
+        follower = cache.get_or_set_bytes('disconnected', 60, compute_after(0.01, b'2'))
+        with pytest.raises(ClientDisconnectedError):
+            await leader
+        assert await follower == b'2'
+
+    async def leader_cancelled():
+        leader = asyncio.ensure_future(cache.get_or_set_bytes('cancelled', 60, compute_after(1)))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(cache.get_or_set_bytes('cancelled', 60, compute_after(0.01, b'3')))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        assert await follower == b'3'
+        assert 'cancelled' not in cache._in_flight
+
+    async def follower_cancelled():
+        # a follower that is cancelled itself does not cancel the leader
+        leader = asyncio.ensure_future(cache.get_or_set_bytes('follower', 60, compute_after(0.02, b'4')))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(cache.get_or_set_bytes('follower', 60, compute_after(0.01)))
+        await asyncio.sleep(0.01)
+        follower.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await follower
+        assert await leader == b'4'
+
+    async def errors_are_shared():
+        # other failures are not retried by every follower
+        calls.clear()
+        results = await asyncio.gather(*(cache.get_or_set_bytes('failing', 60, compute_after(0.01, error=ValueError()))
+                                         for _ in range(3)), return_exceptions=True)
+        assert all(isinstance(result, ValueError) for result in results) and len(calls) == 1
+
+    for scenario in (shared, leader_disconnects, leader_cancelled, follower_cancelled, errors_are_shared):
+        asyncio.run(scenario())
+
+
+def test_route_limiter():
+    async def scenario():
+        limiter = RouteLimiter(concurrency=1, queue_depth=1)
+        await limiter.acquire()
+        waiting = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0)
+        # one running and one waiting: the next one is shed instead of queued
+        with pytest.raises(OverloadedError) as shed:
+            await limiter.acquire()
+        assert shed.value.status_code == 429
+        limiter.release()
+        await waiting
+        limiter.release()
+        assert limiter.admitted == 0
+
+    asyncio.run(scenario())
+
+
+def test_limited_holds_streams():
+    async def chunks():
+        yield b'a'
+        yield b'b'
+
+    @limited(concurrency=1, queue_depth=0)
+    async def route(limit: int = 10):
+        return StreamingResponse(chunks())
+
+    async def scenario():
+        assert (await route(limit=MAX_LIMIT + 1)).body.startswith(b'{"Message":')
+
+        response = await route()
+        # the slot is held while the body streams
+        with pytest.raises(OverloadedError):
+            await route()
+        assert [chunk async for chunk in response.body_iterator] == [b'a', b'b']
+
+        # released when the client goes away mid-stream
+        response = await route()
+        await response.body_iterator.__anext__()
+        await response.body_iterator.aclose()
+
+        # and when the body is dropped before it starts, exactly once
+        response = await route()
+        del response
+        gc.collect()
+        response = await route()
+        assert [chunk async for chunk in response.body_iterator] == [b'a', b'b']
+        del response
+        gc.collect()
+        # a slot released twice would let a second request in
+        held = await route()
+        with pytest.raises(OverloadedError):
+            await route()
+        assert isinstance(held, StreamingResponse)
+
+    asyncio.run(scenario())
+
+
+def test_ndjson_streams_close():
+    closed = threading.Event()
+
+    def batches(fail: bool = False):
+        try:
+            if fail:
+                raise RuntimeError('query failed')
+            for i in range(3):
+                yield [{'i': i}]
+        finally:
+            closed.set()
+
+    async def scenario():
+        # a query that fails outright raises before any response is started
+        with pytest.raises(RuntimeError):
+            await ndjson_response(batches(fail=True))
+        assert closed.wait(1)
+
+        closed.clear()
+        response = await ndjson_response(batches())
+        assert b''.join([chunk async for chunk in response.body_iterator]) == b'{"i":0}\n{"i":1}\n{"i":2}\n'
+        assert closed.wait(1)
+
+        # abandoned mid-stream, e.g. by a client that went away
+        closed.clear()
+        response = await ndjson_response(batches())
+        await response.body_iterator.__anext__()
+        await response.body_iterator.aclose()
+        assert closed.wait(1)
+
+        # dropped before it started
+        closed.clear()
+        response = await ndjson_response(batches())
+        del response
+        gc.collect()
+        assert closed.wait(1)
+
+    asyncio.run(scenario())
+
+
+def test_blocking_batches_close_waits_for_fetch():
+    events = []
+
+    def batches():
+        try:
+            events.append('fetching')
+            time.sleep(0.05)
+            events.append('fetched')
+            yield [1]
+        finally:
+            events.append('closed')
+
+    async def scenario():
+        pulled = BlockingBatches(batches())
+        fetch = asyncio.ensure_future(pulled.next())
+        await asyncio.sleep(0.01)
+        # closing while the batch is still being fetched on another thread waits for it rather than failing
+        pulled.close()
+        pulled.close()
+        assert await fetch == [1]
+        for _ in range(100):
+            if 'closed' in events:
+                break
+            await asyncio.sleep(0.01)
+        assert events == ['fetching', 'fetched', 'closed']
+
+    asyncio.run(scenario())
+
+
+GRAPH_NODES = [{'_key': 'b', '_id': 'hotspots/b', 'name': 'x', 'geo_location': {'type': 'Point', 'coordinates': [1.5, 2.5]}},
+               {'_key': 'a', '_id': 'hotspots/a', 'name': 7, 'tags': {'nested': True}}]
+GRAPH_EDGES = [{'_from': 'a', '_to': 'b', 'snr': 1.5}, {'_from': 'b', '_to': 'c', 'snr': None}]
+
+
+def test_index_graph():
+    graph = index_graph(GRAPH_NODES, GRAPH_EDGES)
+    # ids follow the sorted keys, and endpoints that were not returned as nodes get one too
+    assert graph['node_keys'] == ['a', 'b', 'c']
+    assert graph['src'].tolist() == [0, 1] and graph['dst'].tolist() == [1, 2]
+    # nested values are dropped, except for geo_location which becomes lon/lat
+    assert graph['node_columns'] == {'name': [7, 'x', None], 'lon': [None, 1.5, None], 'lat': [None, 2.5, None]}
+    assert graph['edge_columns'] == {'snr': [1.5, None]}
+
+
+def test_graph_encoders():
+    import msgpack
+    import pyarrow as pa
+
+    graph = msgpack.unpackb(graph_to_msgpack(GRAPH_NODES, GRAPH_EDGES))
+    assert np.frombuffer(graph['edges']['src'], dtype='<i4').tolist() == [0, 1]
+    assert np.frombuffer(graph['edges']['dst'], dtype='<i4').tolist() == [1, 2]
+    assert graph['edges']['snr'] == [1.5, None] and graph['node_keys'] == ['a', 'b', 'c']
+
+    edges = pa.ipc.open_stream(graph_to_arrow(GRAPH_NODES, GRAPH_EDGES, 'edges')).read_all()
+    assert edges.column('src').to_pylist() == ['a', 'b'] and edges.column('dst').to_pylist() == ['b', 'c']
+    assert edges.column('src').type.index_type == pa.int32()
+    assert edges.column('snr').type == pa.float64()
+
+    nodes = pa.ipc.open_stream(graph_to_arrow(GRAPH_NODES, GRAPH_EDGES, 'nodes')).read_all()
+    assert nodes.column('id').to_pylist() == [0, 1, 2]
+    # a column mixing int and str cannot be typed, so it falls back to strings instead of failing
+    assert nodes.column('name').type == pa.string() and nodes.column('name').to_pylist() == ['7', 'x', None]
+
+
+def test_negotiate_graph_format():
+    assert negotiate_graph_format() == 'json'
+    assert negotiate_graph_format('arrow', 'application/json') == 'arrow'
+    assert negotiate_graph_format('csv') is None
+    assert negotiate_graph_format(accept='text/html, application/x-msgpack;q=0.9') == 'msgpack'
+    assert negotiate_graph_format(accept='application/vnd.apache.arrow.stream') == 'arrow'
+
+
+def test_witness_snapshot(monkeypatch):
+    hotspots = [{'_id': f'hotspots/{i}', 'address': f'h{i}'} for i in range(4)]
+    # h0 is witnessed by h1 and h2, h2 by h0. The edge to a missing hotspot is dropped
+    edges = [['hotspots/0', 'hotspots/1'], ['hotspots/2', 'hotspots/0'], ['hotspots/0', 'hotspots/2'],
+             ['hotspots/0', 'hotspots/9']]
+
+    def iter_registered(database, name, bind_vars=None, batch_size=None):
+        rows = hotspots if name == witness_graph.ALL_HOTSPOTS else edges
+        # in batches smaller than the capacity hint, so that the edge arrays have to grow
+        for i in range(0, len(rows), 2):
+            yield rows[i:i + 2]
+
+    monkeypatch.setattr(witness_graph, 'iter_registered', iter_registered)
+    snapshot = witness_graph.load_snapshot(None, {'edges': 1, 'latest': 0, 'revisions': None})
+    assert snapshot.stats()['edges'] == 3
+    assert sorted(snapshot.neighbors('h0', 'outbound').tolist()) == [1, 2]
+    assert snapshot.neighbors('h0', 'inbound').tolist() == [2]
+    assert snapshot.neighbors('h3', 'outbound').tolist() == []
+    assert snapshot.neighbors('h9') is None
+    assert snapshot.witnesses_json('h2') == b'{"witnesses":[{"_id":"hotspots/0","address":"h0"}]}'
+    # no witnesses in this direction, so the route answers with its Message
+    assert snapshot.witnesses_json('h1') is None
+
+
+def test_cells_for_hex(monkeypatch):
+    import h3
+    monkeypatch.setattr(h3_index, 'H3_RESOLUTIONS', (4, 6))
+    hex = h3.geo_to_h3(40.689306, -74.0445, 4)
+    assert h3_index.cells_for_hex(hex) == (4, [hex])
+    # a coarser hex is expanded to its children at the next stored resolution, a finer one has no cells
+    resolution, cells = h3_index.cells_for_hex(h3.h3_to_parent(hex, 3))
+    assert resolution == 4 and hex in cells and len(cells) == 7
+    resolution, cells = h3_index.cells_for_hex(h3.geo_to_h3(40.689306, -74.0445, 5))
+    assert resolution == 6 and len(cells) == 7
+    assert h3_index.cells_for_hex(h3.geo_to_h3(40.689306, -74.0445, 7)) is None
+
+
+def test_outside_distance():
+    import h3
+    lat, lon = 40.689306, -74.0445
+    origin = h3.geo_to_h3(lat, lon, 8)
+    bounds = [h3_index._outside_distance(lat, lon, origin, k) for k in range(1, 4)]
+    assert 0 < bounds[0] < bounds[1] < bounds[2]
+    for k, bound in enumerate(bounds, 1):
+        # no point of a cell outside the k-ring is closer than the bound
+        for cell in h3.hex_ring(origin, k + 1):
+            assert all(h3.point_dist((lat, lon), vertex, unit='m') >= bound for vertex in h3.h3_to_geo_boundary(cell))
+
+
+class FakeCollection:
+    def __init__(self, revision):
+        self.revision = lambda: revision
+
+
+def fake_database(**revisions):
+    return {name: FakeCollection(revisions.get(name, '1')) for name in change_feed.COLLECTIONS}
+
+
+def test_change_feed_versioned(monkeypatch):
+    monkeypatch.setattr(change_feed, 'revisions', {})
+    monkeypatch.setattr(change_feed, 'CHANGE_FEED_ACTIVE', True)
+    # unknown revisions fall back to the fixed TTL
+    assert change_feed.versioned('key', 60, change_feed.WITNESSES) == ('key', 60)
+    change_feed.poll_revisions(fake_database())
+    key, ttl = change_feed.versioned('key', 60, change_feed.WITNESSES)
+    assert key == 'key@1,1' and ttl == change_feed.CHANGE_FEED_MAX_TTL
+    assert change_feed.is_current('1,1', change_feed.WITNESSES)
+    change_feed.poll_revisions(fake_database(hotspots='2'))
+    assert change_feed.versioned('key', 60, change_feed.WITNESSES)[0] == 'key@1,2'
+    assert change_feed.versioned('key', 60, change_feed.PAYMENTS)[0] == 'key@1'
+    assert not change_feed.is_current('1,1', change_feed.WITNESSES)
+    # a failed poll forgets the revisions rather than keep entries alive on stale ones
+    with pytest.raises(KeyError):
+        change_feed.poll_revisions({})
+    assert change_feed.versioned('key', 60, change_feed.WITNESSES) == ('key', 60)
+    monkeypatch.setattr(change_feed, 'CHANGE_FEED_ACTIVE', False)
+    change_feed.poll_revisions(fake_database())
+    assert change_feed.versioned('key', 60, change_feed.WITNESSES) == ('key', 60)
+
+
+def test_when_changed(monkeypatch):
+    monkeypatch.setattr(change_feed, 'revisions', {})
+    monkeypatch.setattr(change_feed, 'CHANGE_FEED_ACTIVE', True)
+    calls = []
+    job = change_feed.when_changed(lambda: calls.append(1) or len(calls), change_feed.HOTSPOTS)
+    # without a version the job always runs
+    assert job() == 1 and job() == 2
+    change_feed.revisions['hotspots'] = '1'
+    assert job() == 3
+    assert job() is None
+    change_feed.revisions['hotspots'] = '2'
+    assert job() == 4 and len(calls) == 4
+
+
+def test_tile_bounds():
+    west, south, east, north = tile_bounds(0, 0, 0)
+    assert (west, east) == (-180, 180)
+    assert north == pytest.approx(85.0511, abs=1e-4) and south == pytest.approx(-85.0511, abs=1e-4)
+    # rows count from the north
+    assert tile_bounds(1, 0, 0) == pytest.approx((-180, 0, 0, north))
+    assert tile_bounds(1, 1, 1) == pytest.approx((0, south, 180, 0))
+    # neighbouring tiles share their edges
+    assert tile_bounds(12, 1205, 1539)[2] == tile_bounds(12, 1206, 1539)[0]
+    assert tile_bounds(12, 1205, 1539)[1] == tile_bounds(12, 1205, 1540)[3]
+    assert valid_tile(1, 1, 1) and not valid_tile(1, 2, 0) and not valid_tile(-1, 0, 0)
+
+
+def test_aggregate_indexed_cells(monkeypatch):
+    import h3
+    coordinates = [(-74.0445, 40.689306), (-74.0446, 40.6894), (-73.9, 40.8), (2.35, 48.85)]
+
+    def cell_aggregates(database, name, bind_vars, raise_if_empty=True):
+        # what the COLLECT on hotspot_cells returns
+        resolution = int(bind_vars['h3_field'][len('h3_r'):])
+        cells = {}
+        for lon, lat in coordinates:
+            cells.setdefault(h3.geo_to_h3(lat, lon, resolution), []).append((lon, lat))
+        return [[cell, sum(p[0] for p in points) / len(points), sum(p[1] for p in points) / len(points), len(points)]
+                for cell, points in cells.items()]
+
+    monkeypatch.setattr(tiles, 'run_registered', cell_aggregates)
+    monkeypatch.setattr(tiles, 'H3_RESOLUTIONS', (4, 6))
+    levels = tiles.aggregate_indexed_cells(None, {1, 4, 5})
+    # every hotspot is counted once per resolution, and rolled up centroids are weighted by count
+    for resolution in (1, 4, 5):
+        assert levels[resolution][:, 2].sum() == len(coordinates)
+    paris = levels[1][levels[1][:, 0] > 0]
+    assert paris.tolist() == [pytest.approx([2.35, 48.85, 1])]
+    new_york = levels[1][levels[1][:, 0] < 0]
+    assert new_york.tolist() == [pytest.approx([(-74.0445 - 74.0446 - 73.9) / 3, (40.689306 + 40.6894 + 40.8) / 3, 3])]
+    assert tiles.aggregate_indexed_cells(None, {7}) is None
+
+
+def test_analytics_cache_is_bounded_by_bytes(monkeypatch):
+    def load_metrics(database, graph, weight, min_time, max_time):
+        keys = np.array([f'node{i}' for i in range(100)], dtype=object)
+        return analytics.GraphMetrics(keys, np.arange(100), np.roll(np.arange(100), 1), np.ones(100), (min_time, max_time))
+
+    monkeypatch.setattr(analytics, 'load_metrics', load_metrics)
+    monkeypatch.setattr(analytics, '_results', analytics.OrderedDict())
+    size = analytics.get_metrics(None, 'payments', 'amount', 0, 3600).memory_bytes()
+    monkeypatch.setattr(analytics, 'ANALYTICS_CACHE_MAX_BYTES', 2 * size)
+    # both ends of the window are floored to the hour, and the window used is reported
+    assert analytics.get_metrics(None, 'payments', 'amount', 3599, 7300).window == (0, 7200)
+    first = analytics.get_metrics(None, 'payments', 'amount', 0, 3600)
+    assert analytics.get_metrics(None, 'payments', 'amount', 10, 3700) is first
+    analytics.get_metrics(None, 'payments', 'amount', 0, 10800)
+    # the least recently used window was evicted to stay within the budget
+    assert len(analytics._results) == 2 and analytics.get_metrics(None, 'payments', 'amount', 0, 3600) is first
+    monkeypatch.setattr(analytics, 'ANALYTICS_CACHE_MAX_BYTES', size // 2)
+    analytics.get_metrics(None, 'payments', 'amount', 0, 14400)
+    assert len(analytics._results) == 0
@@ -0,0 +1,184 @@
+"""
+Map tiles of hotspot locations, addressed by web mercator z/x/y.
+
+From TILE_POINTS_MIN_ZOOM on, a tile holds the hotspots inside it, found with the geo index. Below that, a tile holds
+per-H3-cell hotspot counts and centroids at a resolution matching the zoom. With H3_INDEX_ACTIVE, they are aggregated in AQL
+from the cells in hotspot_cells (see h3_index.py) at the nearest stored resolution, and the far fewer distinct cells are rolled
+up from there. Otherwise they are aggregated from one pass over the hotspot coordinates. The cells of every resolution are kept
+until the hotspots collection changes (see change_feed.py), or for TILE_CELLS_TTL if its revision is unknown. Since
+hotspot_cells trails the hotspots by up to H3_REFRESH_SECONDS, aggregates read from it are kept no longer than that.
+
+Tiles are packed as little-endian float32 rows: [lon, lat] for points and [lon, lat, count] for cells.
+"""
+import math
+import os
+import threading
+import time
+from typing import Optional
+import numpy as np
+from pyArango.database import Database
+from arango_queries import register_query, run_registered
+from clustering import get_coordinate_array
+from change_feed import HOTSPOTS, version, live_ttl, is_current
+from h3_index import H3_INDEX_ACTIVE, H3_RESOLUTIONS, H3_REFRESH_SECONDS, h3_field
+
+
+TILE_POINTS_MIN_ZOOM = int(os.getenv('TILE_POINTS_MIN_ZOOM', 10))
+TILE_MAX_ZOOM = 22
+TILE_MAX_POINTS = int(os.getenv('TILE_MAX_POINTS', 50000))
+TILE_CELLS_TTL = int(os.getenv('TILE_CELLS_TTL', 600))
+# zoom -> H3 resolution of the cells shown at that zoom, roughly a few cells across a 256px tile
+ZOOM_RESOLUTIONS = {0: 1, 1: 1, 2: 2, 3: 2, 4: 3, 5: 3, 6: 4, 7: 4, 8: 5, 9: 6}
+
+EXAMPLE_BOX = {'ring': [[-74.1, 40.6], [-73.9, 40.6], [-73.9, 40.8], [-74.1, 40.8], [-74.1, 40.6]], 'limit': TILE_MAX_POINTS}
+
+POINTS_IN_BOX = register_query('hotspots_in_box', """let box = GEO_POLYGON(@ring)
+    for hotspot in hotspots
+        filter GEO_CONTAINS(box, hotspot.geo_location)
+        limit @limit
+        return [hotspot.geo_location.coordinates[0], hotspot.geo_location.coordinates[1], hotspot.address]""", EXAMPLE_BOX)
+
+
+def tile_bounds(z: int, x: int, y: int) -> tuple:
+    """
+    :return: (west, south, east, north) of a web mercator tile, in degrees.
+    """
+    n = 2 ** z
+
+    def latitude(row: int) -> float:
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * row / n))))
+
+    return x / n * 360 - 180, latitude(y + 1), (x + 1) / n * 360 - 180, latitude(y)
+
+
+def valid_tile(z: int, x: int, y: int) -> bool:
+    return 0 <= z <= TILE_MAX_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+
+CELL_AGGREGATES = register_query('hotspot_cell_aggregates', """for cell in hotspot_cells
+    filter cell.@h3_field != null
+    collect h3 = cell.@h3_field aggregate count = COUNT(1), lon = AVG(cell.coordinates[0]), lat = AVG(cell.coordinates[1])
+    return [h3, lon, lat, count]""", {'h3_field': h3_field(H3_RESOLUTIONS[0])})
+
+
+def cells_ttl(ttl: int) -> int:
+    """
+    :return: ttl, capped for aggregates read from hotspot_cells, which trails the hotspots by up to H3_REFRESH_SECONDS.
+    """
+    return min(ttl, H3_REFRESH_SECONDS) if H3_INDEX_ACTIVE else ttl
+
+
+def _roll_up(cells: list, rows: np.ndarray, resolution: int) -> np.ndarray:
+    """
+    :param cells: H3 cells, all at the same resolution.
+    :param rows: Array of the [lon, lat, count] of each cell.
+    :param resolution: A resolution no finer than that of the cells.
+    :return: float32 array of [lon, lat, count] rows, one per parent cell at resolution.
+    """
+    import h3
+    if not cells or h3.h3_get_resolution(cells[0]) == resolution:
+        return rows.astype(np.float32).reshape(-1, 3)
+    _, parents = np.unique([h3.h3_to_parent(cell, resolution) for cell in cells], return_inverse=True)
+    counts = np.bincount(parents, weights=rows[:, 2])
+    return np.column_stack([np.bincount(parents, weights=rows[:, 0] * rows[:, 2]) / counts,
+                            np.bincount(parents, weights=rows[:, 1] * rows[:, 2]) / counts,
+                            counts]).astype(np.float32)
+
+
+def aggregate_cells(coordinates: np.ndarray, resolutions) -> dict:
+    """
+    Count hotspots and average their coordinates per H3 cell. Points are indexed at the finest resolution only, and coarser
+    resolutions are derived from the (far fewer) distinct cells.
+
+    :param coordinates: Array of [lon, lat] pairs.
+    :param resolutions: The H3 resolutions to aggregate at.
+    :return: Dict of resolution -> float32 array of [lon, lat, count] rows, one per cell.
+    """
+    import h3
+    finest = max(resolutions)
+    coordinates = np.asarray(coordinates, dtype=np.float64).reshape(-1, 2)
+    cells, point_cells = np.unique([h3.geo_to_h3(lat, lon, finest) for lon, lat in coordinates], return_inverse=True)
+    counts = np.bincount(point_cells, minlength=len(cells))
+    rows = np.column_stack([np.bincount(point_cells, weights=coordinates[:, 0], minlength=len(cells)) / np.maximum(counts, 1),
+                            np.bincount(point_cells, weights=coordinates[:, 1], minlength=len(cells)) / np.maximum(counts, 1),
+                            counts])
+    cells = [str(cell) for cell in cells]
+    return {resolution: _roll_up(cells, rows, resolution) for resolution in resolutions}
+
+
+def aggregate_indexed_cells(database: Database, resolutions) -> Optional[dict]:
+    """
+    Same as aggregate_cells, from the cells precomputed in hotspot_cells. Each resolution is rolled up from the nearest stored
+    one.
+
+    :param database: The pyArango Database instance.
+    :param resolutions: The H3 resolutions to aggregate at.
+    :return: Same as aggregate_cells, or None if a resolution is finer than every stored one.
+    """
+    sources = {resolution: min((r for r in H3_RESOLUTIONS if r >= resolution), default=None) for resolution in resolutions}
+    if None in sources.values():
+        return None
+    stored = {}
+    for source in set(sources.values()):
+        cells = run_registered(database, CELL_AGGREGATES, {'h3_field': h3_field(source)}, raise_if_empty=False)
+        stored[source] = ([cell[0] for cell in cells], np.array([cell[1:] for cell in cells], dtype=np.float64).reshape(-1, 3))
+    return {resolution: _roll_up(*stored[source], resolution) for resolution, source in sources.items()}
+
+
+_cells = {'levels': None, 'expires_at': 0.0, 'version': None}
+_cells_lock = threading.Lock()
+
+
+def get_cell_levels(database: Database) -> dict:
+    """
+    Get the per-cell aggregates of every resolution in ZOOM_RESOLUTIONS, rebuilding them if the hotspots have changed.
+
+    :param database: The pyArango Database instance.
+    :return: Same as aggregate_cells.
+    """
+    with _cells_lock:
+        if _cells['levels'] is None or time.monotonic() > _cells['expires_at'] or not is_current(_cells['version'], HOTSPOTS):
+            entry_version = version(HOTSPOTS)
+            resolutions = set(ZOOM_RESOLUTIONS.values())
+            levels = aggregate_indexed_cells(database, resolutions) if H3_INDEX_ACTIVE else None
+            ttl = live_ttl(TILE_CELLS_TTL, entry_version)
+            if levels is None:
+                levels = aggregate_cells(get_coordinate_array(database), resolutions)
+            else:
+                ttl = cells_ttl(ttl)
+            _cells['levels'] = levels
+            _cells['expires_at'] = time.monotonic() + ttl
+            _cells['version'] = entry_version
+        return _cells['levels']
+
+
+def get_tile(database: Database, z: int, x: int, y: int) -> tuple:
+    """
+    Get the contents of a tile.
+
+    :param database: The pyArango Database instance.
+    :param z: The zoom level.
+    :param x: The tile column.
+    :param y: The tile row, from the north.
+    :return: (kind, rows, addresses): 'points' or 'cells', the float32 rows of the tile, and the address of each point (None
+        for cells).
+    """
+    west, south, east, north = tile_bounds(z, x, y)
+    if z >= TILE_POINTS_MIN_ZOOM:
+        ring = [[west, south], [east, south], [east, north], [west, north], [west, south]]
+        points = run_registered(database, POINTS_IN_BOX, {'ring': ring, 'limit': TILE_MAX_POINTS}, raise_if_empty=False)
+        rows = np.array([point[:2] for point in points], dtype=np.float32).reshape(-1, 2)
+        return 'points', rows, [point[2] for point in points]
+    cells = get_cell_levels(database)[ZOOM_RESOLUTIONS[z]]
+    in_tile = (cells[:, 0] >= west) & (cells[:, 0] < east) & (cells[:, 1] >= south) & (cells[:, 1] < north)
+    return 'cells', cells[in_tile], None
+
+
+def tile_json(kind: str, rows: np.ndarray, addresses: Optional[list]) -> dict:
+    coordinates = np.round(rows[:, :2].astype(np.float64), 6)
+    tile = {'kind': kind, 'lon': coordinates[:, 0].tolist(), 'lat': coordinates[:, 1].tolist()}
+    if kind == 'points':
+        tile['address'] = addresses
+    else:
+        tile['count'] = rows[:, 2].astype(np.int64).tolist()
+    return tile
@@ -0,0 +1,141 @@
+"""
+Time windows that are aware of which data can still change.
+
+Blocks are only appended near the chain head, so a window that ended more than IMMUTABLE_AFTER_SECONDS before the latest
+payment/receipt ingested by the ETL always returns the same result, and can be cached for HISTORICAL_CACHE_TTL. The ingested
+high-water mark is polled from Arango (see arango_queries.update_ingested_time) rather than taken from the wall clock, so a
+lagging or catching-up ETL never gets incomplete windows cached as final. Until it is known, no window is historical.
+
+A window that runs up to now is split at a historical boundary: the historical part is cached like any other immutable window,
+and only the short live tail past the boundary is queried per request.
+"""
+import os
+import time
+from typing import NamedTuple, Optional
+
+
+# payments/receipts older than this are assumed to be final, i.e. the ETL never writes rows this far behind its latest one
+IMMUTABLE_AFTER_SECONDS = int(os.getenv('IMMUTABLE_AFTER_SECONDS', 3600))
+# long, but finite, so that the keyspace of arbitrary historical windows does not grow forever (e.g. in Redis)
+HISTORICAL_CACHE_TTL = int(os.getenv('HISTORICAL_CACHE_TTL', 7 * 86400))
+INGESTED_POLL_SECONDS = int(os.getenv('INGESTED_POLL_SECONDS', 10))
+# the historical boundary of an "up to now" window moves in steps of this size, so requests share its historical part
+HISTORICAL_BUCKET_SECONDS = int(os.getenv('HISTORICAL_BUCKET_SECONDS', 3600))
+# the max number of groups fetched from the live tail. If the tail has more, the window is not split
+LIVE_TAIL_MAX_GROUPS = int(os.getenv('LIVE_TAIL_MAX_GROUPS', 10000))
+# the top-N of the historical part is fetched at least this deep, and in powers of two, so that nearby limits share an entry
+MIN_HISTORICAL_DEPTH = 128
+
+
+# the latest payment/receipt time written by the ETL, or None until it has been polled
+_ingested = {'time': None}
+
+
+def now() -> int:
+    return int(time.time())
+
+
+def set_ingested_time(latest: Optional[int]):
+    """
+    :param latest: The latest payment/receipt time in Arango. Only ever moves forward.
+    """
+    if latest is not None and (_ingested['time'] is None or latest > _ingested['time']):
+        _ingested['time'] = latest
+
+
+def immutable_before() -> Optional[int]:
+    """
+    :return: The time before which no more rows can be written, or None if the ingested high-water mark is not known yet.
+    """
+    if _ingested['time'] is None:
+        return None
+    return min(_ingested['time'], now()) - IMMUTABLE_AFTER_SECONDS
+
+
+def resolve_max_time(max_time: Optional[int]) -> int:
+    """
+    :param max_time: A maximum UTC timestamp, or None for "up to now".
+    :return: The timestamp to query with. Evaluated per call, never at import time.
+    """
+    return now() if max_time is None else max_time
+
+
+def is_historical(max_time: Optional[int]) -> bool:
+    """
+    :param max_time: The maximum UTC timestamp of a window, or None for "up to now".
+    :return: True if no more rows can be written into the window.
+    """
+    boundary = immutable_before()
+    return max_time is not None and boundary is not None and max_time <= boundary
+
+
+def historical_boundary(min_time: int, max_time: Optional[int]) -> Optional[int]:
+    """
+    Find where to split a window into an immutable historical part, (min_time, boundary), and a live tail, [boundary,
+    max_time).
+
+    :param min_time: The minimum UTC timestamp of the window.
+    :param max_time: The maximum UTC timestamp of the window, or None for "up to now".
+    :return: The boundary, or None if the window is entirely historical or entirely live.
+    """
+    boundary = immutable_before()
+    if boundary is None or is_historical(max_time):
+        return None
+    boundary -= boundary % HISTORICAL_BUCKET_SECONDS
+    if boundary <= min_time + 1:
+        return None
+    return boundary
+
+
+def historical_depth(n: int) -> int:
+    depth = MIN_HISTORICAL_DEPTH
+    while depth < 2 * n:
+        depth *= 2
+    return depth
+
+
+class TopSpec(NamedTuple):
+    """
+    How to merge the rows of a top-N aggregation: rows are grouped on key_fields, and value_fields are summed and sorted by
+    sort_by.
+    """
+    key_fields: tuple
+    value_fields: tuple
+    sort_by: str
+
+
+def merge_top(spec: TopSpec, n: int, historical: list, historical_complete: bool, tail: list) -> Optional[list]:
+    """
+    Merge the top rows of the historical part of a window with every row of its live tail.
+
+    Groups outside the historical top-k have a historical value no larger than the k-th one, so the merge is exact as long as
+    the n-th merged value is at least that bound plus the largest tail value of any group outside the historical top-k. Values
+    must be non-negative.
+
+    :param spec: How rows are grouped and sorted.
+    :param n: The number of rows to return.
+    :param historical: The top-k rows of the historical part, sorted by spec.sort_by descending.
+    :param historical_complete: True if the historical part has no more than these rows.
+    :param tail: Every row of the live tail.
+    :return: The top-n rows of the whole window, or None if they cannot be determined exactly from these parts.
+    """
+    def key(row):
+        return tuple(row[f] for f in spec.key_fields)
+
+    merged = {key(row): dict(row) for row in historical}
+    # the largest tail value of a group outside the historical top-k, whose historical value is unknown (but at most the k-th)
+    outside_bound = 0
+    for row in tail:
+        current = merged.get(key(row))
+        if current is not None:
+            for field in spec.value_fields:
+                current[field] += row[field]
+        elif historical_complete:
+            merged[key(row)] = dict(row)
+        else:
+            outside_bound = max(outside_bound, row[spec.sort_by])
+    rows = sorted(merged.values(), key=lambda row: row[spec.sort_by], reverse=True)[:n]
+    if not historical_complete:
+        if len(rows) < n or rows[-1][spec.sort_by] < historical[-1][spec.sort_by] + outside_bound:
+            return None
+    return rows
@@ -0,0 +1,155 @@
+"""
+Multi-hop, time-bounded traversals over the payment and witness graphs.
+
+Traversals are breadth-first, one query per level. Each level expands the whole frontier in a single round trip and keeps only
+the top fan_out neighbors of each node, by amount (payments) or snr (witnesses). Vertices are visited at most once across the
+whole traversal, and the node and edge budgets cap the size of the result. Each node reads at most MAX_EDGES_SCANNED_PER_NODE
+of its edges per level, before they are filtered on time and on visited vertices, so a hub costs the same however many of its
+edges are skipped.
+"""
+import os
+from pyArango.database import Database
+from pyArango.theExceptions import AQLFetchError
+from time_windows import resolve_max_time
+from arango_queries import register_query, run_registered, _node_fields, NODE_PROJECTION, EXAMPLE_ACCOUNT, EXAMPLE_HOTSPOT, \
+    EXAMPLE_TIME_WINDOW
+
+
+DIRECTIONS = ('outbound', 'inbound', 'any')
+MAX_TRAVERSAL_DEPTH = int(os.getenv('MAX_TRAVERSAL_DEPTH', 4))
+MAX_TRAVERSAL_NODES = int(os.getenv('MAX_TRAVERSAL_NODES', 5000))
+MAX_TRAVERSAL_EDGES = int(os.getenv('MAX_TRAVERSAL_EDGES', 20000))
+# the most edges read from any one node per level, so that exchanges and other hubs cannot blow up the cost of a level. Hubs
+# are expanded from the first edges read, so their neighbors may be a sample rather than the true top fan_out
+MAX_EDGES_SCANNED_PER_NODE = int(os.getenv('MAX_EDGES_SCANNED_PER_NODE', 10000))
+
+EXAMPLE_LEVEL = {**EXAMPLE_TIME_WINDOW, 'frontier': [f'accounts/{EXAMPLE_ACCOUNT}'],
+                 'visited': {f'accounts/{EXAMPLE_ACCOUNT}': True}, 'max_scanned': MAX_EDGES_SCANNED_PER_NODE, 'fan_out': 10,
+                 'max_edges': 100}
+
+# the AQL direction keyword cannot be a bind variable, so every direction gets its own registered query
+PAYMENT_LEVELS = {direction: register_query(f'payment_traversal_level_{direction}', f"""for node in @frontier
+    for edge in (for v, e in 1..1 {direction.upper()} node payments
+            limit @max_scanned
+            filter e.time > @min_time and e.time < @max_time and not HAS(@visited, v._id)
+            collect from = e._from, to = e._to aggregate payment_total = SUM(e.amount), payment_count = COUNT(1)
+            sort payment_total desc
+            limit @fan_out
+            return {{_from: from, _to: to, total_amount: payment_total, num_payments: payment_count}})
+        sort edge.total_amount desc
+        limit @max_edges
+        return edge""", EXAMPLE_LEVEL) for direction in DIRECTIONS}
+
+WITNESS_LEVELS = {direction: register_query(f'witness_traversal_level_{direction}', f"""for node in @frontier
+    for edge in (for v, e in 1..1 {direction.upper()} node witnesses
+            limit @max_scanned
+            filter e.time > @min_time and e.time < @max_time and not HAS(@visited, v._id)
+            collect from = e._from, to = e._to
+                aggregate best_snr = MAX(e.snr), best_rssi = MAX(e.signal), receipt_count = COUNT(1)
+            sort best_snr desc
+            limit @fan_out
+            return {{_from: from, _to: to, snr: best_snr == null ? null : ROUND(best_snr * 10) / 10, rssi: best_rssi,
+                     num_receipts: receipt_count}})
+        sort edge.snr desc
+        limit @max_edges
+        return edge""", {**EXAMPLE_LEVEL, 'frontier': [], 'visited': {}}) for direction in DIRECTIONS}
+
+HOTSPOT_IDS = register_query('hotspot_ids', """for hotspot in hotspots
+    filter hotspot.address == @address
+    return hotspot._id""", {'address': EXAMPLE_HOTSPOT})
+
+NODES_BY_ID = register_query('nodes_by_id', """for id in @ids
+    return """ + NODE_PROJECTION, {'ids': [f'accounts/{EXAMPLE_ACCOUNT}'], 'fields': None})
+
+
+def traverse(database: Database, level_query: str, start_ids: list, depth: int, min_time: int, max_time: int, fan_out: int,
+             max_nodes: int, max_edges: int, fields: list = None) -> tuple:
+    """
+    Breadth-first traversal with a per-level fan-out cap and global node/edge budgets.
+
+    :param database: The pyArango Database instance.
+    :param level_query: The registered name of the query that expands one level, e.g. PAYMENT_LEVELS['outbound'].
+    :param start_ids: The _ids of the starting vertices.
+    :param depth: The max number of hops from the starting vertices.
+    :param min_time: The minimum UTC timestamp of edges to follow.
+    :param max_time: The maximum UTC timestamp of edges to follow.
+    :param fan_out: The max number of new neighbors to expand from each node, per level.
+    :param max_nodes: The max number of nodes in the result, including the starting vertices.
+    :param max_edges: The max number of edges in the result.
+    :param fields: (optional) the node fields to include in each node. Defaults to the full document.
+    :return: (nodes, edges) lists of the graph. Each edge has the level (hop) at which it was found.
+    """
+    max_time = resolve_max_time(max_time)
+    visited = list(start_ids)
+    # passed to the level queries as an object, so that each edge is checked with a hash lookup rather than a scan of a list
+    visited_set = dict.fromkeys(visited, True)
+    frontier = list(start_ids)
+    edges = []
+    for level in range(1, depth + 1):
+        if not frontier or len(edges) >= max_edges or len(visited) >= max_nodes:
+            break
+        bind_vars = {'frontier': frontier, 'visited': visited_set, 'min_time': min_time, 'max_time': max_time,
+                     'fan_out': fan_out, 'max_scanned': MAX_EDGES_SCANNED_PER_NODE, 'max_edges': max_edges - len(edges)}
+        level_edges = run_registered(database, level_query, bind_vars, raise_if_empty=False)
+        # the endpoint of each edge that had not been visited before this level is its new neighbor
+        previously_visited = set(visited_set)
+        frontier = []
+        for edge in level_edges:
+            neighbor = edge['_from'] if edge['_to'] in previously_visited else edge['_to']
+            if neighbor not in visited_set:
+                if len(visited) >= max_nodes:
+                    continue
+                visited.append(neighbor)
+                visited_set[neighbor] = True
+                frontier.append(neighbor)
+            edges.append({**edge, '_from': edge['_from'].split('/')[-1], '_to': edge['_to'].split('/')[-1], 'level': level})
+    if not edges:
+        raise AQLFetchError('No results matched for query.')
+    nodes = run_registered(database, NODES_BY_ID, {'ids': visited, 'fields': _node_fields(fields)})
+    return nodes, edges
+
+
+def get_payment_traversal(database: Database, address: str, depth: int = 2, direction: str = 'outbound', min_time: int = 0,
+                          max_time: int = None, fan_out: int = 10, max_nodes: int = 500,
+                          max_edges: int = 2000, fields: list = None) -> tuple:
+    """
+    Follow the flow of tokens from (or to) an account for several hops.
+
+    :param database: The pyArango Database instance.
+    :param address: The HNT wallet address to start from.
+    :param depth: The max number of hops.
+    :param direction: 'outbound' to follow payments made, 'inbound' to follow payments received, or 'any'.
+    :param min_time: The minimum UTC timestamp to consider.
+    :param max_time: The maximum UTC timestamp to consider.
+    :param fan_out: The max number of counterparties to expand from each account, by total amount.
+    :param max_nodes: The max number of accounts in the graph.
+    :param max_edges: The max number of (payer, payee) edges in the graph.
+    :param fields: (optional) the account fields to include in each node. Defaults to the full document.
+    :return: (nodes, edges) lists of the graph.
+    """
+    return traverse(database, PAYMENT_LEVELS[direction], [f'accounts/{address}'], depth, min_time, max_time, fan_out,
+                    max_nodes, max_edges, fields)
+
+
+def get_witness_traversal(database: Database, address: str, depth: int = 2, direction: str = 'outbound', min_time: int = 0,
+                          max_time: int = None, fan_out: int = 10, max_nodes: int = 500,
+                          max_edges: int = 2000, fields: list = None) -> tuple:
+    """
+    Get the witness neighborhood of a hotspot, several hops deep.
+
+    :param database: The pyArango Database instance.
+    :param address: The hotspot address to start from.
+    :param depth: The max number of hops.
+    :param direction: 'outbound' to follow the hotspots that witnessed each hotspot, 'inbound' for the hotspots each one
+        witnessed, or 'any'.
+    :param min_time: The minimum UTC timestamp of receipts to consider.
+    :param max_time: The maximum UTC timestamp of receipts to consider.
+    :param fan_out: The max number of witnesses to expand from each hotspot, by snr.
+    :param max_nodes: The max number of hotspots in the graph.
+    :param max_edges: The max number of edges in the graph.
+    :param fields: (optional) the hotspot fields to include in each node. Defaults to the full document.
+    :return: (nodes, edges) lists of the graph.
+    """
+    start_ids = run_registered(database, HOTSPOT_IDS, {'address': address})
+    return traverse(database, WITNESS_LEVELS[direction], start_ids, depth, min_time, max_time, fan_out, max_nodes, max_edges,
+                    fields)
@@ -1,13 +1,48 @@
-from sklearn.cluster import KMeans
-from typing import List
+import numpy as np
+from typing import List, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from sklearn.cluster import MiniBatchKMeans
+
+
+CLUSTER_BATCH_SIZE = 4096
+
+
+def fit_cluster_model(data, n_clusters: int, init: np.ndarray = None) -> tuple['MiniBatchKMeans', float]:
+    """
+    Fit a MiniBatchKMeans model to a dataset, optionally warm-started from previous cluster centers.
+    :param data: Array-like of [lon, lat] pairs.
+    :param n_clusters: The number of clusters.
+    :param init: (optional) the cluster centers of a previous fit to start from.
+    :return: The fitted model and its inertia.
+    """
+    # sklearn takes over a second to import, so only the processes that fit models pay for it
+    from sklearn.cluster import MiniBatchKMeans
+    model = MiniBatchKMeans(n_clusters, init='k-means++' if init is None else init, n_init=1, batch_size=CLUSTER_BATCH_SIZE,
+                            random_state=0)
+    model.fit(np.asarray(data, dtype=np.float32))
+    return model, model.inertia_
+
+
+def update_cluster_model(model: 'MiniBatchKMeans', data, new_data) -> tuple['MiniBatchKMeans', float]:
+    """
+    Incrementally update a fitted model with newly added points.
+    :param model: A fitted MiniBatchKMeans model.
+    :param data: Array-like of all [lon, lat] pairs, used to recompute the inertia.
+    :param new_data: Array-like of the [lon, lat] pairs added since the model was last fitted or updated.
+    :return: The updated model and its inertia over the full dataset.
+    """
+    if len(new_data):
+        model.partial_fit(np.asarray(new_data, dtype=np.float32))
+    return model, -model.score(np.asarray(data, dtype=np.float32))
 
 
 def get_cluster_centers(data, n_clusters: int) -> tuple[List[list], float]:
     """
     Identify cluster centers from dataset. Useful for finding city centers from list of hotspot coordinates.
-    :param data:
-    :param n_clusters:
-    :return:
+    :param data: Array-like of [lon, lat] pairs.
+    :param n_clusters: The number of clusters.
+    :return: The cluster centers and the inertia of the fit.
     """
-    model = KMeans(n_clusters).fit(data)
-    return model.cluster_centers_.tolist(), model.inertia_
\ No newline at end of file
+    model, inertia = fit_cluster_model(data, n_clusters)
+    return model.cluster_centers_.tolist(), float(inertia)
@@ -0,0 +1,171 @@
+"""
+An in-memory snapshot of the witness graph, for answering hotspot adjacency lookups without a round trip to Arango.
+
+Edges are held in compressed sparse row (CSR) form in both directions: indptr/indices arrays over integer hotspot ids. Hotspot
+documents are stored pre-serialized, so a response is just a join of byte strings.
+
+Every worker process loads its own snapshot, so the memory it takes is multiplied by WEB_CONCURRENCY. Each one holds about 8
+bytes per witness edge (an int32 id in each direction, twice that while it is built) plus the serialized hotspot documents,
+roughly 1 KB per hotspot. /witnesses/snapshot/stats reports the actual size.
+"""
+import os
+import sys
+import time
+import logging
+import numpy as np
+import orjson
+from typing import Optional
+from pyArango.database import Database
+from arango_queries import register_query, run_registered, iter_registered
+import change_feed
+
+
+WITNESS_SNAPSHOT_ACTIVE = os.getenv('WITNESS_SNAPSHOT_ACTIVE', '').lower() in ('1', 'true')
+WITNESS_SNAPSHOT_REFRESH_SECONDS = int(os.getenv('WITNESS_SNAPSHOT_REFRESH_SECONDS', 600))
+SNAPSHOT_BATCH_SIZE = 10000
+
+logger = logging.getLogger(__name__)
+
+
+class WitnessGraphSnapshot:
+    def __init__(self, addresses: list, documents: list, src: np.ndarray, dst: np.ndarray, version: dict):
+        """
+        Build the CSR adjacency from edge arrays.
+
+        :param addresses: Hotspot address of each id.
+        :param documents: orjson-serialized hotspot document of each id.
+        :param src: int32 id of the challengee (the edge's _from) of each edge.
+        :param dst: int32 id of the witness (the edge's _to) of each edge.
+        :param version: The version of the collections the snapshot was built from, see current_version.
+        """
+        self.addresses = addresses
+        self.documents = documents
+        self.ids = {address: i for i, address in enumerate(addresses)}
+        self.version = version
+        self.created_at = time.time()
+        self.outbound = self._csr(src, dst, len(addresses))
+        self.inbound = self._csr(dst, src, len(addresses))
+
+    @staticmethod
+    def _csr(rows: np.ndarray, columns: np.ndarray, n: int) -> dict:
+        order = np.argsort(rows, kind='stable')
+        indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=n), out=indptr[1:])
+        return {'indptr': indptr, 'indices': columns[order]}
+
+    def neighbors(self, address: str, direction: str = 'outbound') -> Optional[np.ndarray]:
+        """
+        Get the adjacent hotspots of a hotspot.
+
+        :param address: The hotspot address.
+        :param direction: 'outbound' for the hotspots that witnessed this one, 'inbound' for the hotspots it witnessed.
+        :return: The ids of the adjacent hotspots (one per edge), or None if the hotspot is not in the snapshot.
+        """
+        i = self.ids.get(address)
+        if i is None:
+            return None
+        csr = self.outbound if direction == 'outbound' else self.inbound
+        start, end = csr['indptr'][i], csr['indptr'][i + 1]
+        return csr['indices'][start:end]
+
+    def witnesses_json(self, address: str, direction: str = 'outbound') -> Optional[bytes]:
+        """
+        Same response body as the /hotspots/{address}/outbound and /inbound routes, assembled from the snapshot.
+
+        :param address: The hotspot address.
+        :param direction: 'outbound' or 'inbound'.
+        :return: The JSON body, or None if the hotspot has no witnesses in this direction.
+        """
+        neighbors = self.neighbors(address, direction)
+        if neighbors is None or len(neighbors) == 0:
+            return None
+        return b'{"witnesses":[' + b','.join(self.documents[j] for j in neighbors) + b']}'
+
+    def stats(self) -> dict:
+        array_bytes = sum(array.nbytes for csr in (self.outbound, self.inbound) for array in csr.values())
+        document_bytes = sum(sys.getsizeof(document) for document in self.documents)
+        index_bytes = sys.getsizeof(self.ids) + sum(sys.getsizeof(address) for address in self.addresses)
+        return {
+            'hotspots': len(self.addresses),
+            'edges': len(self.outbound['indices']),
+            'memory_bytes': {'arrays': array_bytes, 'documents': document_bytes, 'index': index_bytes,
+                             'total': array_bytes + document_bytes + index_bytes},
+            'created_at': int(self.created_at),
+            'age_seconds': round(time.time() - self.created_at, 1),
+            'version': self.version
+        }
+
+
+WITNESSES_VERSION = register_query('witnesses_version', """RETURN {
+        edges: LENGTH(witnesses),
+        latest: FIRST(for witness in witnesses sort witness.time desc limit 1 return witness.time)
+    }""")
+
+ALL_HOTSPOTS = register_query('all_hotspots', """for hotspot in hotspots
+    return hotspot""")
+
+ALL_WITNESS_EDGES = register_query('all_witness_edges', """for witness in witnesses
+    return [witness._from, witness._to]""")
+
+
+def current_version(database: Database) -> dict:
+    """
+    :param database: The pyArango Database instance.
+    :return: The WITNESSES_VERSION of the collections, plus the change_feed revisions of both witnesses and hotspots if known.
+        Without the revisions, changes to hotspots alone (e.g. a hotspot asserting a new location) are only picked up with the
+        next witness.
+    """
+    return {**run_registered(database, WITNESSES_VERSION)[0], 'revisions': change_feed.version(change_feed.WITNESSES)}
+
+
+def load_snapshot(database: Database, version: dict = None) -> WitnessGraphSnapshot:
+    """
+    Read the hotspots and witnesses collections into a new snapshot.
+
+    :param database: The pyArango Database instance.
+    :param version: (optional) the current version, see current_version, if already known.
+    :return: The snapshot.
+    """
+    version = version or current_version(database)
+    addresses, documents, ids = [], [], {}
+    for batch in iter_registered(database, ALL_HOTSPOTS, batch_size=SNAPSHOT_BATCH_SIZE):
+        for hotspot in batch:
+            ids[hotspot['_id']] = len(addresses)
+            addresses.append(hotspot['address'])
+            documents.append(orjson.dumps(hotspot))
+
+    # filled in place batch by batch, so the edges are never held as Python objects. The edge count is only a hint, since the
+    # collection can grow while it is read
+    capacity = max(version['edges'] or 0, SNAPSHOT_BATCH_SIZE)
+    src, dst = np.empty(capacity, dtype=np.int32), np.empty(capacity, dtype=np.int32)
+    n = 0
+    for batch in iter_registered(database, ALL_WITNESS_EDGES, batch_size=SNAPSHOT_BATCH_SIZE):
+        batch_src = np.fromiter((ids.get(edge[0], -1) for edge in batch), dtype=np.int32, count=len(batch))
+        batch_dst = np.fromiter((ids.get(edge[1], -1) for edge in batch), dtype=np.int32, count=len(batch))
+        # edges to hotspots that are missing from the collection are dropped, as the traversal would not return them either
+        keep = (batch_src >= 0) & (batch_dst >= 0)
+        kept = int(np.count_nonzero(keep))
+        if n + kept > capacity:
+            capacity = max(2 * capacity, n + kept)
+            src, dst = np.resize(src, capacity), np.resize(dst, capacity)
+        src[n:n + kept] = batch_src[keep]
+        dst[n:n + kept] = batch_dst[keep]
+        n += kept
+    return WitnessGraphSnapshot(addresses, documents, src[:n].copy(), dst[:n].copy(), version)
+
+
+snapshot: Optional[WitnessGraphSnapshot] = None
+
+
+def refresh_snapshot(database: Database):
+    """
+    Rebuild the snapshot if the witnesses or hotspots collections have changed since it was taken, see current_version.
+
+    :param database: The pyArango Database instance.
+    """
+    global snapshot
+    version = current_version(database)
+    if snapshot is not None and snapshot.version == version:
+        return
+    snapshot = load_snapshot(database, version)
+    logger.info(f'Loaded witness graph snapshot: {snapshot.stats()}')
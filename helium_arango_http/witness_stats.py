@@ -0,0 +1,126 @@
+"""
+Witness statistics of a hotspot or an H3 hex: receipt counts, plus SNR, RSSI and distance distributions as histograms and
+quantiles.
+
+Receipts in the window are streamed from Arango as [snr, rssi, distance_m, counterpart] rows and summarized in a single NumPy
+pass, so a dashboard tile gets one small response instead of the raw receipts.
+"""
+import numpy as np
+from pyArango.database import Database
+from pyArango.theExceptions import AQLFetchError
+from arango_queries import register_query, iter_registered, EXAMPLE_HOTSPOT, EXAMPLE_TIME_WINDOW, EXAMPLE_POLYGON
+from h3_index import H3_INDEX_ACTIVE, EXAMPLE_CELLS, cells_for_hex, h3_field
+from time_windows import resolve_max_time
+
+
+DIRECTIONS = ('outbound', 'inbound')
+STATS_BATCH_SIZE = 10000
+QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+# histogram bin edges. Values outside the range are counted in the first or last bin
+HISTOGRAM_BINS = {
+    'snr': np.arange(-20, 32, 2),
+    'rssi': np.arange(-140, -35, 5),
+    'distance_m': np.array([0, 500, 1000, 2000, 5000, 10000, 20000, 50000, 100000])
+}
+
+# the hotspot is the challengee of outbound receipts (witnessed by others), and the witness of inbound receipts
+RECEIPT_ROW = """filter e.time > @min_time and e.time < @max_time
+            return [e.snr, e.signal, GEO_DISTANCE(hotspot.geo_location, v.geo_location), v._key]"""
+
+RECEIPTS_OF_HOTSPOT = {direction: register_query(f'witness_stats_of_hotspot_{direction}', f"""for hotspot in hotspots
+    filter hotspot.address == @address
+    for v, e in 1..1 {direction} hotspot witnesses
+        {RECEIPT_ROW}""", {**EXAMPLE_TIME_WINDOW, 'address': EXAMPLE_HOTSPOT}) for direction in DIRECTIONS}
+
+RECEIPTS_IN_HEX = {direction: register_query(f'witness_stats_in_hex_{direction}', f"""let hex_poly = GEO_POLYGON(@poly_list)
+    for hotspot in hotspots
+        filter GEO_CONTAINS(hex_poly, hotspot.geo_location)
+        for v, e in 1..1 {direction} hotspot witnesses
+            {RECEIPT_ROW}""", {**EXAMPLE_TIME_WINDOW, 'poly_list': EXAMPLE_POLYGON})
+                   for direction in DIRECTIONS}
+
+RECEIPTS_IN_CELLS = {direction: register_query(f'witness_stats_in_h3_cells_{direction}', f"""for cell in hotspot_cells
+    filter cell.@h3_field in @cells
+    for v, e in 1..1 {direction} CONCAT('hotspots/', cell._key) witnesses
+        {RECEIPT_ROW}""", {**EXAMPLE_TIME_WINDOW, **EXAMPLE_CELLS}) for direction in DIRECTIONS}
+
+
+def distribution(values: np.ndarray, bins: np.ndarray) -> dict:
+    """
+    Summarize one column of receipts.
+
+    :param values: The values, with NaN for missing ones.
+    :param bins: The histogram bin edges.
+    :return: Dict of count, mean, quantiles and histogram.
+    """
+    values = values[~np.isnan(values)]
+    if not len(values):
+        return {'count': 0, 'mean': None, 'quantiles': None, 'histogram': None}
+    counts, _ = np.histogram(np.clip(values, bins[0], bins[-1]), bins)
+    return {
+        'count': len(values),
+        'mean': round(float(values.mean()), 2),
+        'quantiles': {str(q): round(float(v), 2) for q, v in zip(QUANTILES, np.quantile(values, QUANTILES))},
+        'histogram': {'bins': bins.tolist(), 'counts': counts.tolist()}
+    }
+
+
+def summarize(database: Database, query: str, bind_vars: dict) -> dict:
+    """
+    Stream receipt rows from a query and summarize them.
+
+    :param database: The pyArango Database instance.
+    :param query: The registered name of a query returning [snr, rssi, distance_m, counterpart] rows.
+    :param bind_vars: Bind variables for the query.
+    :return: Dict of receipt and counterpart counts, and the distribution of each column.
+    """
+    columns, counterparts = [], set()
+    for batch in iter_registered(database, query, bind_vars, batch_size=STATS_BATCH_SIZE):
+        columns.append(np.array([row[:3] for row in batch], dtype=np.float64))
+        counterparts.update(row[3] for row in batch)
+    receipts = np.concatenate(columns) if columns else np.empty((0, 3))
+    if not len(receipts):
+        raise AQLFetchError('No results matched for query.')
+    return {
+        'receipts': len(receipts),
+        'hotspots': len(counterparts),
+        **{name: distribution(receipts[:, i], HISTOGRAM_BINS[name]) for i, name in enumerate(HISTOGRAM_BINS)}
+    }
+
+
+def get_hotspot_witness_stats(database: Database, address: str, direction: str = 'outbound', min_time: int = 0,
+                              max_time: int = None) -> dict:
+    """
+    Get the witness statistics of a hotspot.
+
+    :param database: The pyArango Database instance.
+    :param address: The hotspot address.
+    :param direction: 'outbound' for the receipts of hotspots that witnessed this one, 'inbound' for the ones it witnessed.
+    :param min_time: The minimum UTC timestamp of receipts to consider.
+    :param max_time: The maximum UTC timestamp of receipts to consider.
+    :return: Dict of receipt and counterpart counts, and the snr, rssi and distance_m distributions.
+    """
+    bind_vars = {'address': address, 'min_time': min_time, 'max_time': resolve_max_time(max_time)}
+    return summarize(database, RECEIPTS_OF_HOTSPOT[direction], bind_vars)
+
+
+def get_hex_witness_stats(database: Database, hex: str, direction: str = 'outbound', min_time: int = 0,
+                          max_time: int = None) -> dict:
+    """
+    Get the witness statistics of every hotspot in a hex, using the precomputed H3 cells if available.
+
+    :param database: The pyArango Database instance.
+    :param hex: An h3 hex.
+    :param direction: 'outbound' for the receipts of hotspots in the hex being witnessed, 'inbound' for those they witnessed.
+    :param min_time: The minimum UTC timestamp of receipts to consider.
+    :param max_time: The maximum UTC timestamp of receipts to consider.
+    :return: Same as get_hotspot_witness_stats.
+    """
+    window = {'min_time': min_time, 'max_time': resolve_max_time(max_time)}
+    lookup = cells_for_hex(hex) if H3_INDEX_ACTIVE else None
+    if lookup is not None:
+        resolution, cells = lookup
+        return summarize(database, RECEIPTS_IN_CELLS[direction], {**window, 'h3_field': h3_field(resolution), 'cells': cells})
+    import h3
+    poly_list = [list(p) for p in h3.h3_to_geo_boundary(hex, geo_json=True)]
+    return summarize(database, RECEIPTS_IN_HEX[direction], {**window, 'poly_list': poly_list})